@@ -15,6 +15,7 @@ import os
 import optparse
 import string
 import sys
+import time
 import traceback
 import zipfile
 import platform
@@ -59,7 +60,9 @@ class LeoApp:
         self.start_fullscreen = False   # For qt_frame plugin.
         self.start_maximized = False    # For qt_frame plugin.
         self.start_minimized = False    # For qt_frame plugin.
+        self.trace_hooks = False        # True: profile hook handlers and report on exit.
         self.trace_plugins = False      # True: trace imports of plugins.
+        self.trace_startup_times = False # True: report the time taken by each startup phase.
         self.translateToUpperCase = False # Never set to True.
         self.useIpython = False         # True: add support for IPython.
         self.use_psyco = False          # True: use psyco optimization.
@@ -107,6 +110,7 @@ class LeoApp:
         # Global controller/manager objects...
         self.config = None              # The singleton leoConfig instance.
         self.db = None                  # The singleton leoCacher instance.
+        self.fileWatcher = None         # The singleton FileWatcher instance, or None.
         self.loadManager = None         # The singleton LoadManager instance.
         # self.logManager = None        # The singleton LogManager instance.
         # self.openWithManager = None   # The singleton OpenWithManager instance.
@@ -169,6 +173,7 @@ class LeoApp:
         # Support for scripting...
         self.searchDict = {}          # For communication between find/change scripts.
         self.scriptDict = {}          # For use by scripts. Cleared before running each script.
+        self.scriptCache = g.ScriptCache() # Used by g.getScript and c.executeScript.
         self.scriptResult = None      # For use by leoPymacs.
         self.permanentScriptDict = {} # For use by scrips. Never cleared automatically.
 
@@ -748,6 +753,8 @@ class LeoApp:
         c = frame.c
         if trace: g.trace(frame.c,g.callers())
         c.endEditing() # Commit any open edits.
+        c.fileCommands.backgroundSaver.wait()
+            # Finish any save in progress, so that c.changed is accurate.
         if c.promptingForClose:
             # There is already a dialog open asking what to do.
             return False
@@ -761,6 +768,8 @@ class LeoApp:
         g.app.setLog(None) # no log until we reactive a window.
         g.doHook("close-frame",c=c)
             # This may remove frame from the window list.
+        if g.app.fileWatcher:
+            g.app.fileWatcher.unwatchCommander(c)
         if frame in g.app.windowList:
             g.app.destroyWindow(frame)
         else:
@@ -958,6 +967,8 @@ class LeoApp:
         if g.app.ipk:
             g.app.ipk.cleanup_consoles()
         self.destroyAllOpenWithFiles()
+        if g.app.trace_hooks and g.app.pluginsController:
+            g.app.pluginsController.printHookStats()
         # Don't use g.trace!
         # print('app.finishQuit: setting g.app.killed',g.callers())
         g.app.killed = True
@@ -1348,6 +1359,8 @@ class LoadManager:
             # List of files to be loaded.
         self.options = {}
             # Dictionary of user options. Keys are option names.
+        self.startupTimes = []
+            # List of (phase,seconds) tuples, reported by --trace-startup-times.
 
         if 0: # use lm.options.get instead.
             self.script = None          # The fileName of a script, or None.
@@ -1713,16 +1726,24 @@ class LoadManager:
         isLeoSettings = g.shortFileName(fn).lower()=='leosettings.leo'
         exists = g.os_path_exists(fn)
         if fn and exists and lm.isLeoFile(fn) and not isLeoSettings:
-            # Open the file usinging a null gui.
-            try:
-                g.app.preReadFlag = True
-                c = lm.openSettingsFile(fn)
-            finally:
-                g.app.preReadFlag = False
-            # Merge the settings from c into *copies* of the global dicts.
-            d1,d2 = lm.computeLocalSettings(c,
-                lm.globalSettingsDict,lm.globalShortcutsDict,localFlag=True)
-                    # d1 and d2 are copies.
+            # Use the settings snapshot if neither fn nor the global settings have changed.
+            paths = [lm.computeLeoSettingsPath(),lm.computeMyLeoSettingsPath(),fn]
+            snapshot = lm.getSettingsSnapshot(fn,paths)
+            if snapshot:
+                d1,d2 = snapshot
+            else:
+                state = lm.getConfigState()
+                # Open the file usinging a null gui.
+                try:
+                    g.app.preReadFlag = True
+                    c = lm.openSettingsFile(fn)
+                finally:
+                    g.app.preReadFlag = False
+                # Merge the settings from c into *copies* of the global dicts.
+                d1,d2 = lm.computeLocalSettings(c,
+                    lm.globalSettingsDict,lm.globalShortcutsDict,localFlag=True)
+                        # d1 and d2 are copies.
+                lm.putSettingsSnapshot(fn,paths,d1,d2,state)
             d1.setName(settingsName)
             d2.setName(shortcutsName)
         else:
@@ -1883,23 +1904,33 @@ class LoadManager:
         return ok and c or None
     #@+node:ekr.20120213081706.10382: *4* lm.readGlobalSettingsFiles
     def readGlobalSettingsFiles (self):
-        '''Read leoSettings.leo and myLeoSettings.leo using a null gui.'''
+        '''
+        Read leoSettings.leo and myLeoSettings.leo using a null gui.
+
+        Use the settings snapshot instead if neither file has changed.
+        '''
         trace = (False or g.trace_startup) and not g.unitTesting
         verbose = False
         lm = self
         if trace: g.es_debug()
-        # Open the standard settings files with a nullGui.
-        # Important: their commanders do not exist outside this method!
         paths = [lm.computeLeoSettingsPath(),lm.computeMyLeoSettingsPath()]
-        old_commanders = g.app.commanders()
-        commanders = [lm.openSettingsFile(path) for path in paths]
-        commanders = [z for z in commanders if z]
-        settings_d,shortcuts_d = lm.createDefaultSettingsDicts()
-        for c in commanders:
-            settings_d,shortcuts_d = lm.computeLocalSettings(
-                c,settings_d,shortcuts_d,localFlag=False)
-        # Adjust the name.
-        shortcuts_d.setName('lm.globalShortcutsDict')
+        old_commanders,commanders = g.app.commanders(),[]
+        snapshot = lm.getSettingsSnapshot('global',paths)
+        if snapshot:
+            settings_d,shortcuts_d = snapshot
+        else:
+            state = lm.getConfigState()
+            # Open the standard settings files with a nullGui.
+            # Important: their commanders do not exist outside this method!
+            commanders = [lm.openSettingsFile(path) for path in paths]
+            commanders = [z for z in commanders if z]
+            settings_d,shortcuts_d = lm.createDefaultSettingsDicts()
+            for c in commanders:
+                settings_d,shortcuts_d = lm.computeLocalSettings(
+                    c,settings_d,shortcuts_d,localFlag=False)
+            # Adjust the name.
+            shortcuts_d.setName('lm.globalShortcutsDict')
+            lm.putSettingsSnapshot('global',paths,settings_d,shortcuts_d,state)
         if trace:
             if verbose:
                 for c in commanders:
@@ -1913,6 +1944,108 @@ class LoadManager:
         for c in commanders:
             if c not in old_commanders:
                 g.app.forgetOpenFile(c.fileName())
+    #@+node:agent.20261018211156.1: *4* lm.settings snapshots
+    #@+node:agent.20261018211156.2: *5* lm.computeSettingsStamp
+    def computeSettingsStamp (self,paths):
+        '''
+        Return a list describing everything that determines the settings
+        computed from the given settings files.
+        '''
+        lm = self
+        # The default settings are defined in leoConfig.py.
+        configPath = g.os_path_finalize_join(g.app.loadDir,'leoConfig.py')
+        aList = [sys.platform,lm.computeMachineName(),g.new_modes]
+            # @ifplatform and @ifhostname nodes depend on the machine.
+        for path in [configPath] + paths:
+            if path and g.os_path_exists(path):
+                st = os.stat(path)
+                aList.append((path,st.st_mtime,st.st_size))
+            else:
+                aList.append((path,None,None))
+        return aList
+    #@+node:agent.20261018211156.3: *5* lm.getConfigState
+    def getConfigState (self):
+        '''
+        Return a dict describing the g.app.config ivars that the settings
+        parser sets directly.
+        '''
+        config = g.app.config
+        d = {}
+        for ivar in (
+            'enabledPluginsFileName','enabledPluginsString',
+            'menusFileName','menusList',
+        ):
+            d[ivar] = getattr(config,ivar,None)
+        d['context_menus'] = dict(getattr(config,'context_menus',None) or {})
+        modes = getattr(config,'modeCommandsDict',None)
+        d['modeCommandsDict'] = dict(modes.d) if modes else {}
+        d['common'] = len(config.atCommonButtonsList),len(config.atCommonCommandsList)
+        return d
+    #@+node:agent.20261018211156.4: *5* lm.getSettingsSnapshot
+    def getSettingsSnapshot (self,kind,paths):
+        '''
+        Return (settings_d,shortcuts_d) from the settings snapshot for kind
+        if none of the given settings files has changed since the snapshot
+        was taken. Otherwise return None.
+        '''
+        trace = (False or g.trace_startup) and not g.unitTesting
+        lm,db = self,g.app.db
+        if not g.enableDB or db is None:
+            return None
+        try:
+            d = db.get('settings-snapshot:%s' % kind)
+        except Exception:
+            d = None # The snapshot may have been pickled by an older version of Leo.
+        if not d or d.get('stamp') != lm.computeSettingsStamp(paths):
+            if trace: g.trace('no snapshot for',kind)
+            return None
+        # Redo the parser's changes to g.app.config.
+        config = g.app.config
+        for ivar,val in d.get('config').items():
+            if ivar == 'context_menus':
+                if not hasattr(config,'context_menus'):
+                    config.context_menus = {}
+                config.context_menus.update(val)
+            elif ivar == 'modeCommandsDict':
+                config.modeCommandsDict.update(val)
+            else:
+                setattr(config,ivar,val)
+        if trace: g.trace('using snapshot for',kind)
+        return d.get('settings'),d.get('shortcuts')
+    #@+node:agent.20261018211156.5: *5* lm.putSettingsSnapshot
+    def putSettingsSnapshot (self,kind,paths,settings_d,shortcuts_d,state):
+        '''
+        Save settings_d and shortcuts_d, computed from the given settings
+        files, in the snapshot for kind.
+
+        state is the result of lm.getConfigState before parsing the files.
+        '''
+        lm,db = self,g.app.db
+        if not g.enableDB or db is None:
+            return
+        key = 'settings-snapshot:%s' % kind
+        state2 = lm.getConfigState()
+        if state.get('common') != state2.get('common'):
+            # @buttons and @commands trees contain positions.
+            if key in db: del db[key]
+            return
+        changes = {}
+        for ivar in state2:
+            old,new = state.get(ivar),state2.get(ivar)
+            if ivar in ('context_menus','modeCommandsDict'):
+                d = dict([(z,new.get(z)) for z in new if new.get(z) is not old.get(z)])
+                if d: changes[ivar] = d
+            elif ivar != 'common' and old != new:
+                changes[ivar] = new
+        try:
+            db[key] = {
+                'config': changes,
+                'settings': settings_d,
+                'shortcuts': shortcuts_d,
+                'stamp': lm.computeSettingsStamp(paths),
+            }
+        except Exception:
+            g.es_exception()
     #@+node:ekr.20120214165710.10838: *4* lm.traceSettingsDict
     def traceSettingsDict (self,d,verbose=False):
 
@@ -1941,6 +2074,7 @@ class LoadManager:
 
         '''Load the indicated file'''
         lm = self
+        t0 = time.time()
         # Phase 1: before loading plugins.
         # Scan options, set directories and read settings.
         if not lm.isValidPython(): return
@@ -1952,15 +2086,32 @@ class LoadManager:
         if not g.app.gui:
             return
         # Phase 2: load plugins: the gui has already been set.
+        t1 = time.time()
         g.doHook("start1")
+        lm.recordStartupTime('load plugins',t1)
         if g.app.killed: return
         # Phase 3: after loading plugins. Create one or more frames.
+        t1 = time.time()
         ok = lm.doPostPluginsInit()
+        lm.recordStartupTime('open files',t1)
+        lm.recordStartupTime('total',t0)
+        if g.app.trace_startup_times:
+            lm.reportStartupTimes()
         if ok:
             g.es('') # Clears horizontal scrolling in the log pane.
             g.app.gui.runMainLoop()
             # For scripts, the gui is a nullGui.
             # and the gui.setScript has already been called.
+    #@+node:agent.20261018211221.1: *4* LM.recordStartupTime & reportStartupTimes
+    def recordStartupTime (self,phase,t1):
+        '''Record the time taken by a startup phase that started at time t1.'''
+        self.startupTimes.append((phase,time.time()-t1),)
+
+    def reportStartupTimes (self):
+        '''Print the times recorded by lm.recordStartupTime.'''
+        print('startup times...')
+        for phase,t in self.startupTimes:
+            print('%25s %6.3f sec' % (phase,t))
     #@+node:ekr.20120219154958.10477: *4* LM.doPrePluginsInit & helpers
     def doPrePluginsInit(self,fileName,pymacs):
 
@@ -1986,21 +2137,26 @@ class LoadManager:
         lm.initApp(verbose)
         lm.reportDirectories(verbose)
 
+        # Create the global db before reading settings: it holds the settings snapshots.
+        g.app.setGlobalDb()
+
         # Read settings *after* setting g.app.config and *before* opening plugins.
         # This means if-gui has effect only in per-file settings.
+        t1 = time.time()
         lm.readGlobalSettingsFiles()
             # reads only standard settings files, using a null gui.
             # uses lm.files[0] to compute the local directory
             # that might contain myLeoSettings.leo.
+        lm.recordStartupTime('read settings files',t1)
 
         # Read the recent files file.
         localConfigFile = lm.files[0] if lm.files else None
         g.app.recentFilesManager.readRecentFiles(localConfigFile)
 
-        g.app.setGlobalDb()
-
         # Create the gui after reading options and settings.
+        t1 = time.time()
         lm.createGui(pymacs)
+        lm.recordStartupTime('create gui',t1)
 
         # We can't print the signon until we know the gui.
         g.app.computeSignon() # Set app.signon/signon2 for commanders.
@@ -2085,6 +2241,7 @@ class LoadManager:
         if trace: g.es_debug()
         assert g.app.loadManager
         import leo.core.leoConfig as leoConfig
+        import leo.core.leoFileWatcher as leoFileWatcher
         import leo.core.leoNodes as leoNodes
         import leo.core.leoPlugins as leoPlugins
         import leo.core.leoSessions as leoSessions
@@ -2100,6 +2257,7 @@ class LoadManager:
         g.app.config = leoConfig.GlobalConfigManager()
         g.app.nodeIndices = leoNodes.NodeIndices(g.app.leoID)
         g.app.sessionManager = leoSessions.SessionManager()
+        g.app.fileWatcher = leoFileWatcher.createFileWatcher()
         # Complete the plugins class last.
         g.app.pluginsController.finishCreate()
     #@+node:ekr.20120219154958.10486: *5* LM.scanOptions & helper
@@ -2144,8 +2302,12 @@ class LoadManager:
             help = 'save session tabs on exit')
         add('--silent', action="store_true", dest="silent",
             help = 'disable all log messages')
+        add('--trace-hooks', action="store_true", dest='trace_hooks',
+            help = 'report the time taken by each hook handler on exit')
         add('--trace-plugins', action="store_true", dest='trace_plugins',
             help = 'trace imports of plugins')
+        add('--trace-startup-times', action="store_true", dest='trace_startup_times',
+            help = 'report the time taken by each startup phase')
         add('-v', '--version', action="store_true", dest="version",
             help='print version number and exit')
         add('--window-size', dest='window_size',
@@ -2233,8 +2395,12 @@ class LoadManager:
         # --silent
         g.app.silentMode = options.silent
         # print('scanOptions: silentMode',g.app.silentMode)
+        # --trace-hooks
+        g.app.trace_hooks = options.trace_hooks
         # --trace-plugins
         g.app.trace_plugins = options.trace_plugins
+        # --trace-startup-times
+        g.app.trace_startup_times = options.trace_startup_times
         # --version: print the version and exit.
         versionFlag = options.version
         # --window-size
@@ -2609,6 +2775,8 @@ class LoadManager:
             # b) fn is an external file, existing or not.
             lm.initWrapperLeoFile(c,fn)
         g.doHook("open2",old_c=None,c=c,new_c=c,fileName=fn)
+        if g.app.fileWatcher:
+            g.app.fileWatcher.watchCommander(c)
 
         # Phase 3: Complete the initialization.
         g.app.writeWaitingLog(c)
@@ -113,6 +113,17 @@ class AtFile:
         self.encoding = 'utf-8' # 2014/08/13
         self.fileCommands = c.fileCommands
         self.errors = 0 # Make sure at.error() works even when not inited.
+        # Text written for each node, for at.putNodeFragment.
+        # Keys are gnx's of @<file> nodes. Values are dicts describing the
+        # nodes written the last time the file was written: their keys are
+        # gnx's, their values are (context,h,b,s) tuples.
+        self.fragmentsDict = {}
+        self.oldFragments = {} # The entry for the file being written.
+        self.newFragments = {} # The next entry for the file being written.
+        # A list of g.Bunches describing files to be written later.
+        # The BackgroundSaver class sets this to a list while computing
+        # the contents of external files. None: write files immediately.
+        self.deferredWrites = None
         # **Only** at.writeAll manages these flags.
         # promptForDangerousWrite sets cancelFlag and yesToAll only if canCancelFlag is True.
         self.canCancelFlag = False
@@ -126,6 +137,8 @@ class AtFile:
             'check-python-code-on-write',default=True)
         self.underindentEscapeString = c.config.getString(
             'underindent-escape-string') or '\\-'
+        self.writeIncrementally = c.config.getBool(
+            'write-external-files-incrementally',default=True)
         self.dispatch_dict = self.defineDispatchDict()
             # Define the dispatch dictionary used by scanText4.
         self.createWritersData()
@@ -266,6 +279,7 @@ class AtFile:
         at.encoding = c.config.default_derived_file_encoding
         at.endSentinelComment = ""
         at.errors = 0
+        at.fragmentBreaks = 0 # Incremented when a node writes other nodes.
         at.inCode = True
         at.indent = 0  # The unit of indentation is spaces, not tabs.
         at.language = None
@@ -275,6 +289,7 @@ class AtFile:
         at.raw = False # True: in @raw mode
         at.root = None # The root (a position) of tree being read or written.
         at.root_seen = False # True: root VNode has been handled in this file.
+        at.sectionIndex = None # A g.SectionIndex for at.root's tree, while writing.
         at.startSentinelComment = ""
         at.startSentinelComment = ""
         at.tab_width  = None
@@ -394,6 +409,7 @@ class AtFile:
         at.sentinels = not nosentinels
         at.shortFileName = ""   # For messages.
         at.root = root
+        at.sectionIndex = g.SectionIndex(root)
         # at.tab_width:         set by scanAllDirectives() below.
         at.targetFileName = targetFileName
             # Must be None for @shadow.
@@ -566,9 +582,13 @@ class AtFile:
                 x.updatePublicAndPrivateFiles(at.root,fn,shadow_fn)
                 fn = shadow_fn
             try:
-                # Open the file in binary mode to allow 0x1a in bodies & headlines.
-                at.inputFile = f = open(fn,'rb')
-                s = f.read()
+                s = at.c.cacher.getPrefetchedContents(fn)
+                if s is None:
+                    # Open the file in binary mode to allow 0x1a in bodies & headlines.
+                    at.inputFile = f = open(fn,'rb')
+                    s = f.read()
+                else:
+                    at.inputFile = g.FileLikeObject()
                 at.bom_encoding,s = g.stripBOM(s)
                 e = at.bom_encoding or at.encoding
                 s = g.toUnicode(s,e)
@@ -595,7 +615,8 @@ class AtFile:
             return False
         # Fix bug 760531: always mark the root as read, even if there was an error.
         # Fix bug 889175: Remember the full fileName.
-        at.rememberReadPath(at.fullPath(root),root)
+        fn = at.fullPath(root)
+        at.rememberReadPath(fn,root)
         # Bug fix 2011/05/23: Restore orphan trees from the outline.
         if root.isOrphan():
             g.es("reading:",root.h)
@@ -609,6 +630,15 @@ class AtFile:
         if at.errors:
             if trace: g.trace('Init error')
             return False
+        if not (fromString or importFileName or atShadow or force):
+            # Use the cached tree without reading unchanged files.
+            data = c.cacher.readFileFromStat(fn,root)
+            if data:
+                if trace: g.trace('unchanged',fn)
+                at.setPathUa(root,fn)
+                c.timeStampDict[fn] = data[3]
+                root.clearDirty()
+                return True
         fileName = at.openFileForReading(fromString=fromString)
             # For @shadow files, calls x.updatePublicAndPrivateFiles.
         if fileName and at.inputFile:
@@ -760,8 +790,8 @@ class AtFile:
                 import leo.core.leoNodes as leoNodes
                 for parent_v in v.parents:
                     assert isinstance(parent_v,leoNodes.VNode),parent_v
-                    if v in parent_v.children:
-                        childIndex = parent_v.children.index(v)
+                    childIndex = parent_v._indexOfChild(v)
+                    if childIndex > -1:
                         if trace: g.trace('*moving*',parent_v,childIndex,v)
                         v._cutLink(childIndex,parent_v)
                         v._addLink(len(child.v.children),child.v)
@@ -827,58 +857,162 @@ class AtFile:
         scanned_tnodes = set()
         c.init_error_dialogs()
         after = p.nodeAfterTree() if partialFlag else c.nullPosition()
+        if c.config.getBool('read-external-files-in-parallel'):
+            at.prefetchExternalFiles(p,after)
+        lazy = not partialFlag and c.config.getBool('check-external-files-lazily')
+        if lazy:
+            c.cacher.lazyStatChecks = []
+        c.cacher.beginBatch()
+        try:
+            while p and p != after:
+                gnx = p.gnx
+                #skip clones
+                if gnx in scanned_tnodes:
+                    p.moveToNodeAfterTree()
+                    continue
+                scanned_tnodes.add(gnx)
+                if not p.h.startswith('@'):
+                    p.moveToThreadNext()
+                elif p.isAtIgnoreNode():
+                    if p.isAnyAtFileNode() :
+                        c.ignored_at_file_nodes.append(p.h)
+                    p.moveToNodeAfterTree()
+                elif p.isAtThinFileNode():
+                    anyRead = True
+                    at.read(p,force=force)
+                    p.moveToNodeAfterTree()
+                elif p.isAtAutoNode():
+                    fileName = p.atAutoNodeName()
+                    at.readOneAtAutoNode (fileName,p)
+                    p.moveToNodeAfterTree()
+                elif p.isAtEditNode():
+                    fileName = p.atEditNodeName()
+                    at.readOneAtEditNode (fileName,p)
+                    p.moveToNodeAfterTree()
+                elif p.isAtShadowFileNode():
+                    fileName = p.atShadowFileNodeName()
+                    at.readOneAtShadowNode (fileName,p)
+                    p.moveToNodeAfterTree()
+                elif p.isAtFileNode():
+                    anyRead = True
+                    wasOrphan = p.isOrphan()
+                    ok = at.read(p,force=force)
+                    if wasOrphan and not partialFlag and not ok:
+                        # Remind the user to fix the problem.
+                        # However, the dirty bit gets cleared.
+                        # p.setDirty() # 2011/06/17: won't be preserved anyway.
+                            # Expensive, but it can't be helped.
+                        p.setOrphan() # 2010/10/22: the dirty bit gets cleared.
+                        # c.setChanged(True) # 2011/06/17
+                    p.moveToNodeAfterTree()
+                else:
+                    if p.isAtAsisFileNode() or p.isAtNoSentFileNode():
+                        at.rememberReadPath(at.fullPath(p),p)
+                    p.moveToThreadNext()
+        finally:
+            c.cacher.endBatch()
+            lazyStatChecks = c.cacher.lazyStatChecks
+            c.cacher.lazyStatChecks = None
+        if lazy:
+            at.checkExternalFilesLater(lazyStatChecks)
+        # 2010/10/22: Preserve the orphan bits: the dirty bits will be cleared!
+        #for v in c.all_unique_nodes():
+        #    v.clearOrphan()
+        if partialFlag and not anyRead and not g.unitTesting:
+            g.es("no @<file> nodes in the selected tree")
+        c.cacher.pendingStats = {}
+        c.cacher.prefetchDict = {}
+            # Free the contents of any prefetched files that were not read.
+        if use_tracer: tt.stop()
+        c.raise_error_dialogs()  # 2011/12/17
+    #@+node:agent.20261018193529.1: *4* at.checkExternalFilesLater & helper
+    def checkExternalFilesLater(self,aList):
+        '''
+        Check the external files in aList, a list of (v,fileName) tuples, at
+        idle time, a few files at a time. Reread the files that have changed
+        since they were cached.
+
+        at.readAll calls this method after reading the outline without
+        checking the files' stats.
+        '''
+        at = self
+        aList = aList[:]
+
+        def handler(timer,at=at,aList=aList):
+            for i in range(20):
+                if aList and at.c.exists:
+                    v,fileName = aList.pop(0)
+                    at.checkExternalFile(v,fileName)
+                else:
+                    timer.stop()
+                    return
+
+        if aList:
+            timer = g.IdleTime(handler,delay=100,tag='check-external-files')
+            if timer:
+                timer.start()
+            else:
+                # No gui: check the files now.
+                for v,fileName in aList:
+                    at.checkExternalFile(v,fileName)
+    #@+node:agent.20261018193529.2: *5* at.checkExternalFile
+    def checkExternalFile(self,v,fileName):
+        '''
+        Reread v, the root of an @<file> tree, if the stat of fileName
+        no longer matches the stat recorded in the cache.
+        '''
+        c = self.c
+        data = c.cacher.db.get(c.cacher.statKey(fileName,v.h))
+        st = c.cacher.statFile(fileName)
+        if data and st and st[:3] == tuple(data[:3]):
+            return
+        p = c.vnode2position(v)
+        if not p:
+            return # The tree no longer exists.
+        if any([z.isDirty() for z in p.self_and_subtree()]):
+            g.warning('not rereading changed file:',fileName)
+            return
+        if c.refreshNodeFromDisk(p):
+            c.redraw()
+    #@+node:agent.20261018192859.1: *4* at.prefetchExternalFiles
+    def prefetchExternalFiles(self,root,after):
+        '''
+        Prefetch the external files of all @file, @thin and @auto nodes
+        from root up to (but not including) after.
+
+        Worker threads read the files and compute their cache keys.
+        at.read and at.readOneAtAutoNode then use the prefetched data.
+        All changes to the outline still happen in the main thread,
+        so the result is the same as reading the files one at a time.
+        '''
+        at,c = self,self.c
+        aList,seen = [],set()
+        p = root.copy()
         while p and p != after:
-            gnx = p.gnx
-            #skip clones
-            if gnx in scanned_tnodes:
+            # This traversal must match the traversal in at.readAll.
+            if p.gnx in seen:
                 p.moveToNodeAfterTree()
                 continue
-            scanned_tnodes.add(gnx)
+            seen.add(p.gnx)
             if not p.h.startswith('@'):
                 p.moveToThreadNext()
             elif p.isAtIgnoreNode():
-                if p.isAnyAtFileNode() :
-                    c.ignored_at_file_nodes.append(p.h)
                 p.moveToNodeAfterTree()
-            elif p.isAtThinFileNode():
-                anyRead = True
-                at.read(p,force=force)
+            elif p.isAtThinFileNode() or p.isAtFileNode():
+                if not p.isOrphan():
+                    aList.append((at.fullPath(p),p.h))
                 p.moveToNodeAfterTree()
             elif p.isAtAutoNode():
-                fileName = p.atAutoNodeName()
-                at.readOneAtAutoNode (fileName,p)
+                path = g.setDefaultDirectory(c,p,importing=True)
+                fileName = c.os_path_finalize_join(path,p.atAutoNodeName())
+                aList.append((fileName,p.h))
                 p.moveToNodeAfterTree()
-            elif p.isAtEditNode():
-                fileName = p.atEditNodeName()
-                at.readOneAtEditNode (fileName,p)
-                p.moveToNodeAfterTree()
-            elif p.isAtShadowFileNode():
-                fileName = p.atShadowFileNodeName()
-                at.readOneAtShadowNode (fileName,p)
-                p.moveToNodeAfterTree()
-            elif p.isAtFileNode():
-                anyRead = True
-                wasOrphan = p.isOrphan()
-                ok = at.read(p,force=force)
-                if wasOrphan and not partialFlag and not ok:
-                    # Remind the user to fix the problem.
-                    # However, the dirty bit gets cleared.
-                    # p.setDirty() # 2011/06/17: won't be preserved anyway.
-                        # Expensive, but it can't be helped.
-                    p.setOrphan() # 2010/10/22: the dirty bit gets cleared.
-                    # c.setChanged(True) # 2011/06/17
+            elif p.isAtEditNode() or p.isAtShadowFileNode():
+                # @shadow nodes may update their files before reading them.
                 p.moveToNodeAfterTree()
             else:
-                if p.isAtAsisFileNode() or p.isAtNoSentFileNode():
-                    at.rememberReadPath(at.fullPath(p),p)
                 p.moveToThreadNext()
-        # 2010/10/22: Preserve the orphan bits: the dirty bits will be cleared!
-        #for v in c.all_unique_nodes():
-        #    v.clearOrphan()
-        if partialFlag and not anyRead and not g.unitTesting:
-            g.es("no @<file> nodes in the selected tree")
-        if use_tracer: tt.stop()
-        c.raise_error_dialogs()  # 2011/12/17
+        c.cacher.prefetchFiles(aList)
     #@+node:ekr.20080801071227.7: *4* at.readAtShadowNodes
     def readAtShadowNodes (self,p):
 
@@ -909,7 +1043,10 @@ class AtFile:
         # Remember that we have seen the @auto node.
         # Fix bug 889175: Remember the full fileName.
         at.rememberReadPath(fileName,p)
-        s,ok,fileKey = c.cacher.readFile(fileName,p)
+        if c.cacher.readFileFromStat(fileName,p):
+            s,ok,fileKey = None,True,None
+        else:
+            s,ok,fileKey = c.cacher.readFile(fileName,p)
         if ok:
             if trace: g.trace('***** using cached nodes',p.h)
             # Even if the file is in the cache, the @persistence node may be different.
@@ -3222,6 +3359,7 @@ class AtFile:
             p = c.rootPosition()
             after = c.nullPosition()
         at.clearAllOrphanBits(p)
+        roots = set() # The gnx's of all @<file> nodes not in @ignore trees.
         while p and p != after:
             if p.isAtIgnoreNode() and not p.isAtAsisFileNode():
                 if p.isAnyAtFileNode() :
@@ -3229,6 +3367,7 @@ class AtFile:
                 # Note: @ignore not honored in @asis nodes.
                 p.moveToNodeAfterTree() # 2011/10/08: Honor @ignore!
             elif p.isAnyAtFileNode():
+                roots.add(p.v.fileIndex)
                 try:
                     self.writeAllHelper(p,root,force,toString,writeAtFileNodesFlag,writtenFiles)
                 except Exception:
@@ -3247,6 +3386,11 @@ class AtFile:
         at.canCancelFlag = False
         at.cancelFlag = False
         at.yesToAll = False
+        if not writeAtFileNodesFlag:
+            # Forget the text of files that are no longer written.
+            for gnx in list(at.fragmentsDict.keys()):
+                if gnx not in roots:
+                    del at.fragmentsDict[gnx]
         #@+<< say the command is finished >>
         #@+node:ekr.20041005105605.150: *5* << say the command is finished >>
         if not g.unitTesting:
@@ -3620,7 +3764,8 @@ class AtFile:
         # pylint: disable=unbalanced-tuple-unpacking
         at.public_s, at.private_s = data
         if g.app.unitTesting:
-            exceptions = ('public_s','private_s','sentinels','stringOutput','outputContents')
+            exceptions = ('public_s','private_s','sentinels','stringOutput','outputContents',
+                'fragmentBreaks')
             assert g.checkUnchangedIvars(at,ivars_dict,exceptions),'writeOneAtShadowNode'
         if at.errors == 0 and not toString:
             # Write the public and private files.
@@ -3789,17 +3934,28 @@ class AtFile:
         at = self
         s = fromString if fromString else root.v.b
         root.clearAllVisitedInTree()
-        at.putAtFirstLines(s)
-        at.putOpenLeoSentinel("@+leo-ver=%s" % (5 if at.writeVersion5 else 4))
-            # Use version 4 for @shadow, verion 5 otherwise.
-        at.putInitialComment()
-        at.putOpenNodeSentinel(root)
-        at.putBody(root,fromString=fromString)
-        at.putCloseNodeSentinel(root)
-        # The -leo sentinel is required to handle @last.
-        at.putSentinel("@-leo")
-        root.setVisited()
-        at.putAtLastLines(s)
+        # Remember only the nodes written this time.
+        gnx = root.v.fileIndex
+        at.oldFragments = at.fragmentsDict.get(gnx,{})
+        at.newFragments = {}
+        try:
+            at.putAtFirstLines(s)
+            at.putOpenLeoSentinel("@+leo-ver=%s" % (5 if at.writeVersion5 else 4))
+                # Use version 4 for @shadow, verion 5 otherwise.
+            at.putInitialComment()
+            at.putOpenNodeSentinel(root)
+            at.putBody(root,fromString=fromString)
+            at.putCloseNodeSentinel(root)
+            # The -leo sentinel is required to handle @last.
+            at.putSentinel("@-leo")
+            root.setVisited()
+            at.putAtLastLines(s)
+            if at.newFragments:
+                at.fragmentsDict[gnx] = at.newFragments
+            elif gnx in at.fragmentsDict:
+                del at.fragmentsDict[gnx]
+        finally:
+            at.oldFragments = at.newFragments = {}
         if not toString:
             at.warnAboutOrphandAndIgnoredNodes()
     #@+node:ekr.20041005105605.160: *3* Writing 4.x
@@ -3969,6 +4125,7 @@ class AtFile:
         """Put the expansion of @all."""
 
         at = self
+        at.fragmentBreaks += 1
         j,delta = g.skip_leading_ws_with_indent(s,i,at.tab_width)
         at.putLeadInSentinel(s,i,j,delta)
 
@@ -4066,6 +4223,7 @@ class AtFile:
         """Put the expansion of @others."""
 
         at = self
+        at.fragmentBreaks += 1
         j,delta = g.skip_leading_ws_with_indent(s,i,at.tab_width)
         at.putLeadInSentinel(s,i,j,delta)
 
@@ -4087,9 +4245,7 @@ class AtFile:
                 after = p.nodeAfterTree()
                 while p and p != after:
                     if at.validInAtOthers(p):
-                        at.putOpenNodeSentinel(p)
-                        at_others_flag = at.putBody(p)
-                        at.putCloseNodeSentinel(p)
+                        at_others_flag = at.putNodeFragment(p)
                         if at_others_flag:
                             p.moveToNodeAfterTree()
                         else:
@@ -4152,6 +4308,56 @@ class AtFile:
             return False
         else:
             return True
+    #@+node:agent.20261018193826.1: *7* at.putNodeFragment
+    def putNodeFragment(self,p):
+        '''
+        Put p's node sentinels and body, reusing the text written the last time
+        p was written in the same context. Return True if p contains @others.
+        '''
+        at = self
+        f = at.outputFile
+        context = at.fragmentContext(p)
+        if context:
+            gnx,h,b = p.v.fileIndex,p.h,p.b
+            data = at.oldFragments.get(gnx)
+            if data and data[0] == context and data[1] == h and data[2] == b:
+                at.newFragments[gnx] = data
+                p.v.setVisited()
+                f.write(data[3])
+                return False
+        n,errors,breaks = len(f.list),at.errors,at.fragmentBreaks
+        at.putOpenNodeSentinel(p)
+        at_others_flag = at.putBody(p)
+        at.putCloseNodeSentinel(p)
+        if context:
+            # Don't cache nodes that write other nodes or change the context.
+            if (not at_others_flag and
+                at.errors == errors and at.fragmentBreaks == breaks and
+                at.fragmentContext(p) == context
+            ):
+                at.newFragments[gnx] = context,h,b,''.join(f.list[n:])
+        return at_others_flag
+    #@+node:agent.20261018193826.2: *7* at.fragmentContext
+    def fragmentContext(self,p):
+        '''
+        Return a tuple describing everything besides p's headline and body that
+        affects the text putNodeFragment writes for p, or None if p's text
+        should not be cached.
+        '''
+        at = self
+        if (
+            at.writeIncrementally and at.thinFile and at.writeVersion5 and
+            at.sentinels and not at.toString and
+            not at.atAuto and not at.perfectImportFlag
+        ):
+            return (
+                p.level() - at.root.level(),
+                at.indent,at.tab_width,at.language,
+                at.startSentinelComment,at.endSentinelComment,
+                len(g.globalDirectiveList),
+            )
+        else:
+            return None
     #@+node:ekr.20041005105605.174: *5* putCodeLine (leoAtFile)
     def putCodeLine (self,s,i):
 
@@ -4188,7 +4394,7 @@ class AtFile:
     def findReference(self,name,p):
         '''Find a reference to name.  Raise an error if not found.'''
         at,c = self,self.c
-        ref = g.findReference(c,name,p)
+        ref = g.findReference(c,name,p,index=at.sectionIndex)
         if not ref and not g.unitTesting:
             at.writeError(
                 "undefined section: %s\n\treferenced from: %s" % (name,p.h))
@@ -4197,6 +4403,7 @@ class AtFile:
     def putRefLine(self,s,i,n1,n2,p):
         """Put a line containing one or more references."""
         at = self
+        at.fragmentBreaks += 1
         # Compute delta only once.
         delta = self.putRefAt(s,i,n1,n2,p,delta=None)
         if delta is None: return # 11/23/03
@@ -4769,6 +4976,18 @@ class AtFile:
         if s2 is None:
             g.internalError('empty compare file: %s' % path2)
             return False
+        equal = at.compareStrings(s1,e1,s2,e2,ignoreLineEndings,ignoreBlankLines)
+        if trace: g.trace('equal',equal)
+        return equal
+    #@+node:agent.20261018203001.1: *4* at.compareStrings
+    def compareStrings (self,s1,e1,s2,e2,ignoreLineEndings,ignoreBlankLines=False):
+        '''
+        Return True if the contents s1 and s2 of two files are equivalent.
+        e1 and e2 are the encodings of s1 and s2 if they are not unicode.
+
+        This method does not use any ivars, so the BackgroundSaver class
+        may call it from any thread.
+        '''
         # 2013/10/28: fix bug #1243855: @auto-rst doesn't save text 
         # Make sure both strings are unicode.
         # This is requred to handle binary files in Python 3.x.
@@ -4788,7 +5007,6 @@ class AtFile:
             s1 = s1.replace('\r','')
             s2 = s2.replace('\r','')
             equal = s1 == s2
-        if trace: g.trace('equal',equal)
         return equal
     #@+node:ekr.20041005105605.198: *4* directiveKind4 (write logic)
     def directiveKind4(self,s,i):
@@ -5250,6 +5468,20 @@ class AtFile:
             at.outputFileName = g.os_path_realpath(at.outputFileName)
         if at.targetFileName:
             at.targetFileName = g.os_path_realpath(at.targetFileName)
+        if at.deferredWrites is not None:
+            # The BackgroundSaver class will write the file later.
+            at.deferredWrites.append(g.Bunch(
+                contents=at.outputContents,
+                encoding=at.encoding,
+                explicitLineEnding=at.explicitLineEnding,
+                ignoreBlankLines=ignoreBlankLines,
+                output_newline=at.output_newline,
+                root=root and root.copy(),
+                shortFileName=at.shortFileName,
+                targetFileName=at.targetFileName,
+            ))
+            at.fileChangedFlag = False
+            return False
         if trace: g.trace(
             'ignoreBlankLines',ignoreBlankLines,
             'target exists',g.os_path_exists(at.targetFileName),
@@ -0,0 +1,503 @@
+#@+leo-ver=5-thin
+#@+node:agent.20261018195440.1: * @file leoBenchmarks.py
+'''
+Benchmarks for Leo's core data structures, run with the leoBridge module.
+
+python leo/core/leoBenchmarks.py [--size N] [--import-file FILE] [benchmark...]
+
+With no arguments, run all benchmarks.
+'''
+
+#@+<< imports >>
+#@+node:agent.20261018195440.2: ** << imports >> (leoBenchmarks.py)
+import optparse
+import os
+import sys
+import time
+# Make sure the current directory is on sys.path.
+cwd = os.getcwd()
+if cwd not in sys.path:
+    sys.path.append(cwd)
+import leo.core.leoBridge as leoBridge
+#@-<< imports >>
+# Do not define g here. Use the g returned by the bridge.
+importFiles = []
+    # The files given by --import-file options.
+
+#@+others
+#@+node:agent.20261018195440.3: ** main & helpers (leoBenchmarks.py)
+def main ():
+    '''Run the benchmarks given on the command line.'''
+    options,names = scanOptions()
+    importFiles.extend(options.importFiles or [])
+    bridge = leoBridge.controller(gui='nullGui',
+        loadPlugins=False,readSettings=False,silent=True,verbose=False)
+    g = bridge.globals()
+    names = names or sorted(benchmarksDict)
+    for name in names:
+        func = benchmarksDict.get(name)
+        if func:
+            print('%s...' % name)
+            func(bridge,g,options.size)
+        else:
+            print('unknown benchmark: %s' % name)
+#@+node:agent.20261018195440.4: *3* newOutline
+def newOutline(bridge,name):
+    '''Return a new, empty commander.'''
+    path = os.path.join(os.getcwd(),'%s-benchmark.leo' % name)
+    c = bridge.openLeoFile(path)
+    return c
+#@+node:agent.20261018195440.5: *3* report
+def report(label,n,t):
+    '''Print the total and per-item times.'''
+    print('  %-34s %6d items %7.3fsec %7.2fusec/item' % (
+        label,n,t,1000000.0*t/max(1,n)))
+#@+node:agent.20261018195440.6: *3* scanOptions
+def scanOptions():
+    '''Handle all options and remove them from sys.argv.'''
+    parser = optparse.OptionParser()
+    parser.add_option('--size',dest='size',type='int',default=5000,
+        help='number of nodes in synthetic outlines')
+    parser.add_option('--import-file',dest='importFiles',action='append',
+        help='a file for the import benchmark (may be repeated)')
+    options, args = parser.parse_args()
+    sys.argv = [sys.argv[0]]
+    return options,args
+#@+node:agent.20261018195440.7: ** Benchmarks
+#@+node:agent.20261018195440.8: *3* benchChildIndex
+def benchChildIndex(bridge,g,size):
+    '''
+    Time c.vnode2position and node moves in wide and deep outlines.
+    The per-item times should not grow with the size of the outline.
+    '''
+    c = newOutline(bridge,'child-index')
+    root = c.rootPosition()
+    # A wide outline: size children of one node.
+    wide = root.insertAfter()
+    for i in range(size):
+        wide.insertAsLastChild().h = 'child %s' % i
+    children = wide.v.children[:]
+    t = time.time()
+    for v in children:
+        c.vnode2position(v)
+    report('wide: c.vnode2position',size,time.time()-t)
+    # Move the first child after the last child.
+    # This adjusts the position of the last child.
+    t = time.time()
+    for i in range(size):
+        wide.firstChild().moveAfter(wide.lastChild())
+    report('wide: p.moveAfter',size,time.time()-t)
+    # A deep outline: a chain of size/10 nodes, each with 10 children.
+    deep = wide.insertAfter()
+    p = deep.copy()
+    for i in range(max(1,size//10)):
+        for j in range(10):
+            child = p.insertAsLastChild()
+        p = child
+    vnodes = [z.v for z in deep.subtree()]
+    t = time.time()
+    for v in vnodes:
+        c.vnode2position(v)
+    report('deep: c.vnode2position',len(vnodes),time.time()-t)
+    c.close()
+#@+node:agent.20261018202254.1: *3* benchFindAll
+def benchFindAll(bridge,g,size):
+    '''
+    Time the search loop of the find-all command, with and without the
+    candidates computed by find.computeCandidates.
+    One node in 100 matches the pattern.
+    '''
+    c = newOutline(bridge,'find-all')
+    body = 'if a < b and b > c: print("%s & %s" % (a,b))\n' * 44
+    # A balanced outline: size nodes, each with at most 10 children.
+    parents = [c.rootPosition()]
+    for i in range(size):
+        child = parents[i//10].insertAsLastChild()
+        child.v.h = 'node %s' % i
+        child.v.b = body + ('Needle\n' if i % 100 == 0 else '')
+        parents.append(child)
+    parents = None
+    fc = c.findCommands
+    fc.find_text = 'needle'
+    fc.search_body = fc.search_headline = True
+    fc.mark_finds = fc.node_only = fc.pattern_match = False
+    fc.reverse = fc.suboutline_only = fc.whole_word = False
+    for ignore_case in (True,False):
+        fc.ignore_case = ignore_case
+        for prefilter in (False,True):
+            t = time.time()
+            fc.initBatchCommands()
+            if prefilter:
+                fc.candidates,fc.candidateAncestors = fc.computeCandidates()
+            n = 0
+            while fc.findNextMatch()[0] is not None:
+                n += 1
+            fc.candidates = fc.candidateAncestors = None
+            report('find-all: %s%s (%s found)' % (
+                'ignore-case ' if ignore_case else '',
+                'prefiltered' if prefilter else 'all nodes',n),
+                size,time.time()-t)
+    c.close()
+#@+node:agent.20261018213853.1: *3* benchFts
+def benchFts(bridge,g,size):
+    '''
+    Time indexing an outline of size nodes, writing the index,
+    re-indexing after changing 1% of the nodes, and searching.
+    '''
+    import leo.core.leoFts as leoFts
+    c = newOutline(bridge,'fts')
+    words = ['alpha','beta','gamma','delta','epsilon','zeta','theta','kappa']
+    root = c.rootPosition()
+    for i in range(size):
+        p = root.insertAsLastChild()
+        p.h = 'node %s %s' % (words[i%8],words[(i//8)%8])
+        p.b = ' '.join([words[(i*j)%8] for j in range(20)])
+    path = os.path.join(os.getcwd(),'fts-benchmark.idx')
+    try:
+        index = leoFts.FtsIndex(path)
+        t = time.time()
+        index.indexCommander(c)
+        report('index',size,time.time()-t)
+        t = time.time()
+        index.flush()
+        report('flush',size,time.time()-t)
+        index.close()
+        index = leoFts.FtsIndex(path)
+        for i,p in enumerate(root.children()):
+            if i % 100 == 0:
+                p.b = p.b + ' omega'
+        t = time.time()
+        n = index.indexCommander(c)
+        report('re-index changed nodes',n,time.time()-t)
+        queries = ['alpha','alpha beta','omega','ga*','node kappa']
+        for label,n in (('first search',1),('repeated search',100)):
+            t = time.time()
+            for i in range(n):
+                for query in queries:
+                    index.search(query)
+            report(label,n*len(queries),time.time()-t)
+        index.close()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    c.close()
+#@+node:agent.20261018210358.1: *3* benchImport
+def benchImport(bridge,g,size):
+    '''
+    Time @auto imports of real source files, including the check that
+    writing the imported outline reproduces each file. Report lines/sec
+    for each importer.
+
+    By default, import Leo's own Python and JavaScript sources and
+    Python's C headers. --import-file replaces these defaults.
+    size is not used.
+    '''
+    import sysconfig
+    leoDir = g.app.loadDir
+    files = importFiles or [
+        os.path.join(leoDir,fn) for fn in (
+            'leoCommands.py','leoEditCommands.py','leoGlobals.py','leoNodes.py')
+    ] + [
+        os.path.join(leoDir,'..',fn) for fn in (
+            'external/ckeditor/ckeditor.js','plugins/pygeotag/map.js')
+    ]
+    if not importFiles:
+        includeDir = sysconfig.get_paths().get('include')
+        if includeDir and os.path.isdir(includeDir):
+            files.extend([os.path.join(includeDir,fn)
+                for fn in sorted(os.listdir(includeDir)) if fn.endswith('.h')])
+    d = {} # Keys are extensions, values are [files,lines,nodes,time].
+    for fn in files:
+        if not os.path.exists(fn):
+            print('  not found: %s' % fn)
+            continue
+        ext = os.path.splitext(fn)[1]
+        with open(fn,'rb') as f:
+            n = g.toUnicode(f.read()).count('\n')
+        c = newOutline(bridge,'import')
+        t = time.time()
+        p = c.importCommands.createOutline(fn,c.rootPosition(),atAuto=True)
+        t = time.time()-t
+        aList = d.setdefault(ext,[0,0,0,0.0])
+        aList[0] += 1
+        aList[1] += n
+        aList[2] += len(list(p.self_and_subtree())) if p else 0
+        aList[3] += t
+        c.close()
+    for ext in sorted(d):
+        files,lines,nodes,t = d.get(ext)
+        report('%s: %d files, %d nodes' % (ext,files,nodes),lines,t)
+        print('  %-34s %6d lines/sec' % ('throughput',lines/max(t,0.000001)))
+#@+node:agent.20261018195737.1: *3* benchNodes
+def benchNodes(bridge,g,size):
+    '''
+    Report the memory used by vnodes and the speed of c.all_positions.
+    tracemalloc (Python 3.4 and later) is required to measure memory.
+    '''
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    c = newOutline(bridge,'nodes')
+    # A balanced outline: size nodes, each with at most 10 children.
+    parents = [c.rootPosition()]
+    if tracemalloc:
+        tracemalloc.start()
+        n1 = tracemalloc.get_traced_memory()[0]
+    t = time.time()
+    for i in range(size):
+        parent = parents[i//10]
+        child = parent.insertAsLastChild()
+        child.v.h = 'node %s' % i
+        parents.append(child)
+    report('create nodes',size,time.time()-t)
+    if tracemalloc:
+        # Don't count the positions in parents.
+        del parent,child
+        parents = None
+        n2 = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('  %-34s %6d items %7d bytes/item' % (
+            'memory',size,(n2-n1)//size))
+    t = time.time()
+    n = 0
+    for p in c.all_positions():
+        n += 1
+    report('c.all_positions',n,time.time()-t)
+    if tracemalloc:
+        tracemalloc.start()
+        n1 = tracemalloc.get_traced_memory()[0]
+    t = time.time()
+    aList = [p.copy() for p in c.all_positions()]
+    report('c.all_positions and p.copy',len(aList),time.time()-t)
+    if tracemalloc:
+        n2 = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('  %-34s %6d items %7d bytes/item' % (
+            'memory',len(aList),(n2-n1)//len(aList)))
+    c.close()
+#@+node:agent.20261018203220.1: *3* benchRecolor
+def benchRecolor(bridge,g,size):
+    '''
+    Time JEditColorizer.recolor on size lines of Python, C and HTML.
+    Coloring happens without Qt: the highlighter below just remembers
+    the state of each line, and setTag counts the colored ranges.
+    '''
+    import leo.core.leoColorizer as leoColorizer
+    c = newOutline(bridge,'recolor')
+    class Highlighter:
+        '''A stand-in for QSyntaxHighlighter.'''
+        def __init__(self):
+            self.previous = self.current = -1
+        def currentBlockState(self):
+            return self.current
+        def previousBlockState(self):
+            return self.previous
+        def setCurrentBlockState(self,n):
+            self.current = n
+    class Colorer(leoColorizer.JEditColorizer):
+        '''A JEditColorizer that counts tags instead of setting them.'''
+        tagCount = 0
+        def setTag(self,tag,s,i,j):
+            self.tagCount += 1
+    bodies = (
+        ('python',
+            'class Test(object):\n'
+            '    """A docstring: see http://leoeditor.com"""\n'
+            '    def method(self,a,b=2):\n'
+            "        s = 'abc %s' % (a+b) # A comment.\n"
+            '        return [x for x in range(10) if x > a]\n'),
+        ('c',
+            '#include <stdio.h>\n'
+            '/* A comment: see http://leoeditor.com */\n'
+            'static int f(int a, char *b) {\n'
+            '    printf("%d %s\\n", a, b); // Another comment.\n'
+            '    return a > 0 ? a : -a;\n'
+            '}\n'),
+        ('html',
+            '<html><head><title>A title</title>\n'
+            '<style>body { color: red; }</style></head>\n'
+            '<!-- A comment: see http://leoeditor.com -->\n'
+            '<body><p class="main">Hello &amp; goodbye</p>\n'
+            '<script>var x = "abc"; if (x < 2) { f(x); }</script></body></html>\n'),
+    )
+    colorizer = g.Bunch(changingText=False,flag=True,killColorFlag=False,
+        language=None,showInvisibles=False)
+    for language,body in bodies:
+        lines = g.splitLines(body)
+        lines = (lines * (1 + size // len(lines)))[:size]
+        colorizer.language = language
+        # The second colorer reuses the mode imported by the first.
+        for label in ('init_mode','init_mode again'):
+            t = time.time()
+            highlighter = Highlighter()
+            colorer = Colorer(c,colorizer,highlighter,c.frame.body.wrapper)
+            colorer.init_mode(language)
+            report('%s: %s' % (language,label),1,time.time()-t)
+        t = time.time()
+        for s in lines:
+            colorer.recolor(s)
+            highlighter.previous = highlighter.current
+        t = time.time()-t
+        report('%s: recolor' % language,len(lines),t)
+        print('  %-34s %6d lines/sec %6d tags' % (
+            'throughput',len(lines)/max(t,0.000001),colorer.tagCount))
+    c.close()
+#@+node:agent.20261018210653.1: *3* benchShadow
+def benchShadow(bridge,g,size):
+    '''
+    Time propagating changes from a public @shadow file to its private
+    file, using difflib and x.PatienceDiff. The private file has 10*size
+    lines: 50000 with the default size.
+    '''
+    import random
+    c = newOutline(bridge,'shadow')
+    x = c.shadowController
+    marker = x.MarkerClass(('#','',''))
+    random.seed(1)
+    private = ['#@+leo-ver=5-thin\n','#@+node:ekr.1: * @shadow test.py\n','#@+others\n']
+    n = 0
+    while len(private) < 10*size:
+        n += 1
+        private.append('#@+node:ekr.%s: ** function %s\n' % (n+1,n))
+        private.append('def function%s(a,b):\n' % n)
+        for i in range(random.randint(2,12)):
+            private.append('    x%s = a + b * %s\n' % (i,random.randint(0,9)))
+        private.append('    return x0\n')
+        private.append('\n')
+    private.extend(['#@-others\n','#@-leo\n'])
+    public,junk = x.separate_sentinels(private,marker)
+    # Change, insert and delete about 1% of the lines, including a moved block.
+    new_public = public[:]
+    for i in range(len(new_public)//100):
+        j = random.randrange(len(new_public))
+        kind = random.choice(('change','insert','delete'))
+        if kind == 'change':
+            new_public[j] = new_public[j].rstrip() + ' # changed\n'
+        elif kind == 'insert':
+            new_public.insert(j,'    pass # inserted\n')
+        else:
+            del new_public[j]
+    j = len(new_public)//2
+    block = new_public[j:j+50]
+    del new_public[j:j+50]
+    new_public[10:10] = block
+    for engine in ('difflib','patience'):
+        x.shadow_diff_engine = engine
+        t = time.time()
+        result = x.propagate_changed_lines(new_public,private,marker)
+        t = time.time()-t
+        report('%s: %d lines' % (engine,len(private)),len(private),t)
+        junk,sentinels = x.separate_sentinels(private,marker)
+        ok = x.check_the_final_output(result,new_public,sentinels,marker)
+        print('  %-34s %s' % ('check_the_final_output','ok' if ok else 'FAILED'))
+    c.close()
+#@+node:agent.20261018213231.1: *3* benchScripts
+def benchScripts(bridge,g,size):
+    '''
+    Time expanding and compiling a script whose root contains @others
+    and size/10 children of helper code. The first run fills
+    g.app.scriptCache; the second run uses it.
+    '''
+    c = newOutline(bridge,'scripts')
+    cache = g.app.scriptCache
+    root = c.rootPosition()
+    root.h = 'script'
+    n = size//10
+    root.b = '@others\nresult = f0()\n'
+    for i in range(n):
+        child = root.insertAsLastChild()
+        child.h = 'f%s' % i
+        child.b = 'def f%s(a,b):\n    """Return %s."""\n    return a+b+%s\n' % (i,i,i)
+    cache.clear()
+    for label in ('first run','cached run'):
+        t = time.time()
+        script = g.getScript(c,root,useSelectedText=False)
+        cache.compileScript(script)
+        t = time.time()-t
+        report('%s: %d nodes' % (label,n),n,t)
+    c.close()
+#@+node:agent.20261018212337.1: *3* benchSections
+def benchSections(bridge,g,size):
+    '''
+    Time writing an @file tree whose root refers to size/10 sections,
+    each defined in its own child node. Each section refers to another
+    section defined in its own child.
+    '''
+    c = newOutline(bridge,'sections')
+    at = c.atFileCommands
+    root = c.rootPosition()
+    root.h = '@file sections-benchmark.py'
+    n = size//10
+    lt,gt = '<'+'<','>'+'>'
+    root.b = ''.join(['%s section %s %s\n' % (lt,i,gt) for i in range(n)])
+    for i in range(n):
+        child = root.insertAsLastChild()
+        child.h = '%s section %s %s' % (lt,i,gt)
+        child.b = 'def f%s():\n    %s inner %s %s\n' % (i,lt,i,gt)
+        grandChild = child.insertAsLastChild()
+        grandChild.h = '%s inner %s %s' % (lt,i,gt)
+        grandChild.b = 'return %s\n' % i
+    t = time.time()
+    at.write(root,kind='@file',thinFile=True,toString=True)
+    t = time.time()-t
+    report('write @file: %d sections' % (2*n),2*n,t)
+    assert at.errors == 0 and at.stringOutput.count('return') == n
+    c.close()
+#@+node:agent.20261018201429.1: *3* benchWriteLeo
+def benchWriteLeo(bridge,g,size):
+    '''
+    Time writing a .leo file containing size nodes with 2K of body text.
+    The second write reuses the escaped body text of the first.
+    tracemalloc (Python 3.4 and later) is required to measure memory.
+    '''
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    c = newOutline(bridge,'write-leo')
+    root = c.rootPosition()
+    body = 'if a < b and b > c: print("%s & %s" % (a,b))\n' * 44
+    for i in range(size):
+        child = root.insertAsLastChild()
+        child.v.h = 'node %s' % i
+        child.v.b = body
+    path = os.path.join(os.getcwd(),'write-leo-benchmark-output.leo')
+    try:
+        for label in ('write .leo file','write .leo file again'):
+            if tracemalloc:
+                tracemalloc.start()
+            t = time.time()
+            c.fileCommands.write_Leo_file(path,outlineOnlyFlag=True)
+            t = time.time()-t
+            report(label,size,t)
+            n = os.path.getsize(path)
+            print('  %-34s %6.1fMB %7.1fMB/sec' % ('throughput',n/1000000.0,n/1000000.0/t))
+            if tracemalloc:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print('  %-34s %6.1fMB' % ('peak memory',peak/1000000.0))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    c.close()
+#@-others
+
+benchmarksDict = {
+    'child-index': benchChildIndex,
+    'find-all': benchFindAll,
+    'fts': benchFts,
+    'import': benchImport,
+    'nodes': benchNodes,
+    'recolor': benchRecolor,
+    'scripts': benchScripts,
+    'sections': benchSections,
+    'shadow': benchShadow,
+    'write-leo': benchWriteLeo,
+}
+
+if __name__ == '__main__':
+    main()
+#@@language python
+#@@tabwidth -4
+#@-leo
@@ -20,9 +20,19 @@ import fnmatch
 import hashlib
 import os
 import stat
-# import time
+import threading
+import time
 import zlib
 
+try:
+    from multiprocessing.pool import ThreadPool
+except ImportError:
+    ThreadPool = None
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 # try:
     # import marshal
 # except ImportError:
@@ -58,10 +68,34 @@ class Cacher:
         # set by initFileDB and initGlobalDB...
         self.db = {}
             # 2011/07/30
-            # When caching is enabled will be a PickleShareDB instance.
+            # When caching is enabled will be a SqlitePickleShare instance,
+            # or a PickleShareDB instance if sqlite3 is not available.
         self.dbdirname = None # A string.
         self.inited = False
+        self.lazyStatChecks = None
+            # A list of (v,fileName) tuples while at.readAll defers stat checks.
+        self.pendingStats = {}
+            # Keys are file keys, values are (fileName,headline,stat) tuples.
+            # Set by readFile, used by writeFile.
+        self.prefetchDict = {}
+            # Keys are full paths, values are (headline,contents,key,stat) tuples.
+            # Set by prefetchFiles, used by readFile.
+
+    #@+node:agent.20261018193307.1: *4* createDB
+    def createDB (self,dbdirname,maxSize=0):
+        '''
+        Return a SqlitePickleShare for the file dbdirname.sqlite.
+        The first time, it migrates the PickleShareDB in directory dbdirname.
 
+        Return a PickleShareDB for dbdirname if sqlite3 is not available.
+        '''
+        if sqlite3:
+            try:
+                return SqlitePickleShare(dbdirname+'.sqlite',
+                    maxSize=maxSize,oldRoot=dbdirname)
+            except Exception:
+                g.es_exception()
+        return PickleShareDB(dbdirname)
     #@+node:ekr.20100208082353.5918: *4* initFileDB
     def initFileDB (self,fn):
 
@@ -83,7 +117,8 @@ class Cacher:
             self.dbdirname = dbdirname = join(g.app.homeLeoDir,'db',
                 '%s_%s' % (bname,hashlib.md5(fn).hexdigest()))
 
-            self.db = PickleShareDB(dbdirname)
+            megabytes = self.c.config.getInt('max-cache-db-size-mb') or 0
+            self.db = self.createDB(dbdirname,maxSize=megabytes*1024*1024)
             # Fixes bug 670108.
             self.c.db = self.db
             self.inited = True
@@ -98,7 +133,7 @@ class Cacher:
         # We always create the global db, even if caching is disabled.
         try:
             dbdirname = g.app.homeLeoDir + "/db/global"
-            self.db = db = PickleShareDB(dbdirname)
+            self.db = db = self.createDB(dbdirname)
             if trace: g.trace(db,dbdirname)
             self.inited = True
             return db
@@ -109,6 +144,16 @@ class Cacher:
 
         if changeName or not self.inited:
             self.initFileDB(fn)
+    #@+node:agent.20261018193307.2: *3* beginBatch & endBatch (Cacher)
+    def beginBatch (self):
+        '''Start writing to the db in a single transaction, if possible.'''
+        if hasattr(self.db,'beginBatch'):
+            self.db.beginBatch()
+
+    def endBatch (self):
+        '''End the transaction started by beginBatch.'''
+        if hasattr(self.db,'endBatch'):
+            self.db.endBatch()
     #@+node:ekr.20100209160132.5759: *3* clear/AllCache(s) (Cacher)
     def clearCache (self):
         if self.db:
@@ -257,6 +302,11 @@ class Cacher:
         child_v.h,child_v.b = h,b
         child_v.setDirty()
         c.changed = True # Tell getLeoFile to propegate dirty nodes.
+    #@+node:agent.20261018192859.2: *4* getPrefetchedContents
+    def getPrefetchedContents(self,fileName):
+        '''Return the prefetched contents of fileName, or None.'''
+        data = self.prefetchDict.get(fileName)
+        return data and data[1]
     #@+node:ekr.20100208082353.5923: *4* getCachedGlobalFileRatios
     def getCachedGlobalFileRatios (self):
 
@@ -315,6 +365,49 @@ class Cacher:
             d = {}
         if trace: g.trace(fn,key,data)
         return d
+    #@+node:agent.20261018192859.3: *4* prefetchFiles (Cacher)
+    def prefetchFiles(self,aList,threads=8):
+        '''
+        Read the files in aList, a list of (fileName,headline) tuples,
+        using a pool of worker threads.
+
+        The workers compute the cache key of each file and load the cached
+        outline, if any, into the db's memory cache. They never change the
+        outline. File i/o, md5 hashing and zlib decompression release the
+        GIL, so the workers run in parallel.
+        '''
+        trace = False and not g.unitTesting
+        if not aList: return
+        if trace: t1 = time.time()
+
+        def prefetch(data):
+            fileName,h = data
+            st = self.statFile(fileName)
+                # Stat the file *before* reading it.
+            try:
+                f = open(fileName,'rb')
+                s = f.read()
+                f.close()
+            except IOError:
+                return None
+            key = self.fileKey(h,s,requireEncodedString=True)
+            return fileName,h,s,key,st
+
+        if ThreadPool and len(aList) > 1:
+            pool = ThreadPool(min(threads,len(aList)))
+            try:
+                results = pool.map(prefetch,aList)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [prefetch(z) for z in aList]
+        for data in results:
+            if data:
+                fileName,h,s,key,st = data
+                self.prefetchDict[fileName] = (h,s,key,st)
+        if trace: g.trace('%s files in %2.3f sec' % (
+            len(self.prefetchDict),time.time()-t1))
     #@+node:ekr.20100208071151.5905: *4* readFile (Cacher)
     def readFile (self,fileName,root):
 
@@ -323,17 +416,22 @@ class Cacher:
         if not g.enableDB:
             if trace: g.trace('g.enableDB is False')
             return '',False,None
-        s,e = g.readFileIntoString(fileName,raw=True,silent=True)
-        if s is None:
-            if trace: g.trace('empty file contents',fileName)
-            return s,False,None
+        data = self.prefetchDict.pop(fileName,None)
+        if data and data[0] == root.h:
+            h,s,key,st = data
+        else:
+            st = self.statFile(fileName)
+                # Stat the file *before* reading it.
+            s,e = g.readFileIntoString(fileName,raw=True,silent=True)
+            if s is None:
+                if trace: g.trace('empty file contents',fileName)
+                return s,False,None
+            # There will be a bug if s is not already an encoded string.
+            key = self.fileKey(root.h,s,requireEncodedString=True)
         assert not g.isUnicode(s)
         if trace and verbose:
             for i,line in enumerate(g.splitLines(s)):
                 print('%3d %s' % (i,repr(line)))
-
-        # There will be a bug if s is not already an encoded string.
-        key = self.fileKey(root.h,s,requireEncodedString=True)
         ok = self.db and key in self.db
         if trace: g.trace('in cache',ok,fileName,key)
         if ok:
@@ -343,7 +441,63 @@ class Cacher:
             # Recreate the file from the cache.
             aList = self.db.get(key)
             self.createOutlineFromCacheList(root.v,aList,fileName=fileName)
+            self.recordStat(fileName,root.h,st,key)
+        else:
+            # writeFile will record the stat.
+            self.pendingStats[key] = (fileName,root.h,st)
         return s,ok,key
+    #@+node:agent.20261018193516.1: *4* readFileFromStat (Cacher)
+    def readFileFromStat (self,fileName,root):
+        '''
+        Recreate root's tree from the cache *without* reading fileName if the
+        (size,mtime_ns,inode) stat of fileName matches the stat recorded when
+        the file was last read.
+
+        While at.readAll defers stat checks, trust the recorded stat and
+        remember root.v and fileName in self.lazyStatChecks.
+
+        Return the recorded data, or None.
+        '''
+        trace = False and not g.unitTesting
+        if not g.enableDB or not self.db:
+            return None
+        data = self.db.get(self.statKey(fileName,root.h))
+        if not data:
+            return None
+        if self.lazyStatChecks is None:
+            st = self.statFile(fileName)
+            if not st or st[:3] != tuple(data[:3]):
+                if trace: g.trace('stat changed',fileName)
+                return None
+        aList = self.db.get(data[4])
+        if aList is None:
+            return None
+        if trace: g.trace('unchanged',fileName)
+        if self.lazyStatChecks is not None:
+            self.lazyStatChecks.append((root.v,fileName))
+        # Delete the previous tree, regardless of the @<file> type.
+        while root.hasChildren():
+            root.firstChild().doDelete()
+        self.createOutlineFromCacheList(root.v,aList,fileName=fileName)
+        return data
+    #@+node:agent.20261018193516.2: *4* statFile & statKey (Cacher)
+    def statFile (self,fileName):
+        '''Return the (size,mtime_ns,inode,mtime) stat of fileName, or None.'''
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return None
+        mtime_ns = getattr(st,'st_mtime_ns',None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1000000000)
+        return st.st_size,mtime_ns,st.st_ino,st.st_mtime
+
+    def statKey (self,fileName,h):
+        '''Return the db key of the recorded stat of fileName.'''
+        m = hashlib.md5()
+        m.update(g.toEncodedString(fileName))
+        m.update(g.toEncodedString(h))
+        return "fstat/" + m.hexdigest()
     #@+node:ekr.20100208082353.5927: *3* Writing
     #@+node:ekr.20100208071151.5901: *4* makeCacheList
     def makeCacheList(self,p):
@@ -358,6 +512,21 @@ class Cacher:
         return [
             p.h,p.b,p.gnx,
             [self.makeCacheList(p2) for p2 in p.children()]]
+    #@+node:agent.20261018193516.3: *4* recordStat
+    def recordStat(self,fileName,h,st,key):
+        '''
+        Record st, the stat of fileName taken before reading the file,
+        for use by readFileFromStat. key is the file key of the contents.
+        '''
+        if not st or not self.db:
+            return
+        if time.time() - st[3] < 2.0:
+            # The file may change again without changing its stat.
+            return
+        statKey = self.statKey(fileName,h)
+        data = tuple(st) + (key,)
+        if self.db.get(statKey) != data:
+            self.db[statKey] = data
     #@+node:ekr.20100208082353.5929: *4* setCachedGlobalsElement
     def setCachedGlobalsElement(self,fn):
 
@@ -417,6 +586,10 @@ class Cacher:
         else:
             if trace: g.trace('caching ',p.h,fileKey)
             self.db[fileKey] = self.makeCacheList(p)
+        data = fileKey and self.pendingStats.pop(fileKey,None)
+        if data and g.enableDB:
+            fileName,h,st = data
+            self.recordStat(fileName,h,st,fileKey)
     #@+node:ekr.20100208065621.5890: *3* test (Cacher)
     def test(self):
 
@@ -801,5 +974,265 @@ class PickleShareDB:
             self.cache.pop(it,None)
 
     #@-others
+#@+node:agent.20261018193251.1: ** class SqlitePickleShare
+class SqlitePickleShare:
+
+    """
+    A single-file replacement for PickleShareDB, using sqlite3.
+
+    Values are zlib-compressed pickles, as in PickleShareDB, stored in a
+    single table. beginBatch and endBatch group writes into a single
+    transaction. When the total size of all values exceeds maxSize, the
+    least recently used values are deleted.
+    """
+
+    #@+others
+    #@+node:agent.20261018193251.2: *3*  Birth & special methods
+    #@+node:agent.20261018193251.3: *4*  __init__ (SqlitePickleShare)
+    def __init__(self,fn,maxSize=0,oldRoot=None):
+
+        """
+        Init the SqlitePickleShare class.
+        fn:      The path to the database file. Created if it doesn't exist.
+        maxSize: The maximum total size of all values, in bytes. 0: no limit.
+        oldRoot: The directory of a PickleShareDB to migrate, or None.
+        """
+
+        trace = False and not g.unitTesting
+        self.fn = abspath(expanduser(fn))
+        if trace: g.trace('SqlitePickleShare',self.fn)
+        self.maxSize = maxSize
+        self.batchLevel = 0
+            # > 0: in a transaction started by beginBatch.
+        self.cache = {}
+            # Keys are keys, values are tuples (obj,stamp).
+        self.lock = threading.RLock()
+            # at.prefetchExternalFiles reads the db in worker threads.
+        self.touched = set()
+            # Keys read since the last call to _flushAccessTimes.
+        parent,junk = split(self.fn)
+        if parent and not isdir(parent):
+            os.makedirs(parent)
+        isNew = not isfile(self.fn)
+        self.conn = sqlite3.connect(self.fn,
+            isolation_level=None,check_same_thread=False)
+        self.conn.execute(
+            '''create table if not exists cachevalues(
+                key text primary key, data blob,
+                size integer, stamp real, atime real)''')
+        self.conn.execute(
+            'create index if not exists atime_index on cachevalues(atime)')
+        if isNew and oldRoot and isdir(oldRoot):
+            self.migrate(oldRoot)
+        row = self.conn.execute('select sum(size) from cachevalues').fetchone()
+        self.totalSize = row and row[0] or 0
+    #@+node:agent.20261018193251.4: *4* __contains__
+    def __contains__(self,key):
+
+        return self.has_key(key)
+    #@+node:agent.20261018193251.5: *4* __delitem__
+    def __delitem__(self,key):
+
+        """ del db["key"] """
+
+        key = g.toUnicode(key)
+        with self.lock:
+            self.cache.pop(key,None)
+            self.touched.discard(key)
+            row = self.conn.execute(
+                'select size from cachevalues where key=?',(key,)).fetchone()
+            if row:
+                self.conn.execute('delete from cachevalues where key=?',(key,))
+                self.totalSize -= row[0]
+    #@+node:agent.20261018193251.6: *4* __getitem__
+    def __getitem__(self,key):
+
+        """ db['key'] reading """
+
+        trace = False and not g.unitTesting
+        key = g.toUnicode(key)
+        with self.lock:
+            row = self.conn.execute(
+                'select stamp from cachevalues where key=?',(key,)).fetchone()
+            if not row:
+                raise KeyError(key)
+            stamp = row[0]
+            self.touched.add(key)
+            # Another Leo process may have changed the value.
+            if key in self.cache and stamp == self.cache[key][1]:
+                if trace: g.trace('(SqlitePickleShare: in cache)',key)
+                return self.cache[key][0]
+            row = self.conn.execute(
+                'select data from cachevalues where key=?',(key,)).fetchone()
+        try:
+            obj = pickle.loads(zlib.decompress(row[0]))
+        except Exception:
+            if trace: g.trace('***Exception',key)
+            raise KeyError(key)
+        with self.lock:
+            self.cache[key] = (obj,stamp)
+        if trace: g.trace('(SqlitePickleShare: set cache)',key)
+        return obj
+    #@+node:agent.20261018193251.7: *4* __iter__
+    def __iter__(self):
+
+        for k in list(self.keys()):
+            yield k
+    #@+node:agent.20261018193251.8: *4* __repr__
+    def __repr__(self):
+
+        return "SqlitePickleShare('%s')" % self.fn
+    #@+node:agent.20261018193251.9: *4* __setitem__
+    def __setitem__(self,key,value):
+
+        """ db['key'] = 5 """
+
+        trace = False and not g.unitTesting
+        if trace: g.trace('(SqlitePickleShare)',key)
+        key = g.toUnicode(key)
+        data = zlib.compress(pickle.dumps(value,pickle.HIGHEST_PROTOCOL))
+        stamp = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'select size from cachevalues where key=?',(key,)).fetchone()
+            if row:
+                self.totalSize -= row[0]
+            self.conn.execute(
+                'insert or replace into cachevalues values (?,?,?,?,?)',
+                (key,sqlite3.Binary(data),len(data),stamp,stamp))
+            self.totalSize += len(data)
+            self.cache[key] = (value,stamp)
+            self.touched.discard(key)
+            if not self.batchLevel:
+                self._flushAccessTimes()
+                self.evict()
+    #@+node:agent.20261018193251.10: *3* beginBatch & endBatch
+    def beginBatch(self):
+        '''Start a transaction that ends with the matching endBatch.'''
+        with self.lock:
+            if self.batchLevel == 0:
+                self.conn.execute('begin')
+            self.batchLevel += 1
+
+    def endBatch(self):
+        '''End the transaction started by the matching beginBatch.'''
+        with self.lock:
+            if self.batchLevel == 0:
+                return
+            self.batchLevel -= 1
+            if self.batchLevel == 0:
+                self._flushAccessTimes()
+                self.evict()
+                self.conn.execute('commit')
+    #@+node:agent.20261018193251.11: *3* clear
+    def clear(self,verbose=False):
+
+        if verbose:
+            g.red('clearing cache at file...\n')
+            g.es_print(self.fn)
+        with self.lock:
+            self.conn.execute('delete from cachevalues')
+            self.cache = {}
+            self.touched = set()
+            self.totalSize = 0
+    #@+node:agent.20261018193251.12: *3* evict
+    def evict(self):
+        '''
+        Delete the least recently used values until the total size of all
+        values is at most self.maxSize.
+        '''
+        trace = False and not g.unitTesting
+        with self.lock:
+            if not self.maxSize or self.totalSize <= self.maxSize:
+                return
+            self._flushAccessTimes()
+            aList = []
+            for key,size in self.conn.execute(
+                'select key,size from cachevalues order by atime'
+            ):
+                if self.totalSize <= self.maxSize:
+                    break
+                aList.append(key)
+                self.totalSize -= size
+            self.conn.executemany(
+                'delete from cachevalues where key=?',[(z,) for z in aList])
+            for key in aList:
+                self.cache.pop(key,None)
+            if trace: g.trace('evicted %s values' % len(aList))
+    #@+node:agent.20261018193251.13: *3* get
+    def get(self,key,default=None):
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    #@+node:agent.20261018193251.14: *3* has_key
+    def has_key(self,key):
+
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+    #@+node:agent.20261018193251.15: *3* items
+    def items(self):
+        return [z for z in self]
+    #@+node:agent.20261018193251.16: *3* keys
+    def keys(self,globpat=None):
+
+        """Return all keys in DB, or all keys matching a glob"""
+
+        with self.lock:
+            result = [z[0] for z in self.conn.execute('select key from cachevalues')]
+        if globpat is not None:
+            result = fnmatch.filter(result,globpat)
+        return result
+    #@+node:agent.20261018193251.17: *3* migrate
+    def migrate(self,root):
+        '''Copy all values of the PickleShareDB in directory root to this db.'''
+        trace = False and not g.unitTesting
+        old = PickleShareDB(root)
+        aList = []
+        for fn in old._walkfiles(old.root):
+            try:
+                f = open(fn,'rb')
+                data = f.read()
+                f.close()
+                mtime = os.path.getmtime(fn)
+            except (IOError,OSError):
+                continue
+            # Both classes store values as zlib-compressed pickles.
+            key = g.toUnicode(old._normalized(fn))
+            aList.append((key,sqlite3.Binary(data),len(data),mtime,mtime))
+        with self.lock:
+            self.conn.execute('begin')
+            self.conn.executemany(
+                'insert or replace into cachevalues values (?,?,?,?,?)',aList)
+            self.conn.execute('commit')
+        if trace: g.trace('migrated %s values from %s' % (len(aList),root))
+    #@+node:agent.20261018193251.18: *3* uncache
+    def uncache(self,*items):
+        """ Removes all, or specified items from cache
+
+        Use this after reading a large amount of large objects
+        to free up memory, when you won't be needing the objects
+        for a while.
+
+        """
+        if not items:
+            self.cache = {}
+        for it in items:
+            self.cache.pop(g.toUnicode(it),None)
+    #@+node:agent.20261018193251.19: *3* _flushAccessTimes
+    def _flushAccessTimes(self):
+        '''Record the access times of all values read since the last call.'''
+        with self.lock:
+            if self.touched:
+                atime = time.time()
+                self.conn.executemany(
+                    'update cachevalues set atime=? where key=?',
+                    [(atime,z) for z in self.touched])
+                self.touched = set()
+    #@-others
 #@-others
 #@-leo
@@ -191,7 +191,7 @@ class PythonQSyntaxHighlighter:
             layout = self.cb.layout()
             layout.setAdditionalFormats(self.formats)
             self.formats = []
-            self.d.markContentsDirty(self.cb.position(),self.cb.length())
+            # reformat_blocks_helper calls markContentsDirty for all blocks.
 
     #@+node:ekr.20140825132752.18592: *4* pqsh.delayedRehighlight
     def delayedRehighlight(self): # inline
@@ -240,6 +240,7 @@ class PythonQSyntaxHighlighter:
         '''The common code shared by reformatBlocks and idle_handler.'''
         block = self.r_block
         n,start = 0,False
+        first,last = block,None
         while self.is_valid(block) and (block.position() < self.r_end or self.r_force):
             n += 1
             if n >= self.r_limit > 0 and self.timer:
@@ -249,7 +250,13 @@ class PythonQSyntaxHighlighter:
                 before_state = block.userState()
                 self.reformatBlock(block)
                 self.r_force = block.userState() != before_state
+                last = block
                 block = self.r_block = block.next()
+        if last:
+            # Relayout all the reformatted blocks at once.
+            # Calling markContentsDirty for each block is very slow.
+            i = first.position()
+            self.d.markContentsDirty(i,last.position()+last.length()-i)
         self.formatChanges = []
         self.idle_active = start
         if self.timer and start:
@@ -317,7 +324,7 @@ class ColorizerMixin:
         pass
         
     def write_colorizer_cache (self,p):
-        '''Write colorizing data for p for later use by rehighlight_with_cache.'''
+        '''Keep the colorizing data for p in the color cache.'''
         pass
 
     #@+others
@@ -522,6 +529,10 @@ class JEditColorizer:
     # The string is useful for debugging; Qt only uses the corresponding number.
     #@-<< about the line-oriented jEdit colorizer >>
 
+    modeModules = {}
+        # Keys are paths to files in leo/modes, values are (mtime,module).
+        # Shared by all JEditColorizers: see importMode.
+
     #@+others
     #@+node:ekr.20110605121601.18571: *3*  Birth & init
     #@+node:ekr.20110605121601.18572: *4* __init__ (JeditColorizer)
@@ -585,11 +596,14 @@ class JEditColorizer:
         self.keywords = {} # Keys are keywords, values are 0..5.
         self.language_name = None # The name of the language for the current mode.
         self.last_language = None # The language for which configuration tags are valid.
+        self.tagSignatures = {} # Keys are languages, values are the configured fonts and colors.
         self.modes = {} # Keys are languages, values are modes.
         self.mode = None # The mode object for the present language.
         self.modeBunch = None # A bunch fully describing a mode.
+        self.modeAttributes = [] # (ivarName,value) tuples: set by setModeAttributes.
         self.modeStack = []
         self.rulesDict = {}
+        self.rulesetName = None # The name of the present ruleset.
         # self.defineAndExtendForthWords()
         self.word_chars = {} # Inited by init_keywords().
         self.setFontFromConfig()
@@ -915,6 +929,29 @@ class JEditColorizer:
             wrapper.end_tag_configure()
         except AttributeError:
             pass
+        self.clearCacheIfTagsChanged()
+    #@+node:agent.20261018231502.1: *4* clearCacheIfTagsChanged
+    def clearCacheIfTagsChanged (self):
+        '''
+        Clear the highlighter's cache if configure_tags has changed the fonts
+        or colors of the present language: cached format ranges use the old ones.
+        '''
+        cache = getattr(self.highlighter,'cache',None)
+        if not cache:
+            return
+        wrapper = self.wrapper
+        fonts = [(key,font.toString() if hasattr(font,'toString') else repr(font))
+            for key,font in self.fonts.items() if font]
+        signature = (
+            sorted(getattr(wrapper,'configDict',{}).items()),
+            sorted(getattr(wrapper,'configUnderlineDict',{}).items()),
+            sorted(fonts),
+        )
+        language = self.colorizer.language
+        old = self.tagSignatures.get(language)
+        if old is not None and old != signature:
+            cache.clear()
+        self.tagSignatures[language] = signature
     #@+node:ekr.20110605121601.18579: *4* configure_variable_tags
     def configure_variable_tags (self):
 
@@ -951,11 +988,8 @@ class JEditColorizer:
         self.global_i,self.global_j = 0,0
         self.global_offset = 0
         self.lineCount = 0
-        # These *must* be recomputed.
-        self.nextState = 1 # Dont use 0.
-        self.stateDict = {}
-        self.stateNameDict = {}
-        self.restartDict = {}
+        # Don't clear the state dicts: LeoQtSyntaxHighlighter.reformatBlock
+        # caches state numbers. A state name describes its restarter completely.
         self.init_mode(self.colorizer.language)
         self.clearState()
         self.showInvisibles = self.colorizer.showInvisibles
@@ -985,15 +1019,31 @@ class JEditColorizer:
                 return True
         else:
             if trace: g.trace(language,rulesetName)
-            # Bug fix: 2008/2/10: Don't try to import a non-existent language.
-            path = g.os_path_join(g.app.loadDir,'..','modes')
-            fn = g.os_path_join(path,'%s.py' % (language))
-            if g.os_path_exists(fn):
-                mode = g.importFromPath(moduleName=language,path=path)
-                if trace: g.trace(mode)
-            else:
-                mode = None
+            mode = self.importMode(language)
+            if trace: g.trace(mode)
             return self.init_mode_from_module(name,mode)
+    #@+node:agent.20261018203054.1: *5* importMode
+    def importMode (self,language):
+        '''
+        Return the module in leo/modes for the given language, or None.
+
+        Importing a mode re-executes the mode file, so the modules are cached
+        in JEditColorizer.modeModules and shared by all commanders. A module
+        is imported again only if its file has changed.
+        '''
+        path = g.os_path_join(g.app.loadDir,'..','modes')
+        fn = g.os_path_join(path,'%s.py' % (language))
+        # Bug fix: 2008/2/10: Don't try to import a non-existent language.
+        if not g.os_path_exists(fn):
+            return None
+        mtime = g.os_path_getmtime(fn)
+        data = self.modeModules.get(fn)
+        if data and data[0] == mtime:
+            return data[1]
+        mode = g.importFromPath(moduleName=language,path=path)
+        if mode:
+            self.modeModules[fn] = mtime,mode
+        return mode
     #@+node:btheado.20131124162237.16303: *5* init_mode_from_module
     def init_mode_from_module (self,name,mode):
 
@@ -1015,6 +1065,7 @@ class JEditColorizer:
                 keywordsDict    = {},
                 language        = 'unknown-language',
                 mode            = mode,
+                modeAttributes  = self.computeModeAttributes({}),
                 properties      = {},
                 rulesDict       = {},
                 rulesetName     = rulesetName,
@@ -1043,6 +1094,7 @@ class JEditColorizer:
             keywordsDict    = self.keywordsDict,
             language        = self.colorizer.language,
             mode            = self.mode,
+            modeAttributes  = self.modeAttributes,
             properties      = self.properties,
             rulesDict       = self.rulesDict,
             rulesetName     = self.rulesetName,
@@ -1116,13 +1168,20 @@ class JEditColorizer:
         for z in chars:
             self.word_chars[z] = z
         # g.trace(sorted(self.word_chars.keys()))
-    #@+node:ekr.20110605121601.18584: *5* setModeAttributes
+    #@+node:ekr.20110605121601.18584: *5* setModeAttributes & computeModeAttributes
     def setModeAttributes (self):
 
         '''Set the ivars from self.attributesDict,
         converting 'true'/'false' to True and False.'''
 
-        d = self.attributesDict
+        self.modeAttributes = self.computeModeAttributes(self.attributesDict)
+        for key,val in self.modeAttributes:
+            setattr(self,key,val)
+
+    def computeModeAttributes (self,d):
+
+        '''Return a list of (ivarName,value) tuples for attributes dict d.'''
+
         aList = (
             ('default',         'null'),
     	    ('digit_re',        ''),
@@ -1134,18 +1193,23 @@ class JEditColorizer:
 
         # g.trace(d)
 
+        result = []
         for key, default in aList:
             val = d.get(key,default)
             if val in ('true','True'): val = True
             if val in ('false','False'): val = False
-            setattr(self,key,val)
+            result.append((key,val),)
             # g.trace(key,val)
+        return result
     #@+node:ekr.20110605121601.18585: *5* initModeFromBunch
     def initModeFromBunch (self,bunch):
 
         self.modeBunch = bunch
         self.attributesDict = bunch.attributesDict
-        self.setModeAttributes()
+        # Don't call setModeAttributes: this is called for every delegate.
+        self.modeAttributes = bunch.modeAttributes
+        for key,val in bunch.modeAttributes:
+            setattr(self,key,val)
         self.defaultColor   = bunch.defaultColor
         self.keywordsDict   = bunch.keywordsDict
         self.colorizer.language = bunch.language
@@ -1183,9 +1247,9 @@ class JEditColorizer:
 
         '''Munge a mode name so that it is a valid python id.'''
 
-        valid = string.ascii_letters + string.digits + '_'
+        return self.munge_regex.sub('_',s).lower()
 
-        return ''.join([ch.lower() if ch in valid else '_' for ch in s])
+    munge_regex = re.compile(r'[^a-zA-Z0-9_]')
     #@+node:ekr.20110605121601.18588: *4* setFontFromConfig (jeditColorizer)
     def setFontFromConfig (self):
 
@@ -1514,6 +1578,7 @@ class JEditColorizer:
     kinds = '(file|ftp|gopher|http|https|mailto|news|nntp|prospero|telnet|wais)'
     # url_regex   = re.compile(r"""(file|ftp|http|https)://[^\s'"]+[\w=/]""")
     url_regex   = re.compile(r"""%s://[^\s'"]+[\w=/]""" % (kinds))
+    url_start_regex = re.compile(r'[fFhH]')
 
     def match_any_url(self,s,i):
         return self.match_compiled_regexp(s,i,kind='url',regexp=self.url_regex)
@@ -1941,7 +2006,9 @@ class JEditColorizer:
                     no_escape,no_line_break,no_word_break)
             self.setRestart(boundRestartMatchSpan,
                 # These must be keywords args.
-                delegate=delegate,end=end,kind=kind,
+                delegate=delegate,end=end,
+                exclude_match=exclude_match,
+                kind=kind,
                 no_escape=no_escape,
                 no_line_break=no_line_break,
                 no_word_break=no_word_break)
@@ -2142,7 +2209,7 @@ class JEditColorizer:
             # g.trace('========',n,stateName)
 
         return n
-    #@+node:ekr.20110605121601.18637: *3* colorRangeWithTag
+    #@+node:ekr.20110605121601.18637: *3* colorRangeWithTag & helper
     def colorRangeWithTag (self,s,i,j,tag,delegate='',exclude_match=False):
 
         '''Actually colorize the selected range.
@@ -2165,6 +2232,7 @@ class JEditColorizer:
             # self.setTag(tag,s,i,j) # 2011/05/31: Do the initial color.
             self.modeStack.append(self.modeBunch)
             self.init_mode(delegate)
+            start = None # The start of a run of unmatched characters.
             while 0 <= i < j and i < len(s):
                 progress = i
                 assert j >= 0,j
@@ -2174,15 +2242,17 @@ class JEditColorizer:
                         g.trace('Can not happen: delegate matcher returns None')
                     elif n > 0:
                         # if trace: g.trace('delegate',delegate,i,n,f.__name__,repr(s[i:i+n]))
+                        if start is not None:
+                            self.setDefaultTag(tag,s,start,i)
+                            start = None
                         i += n ; break
                 else:
-                    # New in Leo 4.6: Use the default chars for everything else.
-                    # New in Leo 4.8 devel: use the *delegate's* default characters if possible.
-                    default_tag = self.attributesDict.get('default')
-                    # g.trace(default_tag)
-                    self.setTag(default_tag or tag,s,i,i+1)
+                    # Color runs of unmatched characters with one call to setTag.
+                    if start is None: start = i
                     i += 1
                 assert i > progress
+            if start is not None:
+                self.setDefaultTag(tag,s,start,i)
             bunch = self.modeStack.pop()
             self.initModeFromBunch(bunch)
         elif not exclude_match:
@@ -2196,11 +2266,19 @@ class JEditColorizer:
             # Allow URL's *everywhere*.
             j = min(j,len(s))
             while i < j:
-                if s[i].lower() in 'fh': # file|ftp|http|https
-                    n = self.match_any_url(s,i)
-                    i += max(1,n)
-                else:
-                    i += 1
+                # Skip to the next possible url: file|ftp|http|https
+                m = self.url_start_regex.search(s,i,j)
+                if not m: break
+                i = m.start()
+                n = self.match_any_url(s,i)
+                i += max(1,n)
+    #@+node:agent.20261018203122.1: *4* setDefaultTag
+    def setDefaultTag (self,tag,s,i,j):
+        '''Color s[i:j], a range of characters not matched by any rule of a delegate.'''
+        # New in Leo 4.6: Use the default chars for everything else.
+        # New in Leo 4.8 devel: use the *delegate's* default characters if possible.
+        default_tag = self.attributesDict.get('default')
+        self.setTag(default_tag or tag,s,i,j)
     #@+node:ekr.20110605121601.18638: *3* mainLoop & restart
     def mainLoop(self,n,s):
         '''Colorize a *single* line s, starting in state n.'''
@@ -2663,41 +2741,82 @@ class LeoQtColorizer:
         if trace: g.trace(d)
         return d
     #@+node:ekr.20121003051050.10198: *3* write_colorizer_cache (LeoQtColorizer)
-    # Used info from qt/src/gui/text/qsyntaxhighlighter.cpp
-
     def write_colorizer_cache (self,p):
         '''
-        Write colorizing data for p for later use by rehighlight_with_cache.
+        Keep the colorizing data for p in the highlighter's color cache.
         Called from the node selection logic only if an @colorcache directive is in effect.
         '''
-        trace = False and not g.unitTesting
-        if not p: return
-        c = self.c
-        widget = c.frame.body.widget # a subclass of QTextBrowser
-        doc = widget.document()
-        if trace:
-            t1 = time.time()
-        aList = []
-        for i in range(doc.blockCount()):
-            b = doc.findBlockByNumber(i)
-            s = g.u(b.text())
-            layout = b.layout()
-            ranges = list(layout.additionalFormats()) # A list of FormatRange objects.
-            if ranges:
-                aList.append(g.bunch(i=i,ranges=ranges,s=s))
-                # Apparently not necessary.
-                    # ranges2 = []
-                    # for r in ranges:
-                        # # Hold the format in memory by copying it.
-                        # r.format = QtGui.QTextCharFormat(r.format)
-                        # ranges2.append(r)
-                    # aList.append(g.bunch(i=i,ranges=ranges2,s=s))
-        p.v.colorCache = g.bunch(aList=aList,n=doc.blockCount(),v=p.v)
-        if trace:
-            g.trace('%2.3f sec len(aList): %s v: %s' % (
-                time.time()-t1,len(aList),c.p.v.h,))
+        if p and self.highlighter and self.highlighter.cache:
+            self.highlighter.cache.select(p.v)
     #@-others
 
+#@+node:agent.20261018203502.1: ** class ColorizerCache
+class ColorizerCache:
+    '''
+    A cache of colorizing data for the lines of vnodes, with a limit on the
+    total number of lines. Vnodes are discarded least-recently-used first.
+
+    For each vnode, the cache is a dict. Keys describe a line and the state
+    of the colorer at the start of the line. Values are g.Bunches describing
+    the colorer's state at the end of the line and the
+    QTextLayout.FormatRange objects that color the line.
+
+    See LeoQtSyntaxHighlighter.reformatBlock.
+    '''
+    #@+others
+    #@+node:agent.20261018203502.2: *3* cache.ctor
+    def __init__(self,maxLines):
+        '''Ctor for ColorizerCache class.'''
+        self.count = 0 # The number of calls to select.
+        self.d = {} # Keys are vnodes, values are g.Bunch(count,lines).
+        self.maxLines = maxLines
+        self.size = 0 # An upper bound on the number of cached lines.
+        self.v = None # The most recently selected vnode.
+    #@+node:agent.20261018203502.3: *3* cache.clear
+    def clear(self,v=None):
+        '''Discard the cached lines for v, or all cached lines if v is None.'''
+        if v is None:
+            self.d = {}
+            self.size = 0
+            self.v = None
+        elif v in self.d:
+            del self.d[v]
+            if v == self.v:
+                self.v = None
+    #@+node:agent.20261018203502.4: *3* cache.put
+    def put(self,lines,key,bunch):
+        '''Add a line to lines, a dict returned by select.'''
+        lines[key] = bunch
+        self.size += 1
+        if self.size > self.maxLines:
+            self.trim()
+    #@+node:agent.20261018203502.5: *3* cache.select
+    def select(self,v):
+        '''Return the dict of cached lines for v and mark v as most recently used.'''
+        self.count += 1
+        bunch = self.d.get(v)
+        if bunch:
+            bunch.count = self.count
+        else:
+            bunch = self.d[v] = g.Bunch(count=self.count,lines={})
+        self.v = v
+        return bunch.lines
+    #@+node:agent.20261018203502.6: *3* cache.trim
+    def trim(self):
+        '''Discard the least-recently used vnodes until the cache is small enough.'''
+        aList = sorted(self.d.items(),key=lambda data: data[1].count)
+        size = sum([len(bunch.lines) for v,bunch in aList])
+        for v,bunch in aList:
+            if size <= self.maxLines:
+                break
+            size -= len(bunch.lines)
+            if v == self.v:
+                # Don't change the dict returned by select.
+                bunch.lines.clear()
+            else:
+                del self.d[v]
+        self.size = size
+    #@-others
 #@+node:ekr.20110605121601.18565: ** class LeoQtSyntaxHighlighter
 # This is c.frame.body.colorizer.highlighter
 
@@ -2734,21 +2853,25 @@ class LeoQtSyntaxHighlighter(base_highlighter):
             colorizer=colorizer,
             highlighter=self,
             wrapper=c.frame.body.wrapper)
+        # The color cache. Only PythonQSyntaxHighlighter calls reformatBlock.
+        n = c.config.getInt('colorizer-cache-lines')
+        self.cache = ColorizerCache(maxLines=n) if python_qsh and n and n > 0 else None
+        self.lines = None # The dict returned by self.cache.select.
+        self.ranges = [] # The format ranges set by the last call to highlightBlock.
     #@+node:ekr.20110605121601.18567: *3* highlightBlock (LeoQtSyntaxHighlighter)
     def highlightBlock (self,s):
         """ Called by QSyntaxHiglighter """
-        trace = False and not g.unitTesting
         if self.hasCurrentBlock and not self.colorizer.killColorFlag:
             if g.isPython3:
                 s = str(s)
             else:
                 s = unicode(s)
+            n = len(self.formats) if python_qsh else 0
             self.colorer.recolor(s)
-            v = self.c.p.v
-            if hasattr(v,'colorCache') and v.colorCache and not self.colorizer.changingText:
-                if trace: g.trace('clearing cache',g.callers())
-                self.c.p.v.colorCache = None # Kill the color caching.
-    #@+node:ekr.20110605121601.18568: *3* rehighlight  (leoQtSyntaxhighligher) & helper
+            if python_qsh:
+                # Remember the formats for reformatBlock.
+                self.ranges = self.formats[n:]
+    #@+node:ekr.20110605121601.18568: *3* rehighlight (leoQtSyntaxhighligher)
     def rehighlight (self,p):
         '''Override base rehighlight method'''
         # pylint: disable=arguments-differ
@@ -2770,51 +2893,55 @@ class LeoQtSyntaxHighlighter(base_highlighter):
             old_selecting = tree.selecting
             try:
                 tree.selecting = True
-                if (
-                    self.colorizer.colorCacheFlag
-                    and hasattr(p.v,'colorCache') and p.v.colorCache
-                    and not g.unitTesting
-                ):
-                    # Should be no need to init the colorizer.
-                    self.rehighlight_with_cache(p.v.colorCache)
-                else:
-                    self.colorer.init(p,p.b)
-                    base_highlighter.rehighlight(self)
+                self.colorer.init(p,p.b)
+                if self.cache:
+                    self.lines = self.cache.select(p.v)
+                base_highlighter.rehighlight(self)
             finally:
                 tree.selecting = old_selecting
         if trace:
             g.trace('(LeoQtSyntaxHighlighter) recolors: %4s %2.3f sec' % (
                 self.colorer.recolorCount-n,time.time()-t1))
-    #@+node:ekr.20121003051050.10201: *4* rehighlight_with_cache (LeoQtSyntaxHighlighter)
-    def rehighlight_with_cache (self,bunch):
+    #@+node:agent.20261018203502.7: *3* reformatBlock (LeoQtSyntaxHighlighter)
+    def reformatBlock (self,block):
         '''
-        Rehighlight the block from bunch, without calling QSH.rehighlight.
-
-        - bunch.aList: a list of bunch2 objects.
-        - bunch.n: a block (line) number.
-        - bunch.v: the VNode.
-            - bunch2.i: the index of the block.
-            - bunch2.s: the contents of the block.
-            - bunch2.ranges: a list of QTextLayout.FormatRange objects.
+        Override PythonQSyntaxHighlighter.reformatBlock.
+
+        Reuse the cached formats of the block if its text and the state of the
+        colorer at its start are unchanged. Otherwise, recolor the block and
+        cache the result.
         '''
-        trace = False and not g.unitTesting
-        widget = self.c.frame.body.widget # a subclass of QTextEdit.
-        doc = widget.document()
-        if bunch.n != doc.blockCount():
-            return g.trace('bad block count: expected %s got %s' % (
-                bunch.n,doc.blockCount()))
-        if trace:
-            t1 = time.time()
-        for i,bunch2 in enumerate(bunch.aList):
-            b = doc.findBlockByNumber(bunch2.i) # a QTextBlock
-            layout = b.layout() # a QTextLayout.
-            if bunch2.s == g.u(b.text()):
-                layout.setAdditionalFormats(bunch2.ranges)
-            else:
-                return g.trace('bad line: i: %s\nexpected %s\ngot     %s' % (
-                    i,bunch2.s,g.u(b.text())))
-        if trace:
-            g.trace('%2.3f sec' % (time.time()-t1))
+        c,colorer,colorizer = self.c,self.colorer,self.colorizer
+        if not self.cache or colorizer.changingText or colorizer.killColorFlag:
+            return base_highlighter.reformatBlock(self,block)
+        if self.cache.v != c.p.v:
+            self.lines = self.cache.select(c.p.v)
+        s = g.u(block.text())
+        previous = block.previous()
+        state = previous.userState() if self.is_valid(previous) else -1
+        key = (s,state,colorer.rulesetName,colorer.language_name,
+            colorizer.flag,colorer.showInvisibles)
+        bunch = self.lines.get(key)
+        if bunch:
+            # Restore the colorer's state at the end of the line.
+            if colorer.rulesetName != bunch.rulesetName:
+                colorer.initModeFromBunch(colorer.modes.get(bunch.rulesetName))
+            colorer.language_name = bunch.language_name
+            colorizer.flag = bunch.flag
+            block.setUserState(bunch.state)
+            block.layout().setAdditionalFormats(bunch.ranges)
+        else:
+            self.ranges = []
+            base_highlighter.reformatBlock(self,block)
+            # The coloring of section references depends on the outline.
+            if s.find('<<') == -1 and colorer.modes.get(colorer.rulesetName):
+                self.cache.put(self.lines,key,g.Bunch(
+                    flag=colorizer.flag,
+                    language_name=colorer.language_name,
+                    ranges=self.ranges,
+                    rulesetName=colorer.rulesetName,
+                    state=block.userState(),
+                ))
     #@-others
 #@+node:ekr.20140906095826.18717: ** class NullScintillaLexer
 if Qsci:
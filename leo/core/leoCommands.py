@@ -145,6 +145,8 @@ class Commands (object):
 
         '''Init per-document ivars.'''
 
+        self.directivesCache = {}
+            # Keys are gnx's, values are the data for g.get_directives_dict.
         self.expansionLevel = 0
             # The expansion level of this outline.
         self.expansionNode = None
@@ -1238,33 +1240,45 @@ class Commands (object):
     def refreshFromDisk(self,event=None):
         '''Refresh and @<file> node from disk.'''
         c,p = self,self.p
-        fn = p.anyAtFileNodeName()
-        if fn:
-            at = c.atFileCommands
-            c.recreateGnxDict()
-                # Fix bug 1090950 refresh from disk: cut node ressurection.
-            i = g.skip_id(p.h,0,chars='@')
-            word=p.h[0:i]
-            if word == '@auto':
-                p.deleteAllChildren()
-                at.readOneAtAutoNode(fn,p)
-                c.redraw()
-            elif word in ('@thin','@file'):
-                p.deleteAllChildren()
-                at.read(p,force=True)
-                c.redraw()
-            elif word == '@shadow ':
-                p.deleteAllChildren()
-                at.read(p,force=True,atShadow=True)
+        if p.anyAtFileNodeName():
+            if c.refreshNodeFromDisk(p):
                 c.redraw()
-            elif word == '@edit':
-                p.deleteAllChildren()
-                at.readOneAtEditNode(fn,p)
-                c.redraw()
-            else:
-                g.es_print('can not refresh from disk\n%s' % p.h)
         else:
             g.warning('not an @<file> node:\n%s' % (p.h))
+    #@+node:agent.20261018212816.1: *6* c.refreshNodeFromDisk
+    def refreshNodeFromDisk(self,p):
+        '''
+        Re-read the @<file> tree at p from disk, without redrawing.
+        Return True if p's tree was re-read.
+        '''
+        c = self
+        fn = p.anyAtFileNodeName()
+        if not fn:
+            return False
+        at = c.atFileCommands
+        c.recreateGnxDict()
+            # Fix bug 1090950 refresh from disk: cut node ressurection.
+        i = g.skip_id(p.h,0,chars='@')
+        word=p.h[0:i]
+        if word == '@auto':
+            p.deleteAllChildren()
+            at.readOneAtAutoNode(fn,p)
+        elif word in ('@thin','@file'):
+            p.deleteAllChildren()
+            at.read(p,force=True)
+        elif word == '@shadow':
+            p.deleteAllChildren()
+            at.read(p,force=True,atShadow=True)
+        elif word == '@edit':
+            p.deleteAllChildren()
+            at.readOneAtEditNode(fn,p)
+        else:
+            g.es_print('can not refresh from disk\n%s' % p.h)
+            return False
+        # Refreshing can not be undone, and undo beads may
+        # describe nodes or bodies that no longer exist.
+        c.undoer.clearUndoState()
+        return True
     #@+node:ekr.20031218072017.2834: *6* c.save
     def save (self,event=None,fileName=None):
 
@@ -1981,11 +1995,11 @@ class Commands (object):
             if c.write_script_file:
                 scriptFile = self.writeScriptFile(script)
                 if g.isPython3:
-                    exec(compile(script,scriptFile,'exec'),d)
+                    exec(g.app.scriptCache.compileScript(script,scriptFile),d)
                 else:
                     execfile(scriptFile,d)
             else:
-                exec(script,d)
+                exec(g.app.scriptCache.compileScript(script),d)
         finally:
             g.inScript = g.app.inScript = False
     #@+node:ekr.20031218072017.2143: *7* c.redirectScriptOutput
@@ -6708,8 +6722,8 @@ class Commands (object):
                 if c.positionExists(p):
                     v = p.v
                     parent_v = p.stack[-1][0] if p.stack else c.hiddenRootNode
-                    if v in parent_v.children:
-                        childIndex = parent_v.children.index(v)
+                    childIndex = parent_v._indexOfChild(v)
+                    if childIndex > -1:
                         if trace: g.trace('deleting',parent_v,childIndex,v)
                         v._cutLink(childIndex,parent_v)
                     else:
@@ -8082,16 +8096,14 @@ class Commands (object):
         assert (c == context)
         positions = []
         for immediate in v.parents:
-            if v in immediate.children:
-                n = immediate.children.index(v)
-            else:
+            n = immediate._indexOfChild(v)
+            if n == -1:
                 continue
             stack = [(v,n)]
             while immediate.parents:
                 parent = immediate.parents[0]
-                if immediate in parent.children:
-                    n = parent.children.index(immediate)
-                else:
+                n = parent._indexOfChild(immediate)
+                if n == -1:
                     break
                 stack.insert(0,(immediate,n),)
                 immediate = parent
@@ -8112,9 +8124,8 @@ class Commands (object):
         stack = []
         while v.parents:
             parent = v.parents[0]
-            if v in parent.children:
-                n = parent.children.index(v)
-            else:
+            n = parent._indexOfChild(v)
+            if n == -1:
                 return None
             stack.insert(0,(v,n),)
             v = parent
@@ -1467,12 +1467,15 @@ class ControlCommandsClass (BaseEditCommandsClass):
             'act-on-node':              self.actOnNode,
 
             # Plugin info.
+            'clear-hook-stats':         self.clearHookStats,
+            'print-hook-stats':         self.printHookStats,
             'print-plugin-handlers':    self.printPluginHandlers,
             'print-plugins-info':       self.printPluginsInfo,
 
             # Shell commands.
             'shell-command':            self.shellCommand,
             'shell-command-on-region':  self.shellCommandOnRegion,
+            'toggle-hook-profiler':     self.toggleHookProfiler,
         }
     #@+node:ekr.20050922110030: *3* advertizedUndo
     def advertizedUndo (self,event):
@@ -1493,6 +1496,24 @@ class ControlCommandsClass (BaseEditCommandsClass):
             # Inits vim mode too.
         g.es('Done: %s' % command)
     #@+node:ekr.20070429090859: *3* print plugins info...
+    def clearHookStats (self,event=None):
+
+        '''Clear the statistics gathered by the hook profiler.'''
+
+        profiler = g.app.pluginsController.hookProfiler
+        if profiler:
+            profiler.clear()
+
+    def printHookStats (self,event=None):
+
+        '''
+        Print the number of calls and the time taken by each hook handler.
+        Use toggle-hook-profiler, @bool profile-hooks or --trace-hooks to
+        gather these statistics.
+        '''
+
+        g.app.pluginsController.printHookStats(self.c)
+
     def printPluginHandlers (self,event=None):
 
         '''Print the handlers for each plugin.'''
@@ -1516,6 +1537,15 @@ class ControlCommandsClass (BaseEditCommandsClass):
         that enables the plugin.'''
 
         g.app.pluginsController.printPluginsInfo(self.c)
+
+    def toggleHookProfiler (self,event=None):
+
+        '''Start or stop gathering statistics about hook handlers.'''
+
+        if g.app.pluginsController.toggleHookProfiler():
+            g.es('profiling hooks')
+        else:
+            g.es('hook profiling disabled')
     #@+node:ekr.20060603161041: *3* setSilentMode
     def setSilentMode (self,event=None):
 
@@ -10166,6 +10196,7 @@ class SearchCommandsClass (BaseEditCommandsClass):
         'isearch-with-present-options':   find.isearchWithPresentOptions,
         'replace':                        find.change,
         'replace-all':                    find.minibufferReplaceAll,
+        'replace-all-preview':            find.changeAllPreviewCommand,
         # 'replace-string':               find.setReplaceString,
         'replace-then-find':              find.changeThenFindCommand,
         're-search-forward':              find.reSearchForward,
@@ -14,6 +14,7 @@ import leo.core.leoGlobals as g
 import leo.core.leoNodes as leoNodes
 import binascii
 import difflib
+import filecmp
 
 if g.isPython3:
     import io # Python 3.x
@@ -22,12 +23,14 @@ if g.isPython3:
 else:
     import cStringIO # Python 2.x
     StringIO = cStringIO.StringIO
+    BytesIO = cStringIO.StringIO
 
 import os
 import pickle
 import string
 import sys
 import tempfile
+import threading
 import types
 import zipfile
 
@@ -40,6 +43,12 @@ except Exception:
 
 # The following is sometimes used.
 # import time
+
+# fc.replaceFile gives new files the modes allowed by the umask.
+# os.umask can only read the umask by changing it for the whole
+# process, so read it here, before any background save can start.
+processUmask = os.umask(0)
+os.umask(processUmask)
 #@-<< imports >>
 #@+<< define exception classes >>
 #@+node:ekr.20060918164811: ** << define exception classes >>
@@ -53,6 +62,264 @@ class BadLeoFile(Exception):
 class InvalidPaste(Exception):
     pass
 #@-<< define exception classes >>
+#@+<< define class ChunkedWriter >>
+#@+node:agent.20261018201245.1: ** << define class ChunkedWriter >>
+class ChunkedWriter:
+
+    '''
+    A write-only file-like object that writes strings to an open binary
+    file in large chunks.
+
+    fc.put writes many small strings. Collecting them is much faster than
+    writing them one at a time, and collecting only chunkSize characters
+    at a time uses much less memory than collecting the entire .leo file.
+    '''
+
+    def __init__ (self,theFile,encoding,chunkSize=1024*1024):
+        '''Ctor for ChunkedWriter class.'''
+        self.chunks = []
+        self.chunkSize = chunkSize
+        self.encoding = encoding
+        self.size = 0 # The total length of self.chunks.
+        self.theFile = theFile
+
+    def close (self):
+        '''Flush the output and close the file.'''
+        self.flush()
+        self.theFile.close()
+
+    def flush (self):
+        '''Write all collected strings to the file.'''
+        if self.chunks:
+            s = ''.join(self.chunks)
+            self.chunks = []
+            self.size = 0
+            if g.isPython3:
+                # In Python 2, fc.put has already encoded s.
+                s = bytes(s,self.encoding,'replace')
+            self.theFile.write(s)
+
+    def write (self,s):
+        '''Collect s, writing the collected strings when they are large enough.'''
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= self.chunkSize:
+            self.flush()
+#@-<< define class ChunkedWriter >>
+#@+<< define class BackgroundSaver >>
+#@+node:agent.20261018201903.1: ** << define class BackgroundSaver >>
+class BackgroundSaver:
+
+    '''
+    Save the .leo file and all changed external files in two stages.
+
+    Stage 1 runs in Leo's main thread. It writes the .leo file to a temp
+    file in large chunks and computes the contents of all dirty external
+    files without writing them.
+
+    Stage 2 runs in a separate thread. It compares the new contents with
+    the files on disk and atomically replaces the files that differ. It
+    does not touch the outline and does not call g.es. An idle-time
+    handler reports the results in the main thread.
+
+    Save requests made while stage 2 is running are merged into a single
+    save that starts when stage 2 ends.
+    '''
+
+    #@+others
+    #@+node:agent.20261018201903.2: *3*  bs.ctor
+    def __init__ (self,c):
+        '''Ctor for BackgroundSaver class.'''
+        self.c = c
+        self.jobs = [] # g.Bunches describing the files to write.
+        self.pendingFileName = None # The file to save when stage 2 ends.
+        self.thread = None # The stage 2 thread.
+        self.timer = None # The g.IdleTime that waits for the thread.
+    #@+node:agent.20261018201903.3: *3* bs.isBusy & merge
+    def isBusy (self):
+        '''Return True if a save is in progress.'''
+        return self.thread is not None
+
+    def merge (self,fileName):
+        '''Save fileName again as soon as the save in progress ends.'''
+        self.pendingFileName = fileName
+    #@+node:agent.20261018201903.4: *3* bs.save (stage 1)
+    def save (self,fileName,silent=False):
+        '''
+        Write the .leo file to a temp file and compute the contents of all
+        external files in the main thread, then replace the files in a
+        separate thread. Return False if the .leo file will not be written.
+        '''
+        c = self.c ; at = c.atFileCommands ; fc = c.fileCommands
+        assert not self.isBusy()
+        at.deferredWrites = []
+        try:
+            ok = fc.write_Leo_file(fileName,outlineOnlyFlag=False,toTempFile=True)
+            jobs = at.deferredWrites
+        finally:
+            at.deferredWrites = None
+        if ok:
+            jobs.append(g.Bunch(
+                isLeoFile=True,
+                silent=silent,
+                shortFileName=g.shortFileName(fileName),
+                targetFileName=fileName,
+                tempName=fc.tempFileName,
+            ))
+            fc.tempFileName = None
+        if jobs:
+            self.start(jobs)
+        return ok
+    #@+node:agent.20261018201903.5: *3* bs.start & wait
+    def start (self,jobs):
+        '''Start stage 2 and a timer to report its results.'''
+        for job in jobs:
+            job.error = job.result = None
+            job.lineEndingsOnly = False
+        self.jobs = jobs
+        self.thread = threading.Thread(target=self.run,name='leo-save')
+        self.thread.start()
+        self.timer = g.IdleTime(self.poll,delay=100,tag='background-save')
+        if self.timer:
+            self.timer.start()
+        # Otherwise, there is no gui and fc.save calls self.wait().
+
+    def wait (self):
+        '''Wait for the save in progress, if any, and report its results.'''
+        while self.isBusy():
+            self.finish()
+    #@+node:agent.20261018201903.6: *3* bs.poll & finish
+    def poll (self,timer):
+        '''An idle-time handler that waits for stage 2 to end.'''
+        if self.thread and not self.thread.is_alive():
+            self.finish()
+
+    def finish (self):
+        '''Wait for stage 2, report its results and start any merged save.'''
+        if self.timer:
+            self.timer.stop()
+            self.timer = None
+        self.thread.join()
+        self.thread = None
+        jobs,self.jobs = self.jobs,[]
+        self.report(jobs)
+        fileName,self.pendingFileName = self.pendingFileName,None
+        if fileName and self.c.exists:
+            self.c.fileCommands.save(fileName)
+    #@+node:agent.20261018201903.7: *3* bs.report
+    def report (self,jobs):
+        '''Report the results of stage 2 in the main thread.'''
+        c = self.c ; at = c.atFileCommands ; fc = c.fileCommands
+        for job in jobs:
+            fn = job.targetFileName
+            if job.error:
+                g.error('error writing',fn)
+                g.es_print(job.error,color='red')
+                g.es('not written:',job.shortFileName)
+                if job.get('root'):
+                    job.root.setDirty()
+                    job.root.setOrphan()
+                c.setChanged(True)
+                continue
+            if job.result != 'unchanged':
+                c.setFileTimeStamp(fn)
+            if job.get('isLeoFile'):
+                if not job.silent:
+                    fc.putSavedMessage(fn)
+            elif job.result == 'unchanged':
+                if not g.unitTesting:
+                    g.es('unchanged:',job.shortFileName)
+            elif job.result == 'created':
+                if not g.unitTesting:
+                    g.es('created:',fn)
+                if job.get('root'):
+                    at.rememberReadPath(fn,job.root)
+            else:
+                if job.get('root'):
+                    at.checkPythonCode(job.root,s=job.contents,targetFn=fn)
+                if job.lineEndingsOnly:
+                    g.warning("correcting line endings in:",fn)
+                if not g.unitTesting:
+                    g.es('wrote:',job.shortFileName)
+        c.redraw_after_icons_changed()
+    #@+node:agent.20261018201903.8: *3* bs.run & helpers (stage 2)
+    def run (self):
+        '''Write all jobs. This method runs in a separate thread.'''
+        for job in self.jobs:
+            try:
+                if job.get('isLeoFile'):
+                    job.result = self.writeLeoFile(job)
+                else:
+                    job.result = self.writeExternalFile(job)
+            except Exception:
+                typ,val,tb = sys.exc_info()
+                job.error = '%s: %s' % (typ.__name__,val)
+    #@+node:agent.20261018201903.9: *4* bs.writeExternalFile
+    def writeExternalFile (self,job):
+        '''
+        Write job.contents to job.targetFileName if the contents differ.
+        Return 'created', 'unchanged' or 'wrote'.
+        '''
+        at = self.c.atFileCommands
+        fn = job.targetFileName
+        s = job.contents
+        exists = os.path.exists(fn)
+        if exists:
+            f = open(fn,'rb')
+            try:
+                s2 = f.read()
+            finally:
+                f.close()
+            if at.compareStrings(s,job.encoding,s2,None,
+                ignoreLineEndings=not job.explicitLineEnding,
+                ignoreBlankLines=job.ignoreBlankLines,
+            ):
+                return 'unchanged'
+            job.lineEndingsOnly = job.explicitLineEnding and at.compareStrings(
+                s,job.encoding,s2,None,ignoreLineEndings=True)
+        s = g.toUnicode(s,encoding=job.encoding)
+        if job.output_newline != '\n':
+            s = s.replace('\r','').replace('\n',job.output_newline)
+        self.writeFile(fn,g.toEncodedString(s,encoding=job.encoding))
+        return 'wrote' if exists else 'created'
+    #@+node:agent.20261018201903.10: *4* bs.writeFile
+    def writeFile (self,fileName,s):
+        '''Atomically replace fileName with the bytes s.'''
+        fc = self.c.fileCommands
+        theDir = os.path.dirname(os.path.realpath(fileName))
+        fd,tempName = tempfile.mkstemp(dir=theDir,
+            prefix='.%s-' % os.path.basename(fileName),suffix='.tmp')
+        try:
+            f = os.fdopen(fd,'wb')
+            try:
+                f.write(s)
+            finally:
+                f.close()
+            fc.replaceFile(tempName,fileName)
+        except Exception:
+            if os.path.exists(tempName):
+                os.remove(tempName)
+            raise
+    #@+node:agent.20261018201903.11: *4* bs.writeLeoFile
+    def writeLeoFile (self,job):
+        '''
+        Replace the .leo file with job.tempName, the temp file written by
+        stage 1, if their contents differ. Return 'unchanged' or 'wrote'.
+        '''
+        fc = self.c.fileCommands
+        fn,tempName = job.targetFileName,job.tempName
+        try:
+            if os.path.exists(fn) and filecmp.cmp(tempName,fn,shallow=False):
+                os.remove(tempName)
+                return 'unchanged'
+            fc.replaceFile(tempName,fn)
+        except Exception:
+            if os.path.exists(tempName):
+                os.remove(tempName)
+            raise
+        return 'wrote'
+    #@-others
+#@-<< define class BackgroundSaver >>
 
 if sys.platform != 'cli':
     #@+<< define sax classes >>
@@ -521,6 +788,286 @@ if sys.platform != 'cli':
             g.pr('children:',g.listToString(self.children))
             g.pr('attrs:',list(self.attributes.values()))
         #@-others
+    #@+node:agent.20261018200623.1: *3* class LazyUnknownAttributes (dict)
+    class LazyUnknownAttributes(dict):
+
+        '''A dict of unknown attributes read from a <v> or <t> element.
+
+        Most values are hexlified pickles. They are unpickled (by fc.getSaxUa)
+        the first time any value is accessed, so reading an outline does not
+        pay for attributes that are never used. Keys are available at once.'''
+
+        __slots__ = ('decoder',)
+
+        #@+others
+        #@+node:agent.20261018200623.2: *4*  ctor & decode (LazyUnknownAttributes)
+        def __init__(self,decoder,d):
+            '''Ctor for the LazyUnknownAttributes class.
+            d is a dict of undecoded values.'''
+            self.decoder = decoder
+                # A function f(key,val) returning the decoded value,
+                # or None when all values have been decoded.
+            dict.__init__(self,d)
+
+        def decode(self):
+            '''Decode all values in place.'''
+            decoder = self.decoder
+            if decoder:
+                self.decoder = None
+                for key in dict.keys(self):
+                    dict.__setitem__(self,key,decoder(key,dict.__getitem__(self,key)))
+        #@+node:agent.20261018200623.3: *4* dict overrides (LazyUnknownAttributes)
+        # Methods that expose values decode them first.
+
+        def __getitem__(self,key):
+            self.decode()
+            return dict.__getitem__(self,key)
+
+        def __iter__(self):
+            # Overriding __iter__ makes dict(self) and {}.update(self) use
+            # __getitem__ rather than copying the undecoded values.
+            return dict.__iter__(self)
+
+        def __eq__(self,other):
+            self.decode()
+            return dict.__eq__(self,other)
+
+        def __ne__(self,other):
+            self.decode()
+            return dict.__ne__(self,other)
+
+        def __reduce__(self):
+            # Pickle and copy as a plain dict.
+            self.decode()
+            return (dict,(dict(self),))
+
+        def __repr__(self):
+            self.decode()
+            return dict.__repr__(self)
+
+        def __setitem__(self,key,val):
+            self.decode()
+            dict.__setitem__(self,key,val)
+
+        __str__ = __repr__
+
+        def copy(self):
+            self.decode()
+            return dict(self)
+
+        def get(self,key,default=None):
+            self.decode()
+            return dict.get(self,key,default)
+
+        def items(self):
+            self.decode()
+            return dict.items(self)
+
+        def pop(self,*args):
+            self.decode()
+            return dict.pop(self,*args)
+
+        def popitem(self):
+            self.decode()
+            return dict.popitem(self)
+
+        def setdefault(self,key,default=None):
+            self.decode()
+            return dict.setdefault(self,key,default)
+
+        def update(self,*args,**keys):
+            self.decode()
+            dict.update(self,*args,**keys)
+
+        def values(self):
+            self.decode()
+            return dict.values(self)
+
+        if not g.isPython3:
+
+            def iteritems(self):
+                self.decode()
+                return dict.iteritems(self)
+
+            def itervalues(self):
+                self.decode()
+                return dict.itervalues(self)
+        #@-others
+    #@+node:agent.20261018200623.4: *3* class SaxStreamingHandler (SaxContentHandler)
+    class SaxStreamingHandler (SaxContentHandler):
+
+        '''A sax content handler that creates vnodes as <v> and <t> elements
+        arrive, instead of building a tree of SaxNodeClass objects that
+        fc.createSaxChildren must traverse in a second pass.
+
+        The vnodes have the same links, headlines, bodies and attributes
+        that fc.createSaxChildren would have given them.'''
+
+        #@+others
+        #@+node:agent.20261018200623.5: *4*  __init__ (SaxStreamingHandler)
+        def __init__ (self,fc,fileName,silent,inClipboard):
+            '''Ctor for SaxStreamingHandler class.'''
+            SaxContentHandler.__init__(self,fc.c,fileName,silent,inClipboard)
+            self.fc = fc
+            self.newGnxList = []
+                # Gnx's entered into fc.gnxDict, removed if the read fails.
+            self.newVnodes = set()
+                # Vnodes created by this read.
+            self.oldVnodeChanges = []
+                # (f,args) tuples: changes to existing vnodes (clones).
+                # finish makes them, so a failed read leaves the outline alone.
+            self.skipLevel = 0
+                # > 0 while skipping the descendants of a clone.
+            self.stack = []
+                # One g.Bunch for each open <v> element.
+            self.tnodeBunch = None
+                # A g.Bunch for the open <t> element.
+            self.tnxToVnodeDict = {}
+                # Keys are tnx's (strings), values are vnodes.
+            self.topChildren = None
+                # The children of the hidden root node.
+        #@+node:agent.20261018200623.6: *4* abort & finish
+        def abort (self):
+            '''Remove all gnx's added to fc.gnxDict by a failed read.'''
+            d = self.fc.gnxDict
+            for gnx in self.newGnxList:
+                if gnx in d:
+                    del d[gnx]
+            self.oldVnodeChanges = []
+
+        def finish (self):
+            '''
+            Change the existing vnodes and link the top-level vnodes to the
+            hidden root node. Return the first top-level vnode, or None.
+            '''
+            for f,args in self.oldVnodeChanges:
+                f(*args)
+            self.oldVnodeChanges = []
+            children = self.topChildren
+            if children is None:
+                return None # No <v> elements.
+            parent_v = self.c.hiddenRootNode
+            parent_v.children = children
+            for child in children:
+                child.parents.append(parent_v)
+            return children and children[0] or None
+        #@+node:agent.20261018200623.7: *4* endTnode (SaxStreamingHandler)
+        def endTnode (self):
+
+            bunch,self.tnodeBunch = self.tnodeBunch,None
+            if bunch:
+                v = bunch.v
+                b = ''.join(self.content)
+                if v in self.newVnodes:
+                    v.setBodyString(b)
+                    self.fc.handleTnodeSaxAttributes(bunch.sax_node,v)
+                else:
+                    self.oldVnodeChanges.append((self.setOldBody,(v,b)))
+                    self.oldVnodeChanges.append(
+                        (self.fc.handleTnodeSaxAttributes,(bunch.sax_node,v)))
+            self.content = []
+        #@+node:agent.20261018200623.8: *4* endVnode (SaxStreamingHandler)
+        def endVnode (self):
+
+            if self.skipLevel:
+                self.skipLevel -= 1
+                return
+            bunch = self.stack.pop()
+            if bunch.children is not None:
+                parent_v = bunch.v # Always a new vnode.
+                parent_v.children = bunch.children
+                for child in bunch.children:
+                    if child in self.newVnodes:
+                        child.parents.append(parent_v)
+                    else:
+                        self.oldVnodeChanges.append((child.parents.append,(parent_v,)))
+        #@+node:agent.20261018200623.9: *4* endVH (SaxStreamingHandler)
+        def endVH (self):
+
+            if self.stack and not self.skipLevel:
+                v = self.stack[-1].v
+                if v in self.newVnodes:
+                    v.setHeadString(''.join(self.content))
+            self.content = []
+        #@+node:agent.20261018200623.10: *4* getRootNode (SaxStreamingHandler)
+        def getRootNode (self):
+
+            return None # There is no tree of SaxNodeClass objects.
+        #@+node:agent.20261018222035.1: *4* setOldBody (SaxStreamingHandler)
+        def setOldBody (self,v,b):
+            '''Set the body of v, an existing vnode.'''
+            if v.b != b:
+                # The body of the later node overrides the earlier.
+                v.b = b
+        #@+node:agent.20261018200623.11: *4* startTnode (SaxStreamingHandler)
+        def startTnode (self,attrs):
+
+            if not self.inElement('tnodes'):
+                self.error('<t> outside <tnodes>')
+            self.content = []
+            sax_node = SaxNodeClass()
+            tx = None
+            for name in attrs.getNames():
+                val = attrs.getValue(name)
+                if name == 'tx':
+                    tx = val
+                else:
+                    sax_node.tnodeAttributes[name] = val
+            v = self.tnxToVnodeDict.get(tx)
+            if v:
+                self.tnodeBunch = g.Bunch(sax_node=sax_node,v=v)
+            else:
+                self.error('Bad leo file: no node for <t tx=%s>' % (tx))
+        #@+node:agent.20261018200623.12: *4* startVnode (SaxStreamingHandler)
+        def startVnode (self,attrs):
+
+            fc = self.fc
+            if not self.inElement('vnodes'):
+                self.error('<v> outside <vnodes>')
+            if self.topChildren is None:
+                self.topChildren = []
+            if self.skipLevel or (self.stack and self.stack[-1].children is None):
+                # A descendant of a clone: the clone already has its children.
+                self.skipLevel += 1
+                return
+            sax_node = SaxNodeClass()
+            for name in attrs.getNames():
+                val = attrs.getValue(name)
+                if name == 't':
+                    sax_node.tnx = str(val) # nodeIndices.toString returns a string.
+                else:
+                    sax_node.attributes[name] = val
+            tnx = sax_node.tnx
+            v = fc.gnxDict.get(tnx)
+            if v: # A clone.
+                children = None
+            else:
+                if tnx:
+                    # Important: this should retain compatibility with old .leo files.
+                    gnx = g.toUnicode(fc.canonicalTnodeIndex(tnx))
+                else:
+                    gnx = g.app.nodeIndices.getNewIndex(None)
+                    g.trace('no txn! allocated new gnx',gnx)
+                v = leoNodes.VNode(context=self.c,gnx=gnx)
+                v.setBodyString('')
+                v.setHeadString('')
+                fc.gnxDict [gnx] = v
+                if g.trace_gnxDict: g.trace(self.c.shortFileName(),gnx,v)
+                self.newGnxList.append(gnx)
+                self.newVnodes.add(v)
+                children = []
+            if tnx:
+                self.tnxToVnodeDict[tnx] = v
+            if v in self.newVnodes:
+                fc.handleVnodeSaxAttributes(sax_node,v)
+            else:
+                self.oldVnodeChanges.append((fc.handleVnodeSaxAttributes,(sax_node,v)))
+            if self.stack:
+                self.stack[-1].children.append(v)
+            else:
+                self.topChildren.append(v)
+            self.stack.append(g.Bunch(v=v,children=children))
+        #@-others
     #@-others
     #@-<< define sax classes >>
 
@@ -544,6 +1091,9 @@ class FileCommands:
         )
         self.checkOutlineBeforeSave = c.config.getBool(
             'check_outline_before_save',default=False)
+        self.saveInBackground = c.config.getBool(
+            'save-in-background',default=False)
+        self.backgroundSaver = BackgroundSaver(c)
         self.initIvars()
     #@+node:ekr.20090218115025.5: *3* fc.initIvars
     def initIvars(self):
@@ -551,6 +1101,7 @@ class FileCommands:
         # General...
         c = self.c
         self.mFileName = ""
+        self.tempFileName = None # Set by fc.writeToFileHelper.
         self.fileDate = -1
         self.leo_file_encoding = c.config.new_leo_file_encoding
             # The bin param doesn't exist in Python 2.3;
@@ -567,6 +1118,8 @@ class FileCommands:
         self.currentVnode = None
         self.rootVnode = None
         # For writing...
+        self.escapedBodyDict = {}
+            # Keys are gnx's; values are tuples (v.b,escaped v.b).
         self.read_only = False
         self.rootPosition = None
         self.outputFile = None
@@ -1155,10 +1708,9 @@ class FileCommands:
 
         aDict = {}
         for key in d:
-            val = g.toUnicode(d.get(key)) # 2011/02/22
-            val2 = self.getSaxUa(key,val)
-            # g.trace(key,val,val2)
-            aDict[key] = val2
+            aDict[key] = g.toUnicode(d.get(key)) # 2011/02/22
+        aDict = LazyUnknownAttributes(self.getSaxUa,aDict)
+            # Values are decoded by getSaxUa on first access.
 
         if aDict:
             if trace: g.trace('uA',v,list(aDict.keys()))
@@ -1226,10 +1778,9 @@ class FileCommands:
                 if False and trace: g.trace(
                     '****ignoring***',key,d.get(key))
             else:
-                val = d.get(key)
-                val2 = self.getSaxUa(key,val)
-                aDict[key] = val2
-                # g.trace(key,val,val2)
+                aDict[key] = d.get(key)
+        aDict = LazyUnknownAttributes(self.getSaxUa,aDict)
+            # Values are decoded by getSaxUa on first access.
         if aDict:
             # if trace: g.trace('uA',v,aDict)
             v.unknownAttributes = aDict
@@ -1369,25 +1920,43 @@ class FileCommands:
         return sax_node
     #@+node:ekr.20060919110638.3: *4* fc.readSaxFile
     def readSaxFile (self,theFile,fileName,silent,inClipboard,reassignIndices,s=None):
+        '''
+        Read a .leo file, or s, the text of a copied outline, in a single pass.
 
-        dump = False and not g.unitTesting
-        fc = self ; c = fc.c
-
-        # Pass one: create the intermediate nodes.
-        saxRoot = fc.parse_leo_file(theFile,fileName,
-            silent=silent,inClipboard=inClipboard,s=s)
-
-        if dump: fc.dumpSaxTree(saxRoot,dummy=True)
-
-        # Pass two: create the tree of vnodes from the intermediate nodes.
-        if saxRoot:
-            parent_v = c.hiddenRootNode
-            children = fc.createSaxChildren(saxRoot,parent_v)
-            assert c.hiddenRootNode.children == children
-            v = children and children[0] or None
-            return v
-        else:
+        The SaxStreamingHandler creates vnodes as elements arrive, and the
+        input is cleaned and parsed in chunks, so no copy of the whole input
+        and no tree of intermediate nodes exists at any time.
+        '''
+        fc = self
+        handler = SaxStreamingHandler(fc,fileName,silent,inClipboard)
+        try:
+            parser = xml.sax.make_parser()
+            parser.setFeature(xml.sax.handler.feature_external_ges,1)
+                # Include external general entities, esp. xml-stylesheet lines.
+            parser.setContentHandler(handler)
+            for chunk in fc.saxInputChunks(theFile,s):
+                parser.feed(chunk)
+            parser.close()
+        except Exception:
+            g.error('error parsing',fileName)
+            g.es_exception()
+            handler.abort()
             return None
+        return handler.finish()
+    #@+node:agent.20261018200630.1: *4* fc.saxInputChunks
+    def saxInputChunks (self,theFile,s,chunkSize=1024*1024):
+        '''Yield successive cleaned chunks of theFile or s.'''
+        if theFile:
+            while True:
+                chunk = theFile.read(chunkSize)
+                if not chunk:
+                    break
+                yield self.cleanSaxInputString(chunk)
+        else:
+            if g.isPython3 and isinstance(s,bytes):
+                s = str(s,encoding='utf-8')
+            for i in range(0,len(s),chunkSize):
+                yield self.cleanSaxInputString(s[i:i+chunkSize])
     #@+node:ekr.20060919110638.11: *4* fc.resolveTnodeLists
     def resolveTnodeLists (self):
         '''
@@ -1499,6 +2068,11 @@ class FileCommands:
     def save(self,fileName,silent=False):
 
         c = self.c ; v = c.currentVnode()
+        saver = self.backgroundSaver
+        if self.saveInBackground and saver.isBusy():
+            # Save again when the save in progress ends.
+            saver.merge(fileName)
+            return True
 
         # New in 4.2.  Return ok flag so shutdown logic knows if all went well.
         ok = g.doHook("save1",c=c,p=v,v=v,fileName=fileName)
@@ -1508,18 +2082,26 @@ class FileCommands:
             self.setDefaultDirectoryForNewFiles(fileName)
             c.cacher.save(fileName,changeName=True)
             ok = c.checkFileTimeStamp(fileName)
-            if ok:
+            if ok and self.saveInBackground:
+                # The saver reports when the files have been written.
+                ok = saver.save(fileName,silent)
+            elif ok:
                 ok = self.write_Leo_file(fileName,False) # outlineOnlyFlag
-            if ok:
-                if not silent:
+                if ok and not silent:
                     self.putSavedMessage(fileName)
+            if ok:
                 c.setChanged(False) # Clears all dirty bits.
                 if c.config.save_clears_undo_buffer:
                     g.es("clearing undo")
                     c.undoer.clearUndoState()
+            if saver.isBusy() and not saver.timer:
+                saver.wait() # No gui: finish the save now.
 
             c.redraw_after_icons_changed()
 
+        if g.app.fileWatcher:
+            # Watch new @<file> nodes and the new .leo file.
+            g.app.fileWatcher.watchCommander(c)
         g.doHook("save2",c=c,p=v,v=v,fileName=fileName)
         return ok
     #@+node:ekr.20031218072017.3043: *4* fc.saveAs
@@ -1539,6 +2121,9 @@ class FileCommands:
             finally:
                 c.ignoreChangedPaths = True
             c.redraw_after_icons_changed()
+        if g.app.fileWatcher:
+            # Watch new @<file> nodes and the new .leo file.
+            g.app.fileWatcher.watchCommander(c)
         g.doHook("save2",c=c,p=p,v=p,fileName=fileName)
     #@+node:ekr.20031218072017.3044: *4* fc.saveTo
     def saveTo (self,fileName):
@@ -1583,7 +2168,7 @@ class FileCommands:
     #@+node:ekr.20031218072017.1470: *3* fc.put & helpers
     def put (self,s):
         '''Put string s to self.outputFile. All output eventually comes here.'''
-        # Improved code: self.outputFile (a cStringIO object) always exists.
+        # self.outputFile (a file-like object) always exists.
         if s:
             # if g.unitTesting: g.trace(g.callers(1),repr(s))
             self.putCount += 1
@@ -1772,9 +2357,26 @@ class FileCommands:
         # Call put just once.
         gnx = v.fileIndex
         ua = hasattr(v,'unknownAttributes') and self.putUnknownAttributes(v) or ''
-        b = v.b
-        body = xml.sax.saxutils.escape(b) if b else ''
+        body = self.escapedBody(v)
         self.put('<t tx="%s"%s>%s</t>\n' % (gnx,ua,body))
+    #@+node:agent.20261018201245.2: *5* fc.escapedBody
+    def escapedBody (self,v):
+        '''
+        Return the escaped body text of v.
+
+        Escaping a large body takes time. Reuse the escaped text of the
+        previous save if v.b is the very same string.
+        '''
+        b = v.b
+        if not b:
+            return ''
+        d = self.escapedBodyDict
+        data = d.get(v.fileIndex)
+        if data and data[0] is b:
+            return data[1]
+        body = xml.sax.saxutils.escape(b)
+        d [v.fileIndex] = (b,body)
+        return body
     #@+node:ekr.20031218072017.1575: *4* fc.putTnodes
     def putTnodes (self):
 
@@ -1810,6 +2412,11 @@ class FileCommands:
                 g.trace('can not happen: no VNode for',repr(index))
                 # This prevents the file from being written.
                 raise BadLeoFile('no VNode for %s' % repr(index))
+        if not self.usingClipboard:
+            # Forget the escaped bodies of deleted nodes.
+            d = self.escapedBodyDict
+            for index in [z for z in d if z not in tnodes]:
+                del d[index]
         #@-<< write only those tnodes that were referenced >>
         self.put("</tnodes>\n")
     #@+node:ekr.20031218072017.1863: *4* fc.putVnode
@@ -1876,7 +2483,8 @@ class FileCommands:
             v.u = d
         elif hasattr(v,"unknownAttributes"):
             d = v.unknownAttributes
-            if d and not c.fixed and d.get('str_leo_pos'):
+            # Test 'in' first: d.get decodes LazyUnknownAttributes dicts.
+            if d and not c.fixed and 'str_leo_pos' in d and d.get('str_leo_pos'):
                 # g.trace("clearing str_leo_pos",v)
                 del d['str_leo_pos']
                 v.unknownAttributes = d
@@ -1976,8 +2584,12 @@ class FileCommands:
         self.usingClipboard = False
         return s
     #@+node:ekr.20031218072017.3046: *3* fc.write_Leo_file & helpers
-    def write_Leo_file(self,fileName,outlineOnlyFlag,toString=False,toOPML=False):
-
+    def write_Leo_file(self,fileName,outlineOnlyFlag,toString=False,toOPML=False,toTempFile=False):
+        '''
+        Write the outline to fileName, or to g.app.write_Leo_file_string if
+        toString is True. If toTempFile is True, write the outline to a temp
+        file whose name is fc.tempFileName, leaving fileName unchanged.
+        '''
         c = self.c
         if self.checkOutlineBeforeSave and not self.checkOutline():
             return False
@@ -1992,7 +2604,7 @@ class FileCommands:
             if toString:
                 ok = self.writeToStringHelper(fileName)
             else:
-                ok = self.writeToFileHelper(fileName,toOPML)
+                ok = self.writeToFileHelper(fileName,toOPML,replace=not toTempFile)
         finally:
             self.outputFile = None
             self.toString = False
@@ -2046,109 +2658,99 @@ class FileCommands:
             g.es('can save each changed file.',color='red')
             return False
     #@+node:ekr.20100119145629.6111: *4* fc.writeToFileHelper & helpers
-    def writeToFileHelper (self,fileName,toOPML):
+    def writeToFileHelper (self,fileName,toOPML,replace=True):
+        '''
+        Write the outline to fileName.
+
+        Write to a temp file in large chunks, then rename the temp file to
+        fileName. The entire .leo file never exists as a single string, and
+        fileName remains unchanged if anything goes wrong.
 
+        If replace is False, leave the outline in the temp file and set
+        fc.tempFileName to its name.
+        '''
         c = self.c ; toZip = c.isZipped
-        ok,backupName = self.createBackupFile(fileName)
-        if not ok: return False
-        fileName,theActualFile = self.createActualFile(fileName,toOPML,toZip)
-        if not theActualFile: return False
         self.mFileName = fileName
-        self.outputFile = StringIO() # Always write to a string.
+        self.tempFileName = None
+        tempName,theFile = self.createTempFile(fileName)
+        if not theFile: return False
         try:
-            if toOPML:
-                if hasattr(c,'opmlController'):
-                    c.opmlController.putToOPML(owner=self)
+            self.outputFile = ChunkedWriter(theFile,self.leo_file_encoding)
+            try:
+                if toOPML:
+                    if hasattr(c,'opmlController'):
+                        c.opmlController.putToOPML(owner=self)
+                    else:
+                        # This is not likely ever to be called.
+                        g.trace('leoOPML plugin not active.')
                 else:
-                    # This is not likely ever to be called.
-                    g.trace('leoOPML plugin not active.')
-            else:
-                self.putLeoFile()
-            s = self.outputFile.getvalue()
-            g.app.write_Leo_file_string = s # 2010/01/19: always set this.
+                    self.putLeoFile()
+            finally:
+                self.outputFile.close()
             if toZip:
-                self.writeZipFile(s)
-            else:
-                if g.isPython3:
-                    s = bytes(s,self.leo_file_encoding,'replace')
-                theActualFile.write(s)
-                theActualFile.close()
+                tempName = self.writeZipFile(tempName)
+            # raise AttributeError # To test handleWriteLeoFileException.
+            if replace:
+                self.replaceFile(tempName,fileName)
                 c.setFileTimeStamp(fileName)
-                # raise AttributeError # To test handleWriteLeoFileException.
-                # Delete backup file.
-                if backupName and g.os_path_exists(backupName):
-                    self.deleteFileWithMessage(backupName,'backup')
+            else:
+                self.tempFileName = tempName
             return True
         except Exception:
-            self.handleWriteLeoFileException(
-                fileName,backupName,theActualFile)
+            self.handleWriteLeoFileException(fileName,tempName)
             return False
-    #@+node:ekr.20100119145629.6106: *5* fc.createActualFile
-    def createActualFile (self,fileName,toOPML,toZip):
-
-        if toZip:
-            self.toString = True
-            theActualFile = None
-        else:
-            try:
-                # 2010/01/21: always write in binary mode.
-                theActualFile = open(fileName,'wb')
-            except IOError:
-                g.es('can not open %s' % fileName)
-                g.es_exception()
-                theActualFile = None
-        return fileName,theActualFile
-    #@+node:ekr.20031218072017.3047: *5* fc.createBackupFile
-    def createBackupFile (self,fileName):
-
-        '''
-            Create a closed backup file and copy the file to it,
-            but only if the original file exists.
+    #@+node:agent.20261018201245.3: *5* fc.createTempFile
+    def createTempFile (self,fileName):
         '''
+        Create and open a temp file in the directory containing fileName,
+        so that fc.replaceFile can rename it to fileName.
 
-        if g.os_path_exists(fileName):
-            fd,backupName = tempfile.mkstemp(text=False)
-            f = open(fileName,'rb') # rb is essential.
-            s = f.read()
-            f.close()
-            try:
-                try:
-                    os.write(fd,s)
-                finally:
-                    os.close(fd)
-                ok = True
-            except Exception:
-                g.error('exception creating backup file')
-                g.es_exception()
-                ok,backupName = False,None
-            if not ok and self.read_only:
+        Return (tempName,theFile), or (None,None) if there is an error.
+        '''
+        theDir = g.os_path_dirname(g.os_path_realpath(fileName))
+        try:
+            fd,tempName = tempfile.mkstemp(dir=theDir,
+                prefix='.%s-' % g.shortFileName(fileName),suffix='.tmp')
+            # 2010/01/21: always write in binary mode.
+            return tempName,os.fdopen(fd,'wb')
+        except Exception:
+            g.es('can not create temp file in %s' % theDir)
+            g.es_exception()
+            if self.read_only:
                 g.error("read only")
-        else:
-            ok,backupName = True,None
-        return ok,backupName
+            return None,None
     #@+node:ekr.20100119145629.6108: *5* fc.handleWriteLeoFileException
-    def handleWriteLeoFileException(self,fileName,backupName,theActualFile):
-
-        c = self.c
+    def handleWriteLeoFileException(self,fileName,tempName):
 
         g.es("exception writing:",fileName)
         g.es_exception(full=True)
 
-        if theActualFile:
-            theActualFile.close()
-
-        # Delete fileName.
-        if fileName and g.os_path_exists(fileName):
-            self.deleteFileWithMessage(fileName,'')
-
-        # Rename backupName to fileName.
-        if backupName and g.os_path_exists(backupName):
-            g.es("restoring",fileName,"from",backupName)
-
-            # No need to create directories when restoring.
-            g.utils_rename(c,backupName,fileName)
+        # fileName has not been touched: just delete the temp file.
+        if tempName and g.os_path_exists(tempName):
+            self.deleteFileWithMessage(tempName,'temp')
+    #@+node:agent.20261018201245.4: *5* fc.replaceFile
+    def replaceFile (self,tempName,fileName):
+        '''
+        Rename tempName to fileName, giving it the access mode of fileName.
+        The rename is atomic except when replacing a file in Python 2 on
+        Windows.
+        '''
+        # Replace the target of a link, not the link itself.
+        fileName = g.os_path_realpath(fileName)
+        exists = g.os_path_exists(fileName)
+        if exists:
+            mode = g.utils_stat(fileName)
         else:
-            g.error('backup file does not exist!',repr(backupName))
+            # mkstemp creates files readable only by their owner.
+            mode = 0o666 & ~processUmask
+        g.utils_chmod(tempName,mode,verbose=False)
+            # BackgroundSaver.writeFile calls this method outside the main thread.
+        if hasattr(os,'replace'):
+            os.replace(tempName,fileName) # Python 3.3 and later.
+        else:
+            if exists and sys.platform.startswith('win'):
+                os.remove(fileName) # os.rename does not replace files on Windows.
+            os.rename(tempName,fileName)
     #@+node:ekr.20100119145629.6110: *4* fc.writeToStringHelper
     def writeToStringHelper (self,fileName):
 
@@ -2165,22 +2767,30 @@ class FileCommands:
             g.app.write_Leo_file_string = ''
             return False
     #@+node:ekr.20070412095520: *4* fc.writeZipFile
-    def writeZipFile (self,s):
-
-        # The name of the file in the archive.
-        contentsName = g.toEncodedString(
-            g.shortFileName(self.mFileName),
-            self.leo_file_encoding,reportErrors=True)
-
-        # The name of the archive itself.
-        fileName = g.toEncodedString(
-            self.mFileName,
-            self.leo_file_encoding,reportErrors=True)
-
-        # Write the archive.
-        theFile = zipfile.ZipFile(fileName,'w',zipfile.ZIP_DEFLATED)
-        theFile.writestr(contentsName,s)
+    def writeZipFile (self,tempName):
+        '''
+        Compress the .leo file in tempName into a new temp file.
+        Delete tempName and return the name of the new temp file.
+        '''
+        zipName,theFile = self.createTempFile(self.mFileName)
+        if not theFile:
+            raise IOError('can not create temp file for %s' % self.mFileName)
         theFile.close()
+        try:
+            # The name of the file in the archive.
+            contentsName = g.shortFileName(self.mFileName)
+            # Write the archive.
+            theZipFile = zipfile.ZipFile(zipName,'w',zipfile.ZIP_DEFLATED)
+            try:
+                theZipFile.write(tempName,contentsName)
+            finally:
+                theZipFile.close()
+        except Exception:
+            self.deleteFileWithMessage(zipName,'zip')
+            raise
+        finally:
+            self.deleteFileWithMessage(tempName,'temp')
+        return zipName
     #@+node:ekr.20031218072017.2012: *3* fc.writeAtFileNodes
     def writeAtFileNodes (self,event=None):
         '''Write all @file nodes in the selected outline.'''
@@ -2252,11 +2862,11 @@ class FileCommands:
         result = []
 
         for p,torv in aList:
-            if type(torv.unknownAttributes) != type({}):
+            if not isinstance(torv.unknownAttributes,dict):
                 g.warning("ignoring non-dictionary uA for",p)
             else:
                 # Create a new dict containing only entries that can be pickled.
-                d = dict(torv.unknownAttributes) # Copy the dict.
+                d = torv.unknownAttributes.copy()
 
                 for key in d:
                     # Just see if val can be pickled.  Suppress any error.
@@ -2376,9 +2986,14 @@ class FileCommands:
         """Put pickleable values for all keys in torv.unknownAttributes dictionary."""
 
         attrDict = torv.unknownAttributes
-        if type(attrDict) != type({}):
+        if not isinstance(attrDict,dict):
             g.warning("ignoring non-dictionary unknownAttributes for",torv)
             return ''
+        elif getattr(attrDict,'decoder',None):
+            # A LazyUnknownAttributes dict that has never been accessed.
+            # Write the values exactly as they were read.
+            return ''.join([' %s=%s' % (key,xml.sax.saxutils.quoteattr(val))
+                for key,val in dict.items(attrDict)])
         else:
             val = ''.join([self.putUaHelper(torv,key,val) for key,val in attrDict.items()])
             # g.trace(torv,attrDict)
@@ -0,0 +1,288 @@
+#@+leo-ver=5-thin
+#@+node:agent.20261018212810.1: * @file leoFileWatcher.py
+#@@language python
+#@@tabwidth -4
+'''
+Leo's external file watcher.
+
+On Linux, the FileWatcher class uses inotify to watch the directories
+containing each commander's .leo file and @<file> nodes. Changes are
+coalesced and reported, after a short quiet period, by the
+external-files-changed hook.
+'''
+#@+<< imports >>
+#@+node:agent.20261018212810.2: ** << imports >> (leoFileWatcher.py)
+import leo.core.leoGlobals as g
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+import time
+#@-<< imports >>
+#@+others
+#@+node:agent.20261018212810.3: ** class Inotify
+class Inotify:
+    '''A thin ctypes wrapper for Linux's inotify api.'''
+    # Event masks, from <sys/inotify.h>.
+    IN_MODIFY      = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ONLYDIR     = 0x01000000
+    #@+others
+    #@+node:agent.20261018212810.4: *3*  inotify.ctor
+    def __init__(self):
+        '''Ctor for the Inotify class.'''
+        name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = libc = ctypes.CDLL(name,use_errno=True)
+        flags = os.O_NONBLOCK | getattr(os,'O_CLOEXEC',0o2000000)
+        self.fd = libc.inotify_init1(flags)
+        if self.fd < 0:
+            self.error()
+    #@+node:agent.20261018212810.5: *3* inotify.addWatch & removeWatch
+    def addWatch(self,path,mask):
+        '''Watch path for the events in mask. Return the watch descriptor.'''
+        wd = self.libc.inotify_add_watch(self.fd,
+            g.toEncodedString(path,sys.getfilesystemencoding() or 'utf-8'),
+            ctypes.c_uint32(mask))
+        if wd < 0:
+            self.error()
+        return wd
+
+    def removeWatch(self,wd):
+        '''Stop watching the watch descriptor wd.'''
+        if self.libc.inotify_rm_watch(self.fd,wd) < 0:
+            self.error()
+    #@+node:agent.20261018212810.6: *3* inotify.close
+    def close(self):
+        '''Close the inotify file descriptor.'''
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+    #@+node:agent.20261018212810.7: *3* inotify.error
+    def error(self):
+        '''Raise OSError for the last libc error.'''
+        n = ctypes.get_errno()
+        raise OSError(n,os.strerror(n))
+    #@+node:agent.20261018212810.8: *3* inotify.read
+    def read(self):
+        '''Return a list of (wd,mask,name) tuples for all queued events.'''
+        aList = []
+        while True:
+            try:
+                s = os.read(self.fd,65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK):
+                    break
+                raise
+            if not s:
+                break
+            # Each read returns only complete events.
+            i = 0
+            while i + 16 <= len(s):
+                wd,mask,cookie,n = struct.unpack_from('iIII',s,i)
+                name = s[i+16:i+16+n].rstrip(b'\0')
+                aList.append((wd,mask,g.toUnicode(name)))
+                i += 16 + n
+        return aList
+    #@-others
+#@+node:agent.20261018212810.9: ** class FileWatcher
+class FileWatcher:
+    '''
+    Watch the .leo file and @<file> nodes of all open commanders.
+
+    Leo watches directories, not files, so that editors and version
+    control tools that replace files (rather than rewriting them) are
+    seen. Events for the same file are coalesced, and the
+    external-files-changed hook is called once the directories have
+    been quiet for self.delay seconds.
+    '''
+    #@+others
+    #@+node:agent.20261018212810.10: *3*  fw.ctor
+    def __init__(self,inotify=None):
+        '''Ctor for the FileWatcher class.'''
+        self.commanders = {}
+            # Keys are commanders, values are dicts.
+            # Keys of inner dicts are normalized paths,
+            # values are tuples (fileName,vnodes).
+        self.delay = 0.3
+            # Seconds of quiet before reporting changes.
+        self.dirs = {}
+            # Keys are watched directories, values are watch descriptors.
+        self.inotify = inotify or Inotify()
+        self.pending = {}
+            # Keys are normalized paths, values are the times of the last event.
+        self.timer = None
+            # The IdleTime instance that calls self.poll.
+        self.wds = {}
+            # Keys are watch descriptors, values are directories.
+        I = Inotify
+        self.mask = (I.IN_CLOSE_WRITE | I.IN_CREATE | I.IN_DELETE |
+            I.IN_MOVED_FROM | I.IN_MOVED_TO | I.IN_ONLYDIR)
+    #@+node:agent.20261018212810.11: *3* fw.deliver
+    def deliver(self):
+        '''Report all pending changes to the commanders that own them.'''
+        for c in self.commanders:
+            saver = c.exists and c.fileCommands.backgroundSaver
+            if saver and saver.isBusy():
+                # Leo itself is writing files: try again later.
+                return
+        pending,self.pending = self.pending,{}
+        for c in list(self.commanders.keys()):
+            if not c.exists:
+                del self.commanders[c]
+                continue
+            d = self.commanders[c]
+            changed = sorted([fn for path,(fn,vnodes) in d.items()
+                if path in pending and self.isChanged(c,fn)])
+            if changed and not g.doHook('external-files-changed',
+                c=c,paths=changed
+            ):
+                self.handleChangedFiles(c,changed)
+    #@+node:agent.20261018212810.12: *3* fw.handleChangedFiles
+    def handleChangedFiles(self,c,paths):
+        '''
+        The default external-files-changed handler.
+
+        Re-read the changed @<file> trees if @bool
+        refresh-changed-external-files is True and the tree has not
+        been changed in Leo. Otherwise just warn.
+        '''
+        refresh = c.config.getBool('refresh-changed-external-files',default=False)
+        d = self.commanders.get(c,{})
+        redraw = False
+        for fn in paths:
+            junk,vnodes = d.get(self.normalize(fn),(fn,[]))
+            positions = [c.vnode2position(v) for v in vnodes]
+            positions = [p for p in positions if p]
+            if not positions:
+                g.warning('changed outside Leo:',fn)
+            for p in positions:
+                if (refresh and g.os_path_exists(fn) and
+                    not any([z.isDirty() for z in p.self_and_subtree()])
+                ):
+                    c.refreshNodeFromDisk(p)
+                    c.setFileTimeStamp(fn)
+                        # Not all readers set the time stamp.
+                    g.es_print('refreshed',p.h)
+                    redraw = True
+                else:
+                    g.warning('changed outside Leo:',p.h)
+        if redraw:
+            c.redraw()
+    #@+node:agent.20261018212810.13: *3* fw.isChanged
+    def isChanged(self,c,fn):
+        '''Return True if fn differs from the version Leo last read or wrote.'''
+        if not g.os_path_exists(fn):
+            return True
+        timeStamp = c.timeStampDict.get(fn)
+        return timeStamp is None or timeStamp != os.path.getmtime(fn)
+    #@+node:agent.20261018212810.14: *3* fw.normalize
+    def normalize(self,fn):
+        '''Return the key used for fn.'''
+        return os.path.normcase(os.path.realpath(fn))
+    #@+node:agent.20261018212810.15: *3* fw.poll
+    def poll(self,timer=None):
+        '''Handle all inotify events. Called at idle time.'''
+        events = self.inotify.read()
+        now = time.time()
+        I = Inotify
+        for wd,mask,name in events:
+            if mask & I.IN_Q_OVERFLOW:
+                # Events have been lost: check everything.
+                for d in self.commanders.values():
+                    for path in d:
+                        self.pending[path] = now
+            elif mask & I.IN_IGNORED:
+                # The directory itself has been removed.
+                directory = self.wds.pop(wd,None)
+                if directory:
+                    del self.dirs[directory]
+                    for d in self.commanders.values():
+                        for path in d:
+                            if os.path.dirname(path) == directory:
+                                self.pending[path] = now
+            else:
+                directory = self.wds.get(wd)
+                if directory and name:
+                    path = os.path.join(directory,name)
+                    for d in self.commanders.values():
+                        if path in d:
+                            self.pending[path] = now
+                            break
+        if self.pending and now - max(self.pending.values()) >= self.delay:
+            self.deliver()
+    #@+node:agent.20261018212810.16: *3* fw.unwatchCommander
+    def unwatchCommander(self,c):
+        '''Stop watching c's files.'''
+        if c in self.commanders:
+            del self.commanders[c]
+            self.updateWatches()
+    #@+node:agent.20261018212810.17: *3* fw.updateWatches
+    def updateWatches(self):
+        '''Watch exactly the directories containing watched files.'''
+        dirs = set()
+        for d in self.commanders.values():
+            for path in d:
+                dirs.add(os.path.dirname(path))
+        for directory in list(self.dirs.keys()):
+            if directory not in dirs:
+                wd = self.dirs.pop(directory)
+                del self.wds[wd]
+                try:
+                    self.inotify.removeWatch(wd)
+                except OSError:
+                    pass # The directory no longer exists.
+        for directory in dirs:
+            if directory not in self.dirs and g.os_path_isdir(directory):
+                try:
+                    wd = self.inotify.addWatch(directory,self.mask)
+                except OSError as e:
+                    g.trace('can not watch %s: %s' % (directory,e))
+                    continue
+                self.dirs[directory] = wd
+                self.wds[wd] = directory
+    #@+node:agent.20261018212810.18: *3* fw.watchCommander
+    def watchCommander(self,c):
+        '''Watch c's .leo file and all of its @<file> nodes.'''
+        if not c.config.getBool('watch-external-files',default=True):
+            self.unwatchCommander(c)
+            return
+        if not self.timer:
+            self.timer = g.IdleTime(self.poll,delay=200,tag='file-watcher')
+            if not self.timer:
+                return # No gui: nothing would handle the events.
+            self.timer.start()
+        at = c.atFileCommands
+        d = {}
+        fn = c.fileName()
+        if fn:
+            d[self.normalize(fn)] = (fn,[])
+        for p in c.all_unique_positions():
+            if p.isAnyAtFileNode():
+                fn = at.fullPath(p)
+                if fn:
+                    junk,vnodes = d.setdefault(self.normalize(fn),(fn,[]))
+                    vnodes.append(p.v)
+        self.commanders[c] = d
+        self.updateWatches()
+    #@-others
+#@+node:agent.20261018212810.19: ** createFileWatcher
+def createFileWatcher():
+    '''Return a FileWatcher, or None if inotify is not available.'''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return FileWatcher()
+    except (AttributeError,OSError) as e:
+        # AttributeError: libc has no inotify functions.
+        g.trace('inotify is not available: %s' % e)
+        return None
+#@-others
+#@-leo
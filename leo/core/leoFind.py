@@ -159,6 +159,10 @@ class LeoFind:
         self.buttonFlag = False
         self.changeAllFlag = False
         self.findAllFlag = False
+        self.candidates = None
+            # None or the set of vnodes that batch searches must search.
+        self.candidateAncestors = None
+            # None or the set of all ancestors of self.candidates.
         self.in_headline = False # True: searching headline text.
         self.p = None # The position being searched.  Never saved between searches!
         self.was_in_headline = None
@@ -177,6 +181,7 @@ class LeoFind:
         # Must be called when config settings are valid.
         c = self.c
         self.minibuffer_mode = c.config.getBool('minibuffer-find-mode',default=False)
+        self.prefilter = c.config.getBool('find-all-prefilter',default=True)
         # now that configuration settings are valid,
         # we can finish creating the Find pane.
         dw = c.frame.top
@@ -287,11 +292,19 @@ class LeoFind:
     def openFindTab (self,event=None,show=True):
         '''Open the Find tab in the log pane.'''
         self.c.frame.log.selectTab('Find')
-    #@+node:ekr.20131117164142.17016: *4* find.changeAllCommand
+    #@+node:ekr.20131117164142.17016: *4* find.changeAllCommand & changeAllPreviewCommand
     def changeAllCommand(self,event=None):
         
         self.setup_command()
         self.changeAll()
+
+    def changeAllPreviewCommand(self,event=None):
+        '''
+        List the number of matches in each node that replace-all would
+        change, without changing anything.
+        '''
+        self.setup_command()
+        self.changeAll(dryRun=True)
     #@+node:ekr.20031218072017.3066: *4* find.setup_command
     # Initializes a search when a command is invoked from the menu.
 
@@ -984,65 +997,6 @@ class LeoFind:
 
         self.ftm.setFindText(pattern)
     #@+node:ekr.20031218072017.3067: *3* LeoFind.Utils
-    #@+node:ekr.20031218072017.2293: *4* find.batchChange (sets start of replace-all group)
-    #@+at This routine performs a single batch change operation, updating the
-    # head or body string of p and leaving the result in s_ctrl. We update
-    # the body if we are changing the body text of c.currentVnode().
-    # 
-    # s_ctrl contains the found text on entry and contains the changed text
-    # on exit. pos and pos2 indicate the selection. The selection will never
-    # be empty. NB: we can not assume that self.p is visible.
-    #@@c
-
-    def batchChange (self,pos1,pos2):
-
-        c = self.c ; u = c.undoer
-        p = self.p
-        w = self.s_ctrl
-        # Replace the selection with self.change_text
-        if pos1 > pos2: pos1,pos2=pos2,pos1
-        s = w.getAllText()
-        if pos1 != pos2: w.delete(pos1,pos2)
-        w.insert(pos1,self.change_text)
-        # Update the selection.
-        insert=pos1 if self.reverse else pos1+len(self.change_text)
-        w.setSelectionRange(insert,insert)
-        w.setInsertPoint(insert)
-        # Update the node
-        s = w.getAllText() # Used below.
-        if self.in_headline:
-            #@+<< change headline >>
-            #@+node:ekr.20031218072017.2294: *5* << change headline >>
-            if len(s) > 0 and s[-1]=='\n':
-                s = s[:-1]
-            if s != p.h:
-                undoData = u.beforeChangeNodeContents(p)
-                p.initHeadString(s)
-                if self.mark_changes:
-                    p.setMarked()
-                p.setDirty()
-                if not c.isChanged():
-                    c.setChanged(True)
-                u.afterChangeNodeContents(p,'Change Headline',undoData)
-            #@-<< change headline >>
-        else:
-            #@+<< change body >>
-            #@+node:ekr.20031218072017.2295: *5* << change body >>
-            if len(s) > 0 and s[-1]=='\n': s = s[:-1]
-
-            if s != p.b:
-
-                undoData = u.beforeChangeNodeContents(p)
-
-                c.setBodyString(p,s)
-                if self.mark_changes:
-                    p.setMarked()
-                p.setDirty()
-                if not c.isChanged():
-                    c.setChanged(True)
-
-                u.afterChangeNodeContents(p,'Change Body',undoData)
-            #@-<< change body >>
     #@+node:ekr.20031218072017.3068: *4* find.change
     def change(self,event=None):
         if self.checkArgs():
@@ -1050,8 +1004,13 @@ class LeoFind:
             self.changeSelection()
 
     replace = change
-    #@+node:ekr.20031218072017.3069: *4* find.changeAll
-    def changeAll(self):
+    #@+node:ekr.20031218072017.3069: *4* find.changeAll & helpers
+    def changeAll(self,dryRun=False):
+        '''
+        Replace all matches of the find pattern in the search range.
+        dryRun: report the number of matches in each node without
+        changing anything.
+        '''
         trace = False and not g.unitTesting
         c = self.c ; u = c.undoer ; undoType = 'Replace All'
         current = c.p
@@ -1061,23 +1020,129 @@ class LeoFind:
         self.initInHeadline()
         saveData = self.save()
         self.initBatchCommands()
-        count = 0
-        u.beforeChangeGroup(current,undoType)
         # Fix bug 338172: ReplaceAll will not replace newlines indicated as \n in target string.
         self.change_text = self.replaceBackSlashes(self.change_text)
-        while 1:
-            pos1, pos2 = self.findNextMatch()
-            if pos1 is None:
-                if trace: g.trace('findNextMatch failed')
-                break
-            if trace: g.trace(pos1,pos2,self.p and self.p.h)
-            count += 1
-            self.batchChange(pos1,pos2)
-        p = c.p
-        u.afterChangeGroup(p,undoType,reportFlag=True)
-        g.es("changed:",count,"instances of",self.find_text,"to",self.change_text)
-        c.redraw(p)
+        changes = self.computeChanges()
+        count = sum([n for p,h,b,n in changes])
+        if dryRun:
+            for p,h,b,n in changes:
+                g.es('%4s %s' % (n,p.h))
+            g.es("found:",count,"instances of",self.find_text,"in",len(changes),"nodes")
+        else:
+            u.beforeChangeGroup(current,undoType)
+            for p,h,b,n in changes:
+                self.batchChange(p,h,b)
+            p = c.p
+            u.afterChangeGroup(p,undoType,reportFlag=True)
+            g.es("changed:",count,"instances of",self.find_text,"to",self.change_text)
+            c.redraw(p)
         self.restore(saveData)
+    #@+node:ekr.20031218072017.2293: *5* find.batchChange
+    def batchChange (self,p,h,b):
+        '''
+        Set the headline and body of p to h and b as part of the
+        replace-all undo group.
+        '''
+        c = self.c ; u = c.undoer
+        undoData = u.beforeChangeNodeContents(p)
+        if h != p.h:
+            p.initHeadString(h)
+        if b != p.b:
+            if p.v == c.p.v:
+                c.setBodyString(p,b) # Update the body pane.
+            else:
+                p.v.setBodyString(b)
+        if self.mark_changes:
+            p.setMarked()
+        p.setDirty()
+        if not c.isChanged():
+            c.setChanged(True)
+        u.afterChangeNodeContents(p,'Change',undoData)
+    #@+node:agent.20261018204700.1: *5* find.computeChanges
+    def computeChanges(self):
+        '''
+        Return a list of tuples (p,h,b,n): replacing all matches in the
+        search range would set the headline and body of p to h and b,
+        making n replacements. Each vnode appears at most once.
+
+        This visits the same nodes as find.findNextMatch, without loading
+        them into the SearchWidget.
+        '''
+        if self.pattern_match and not self.precompilePattern():
+            return []
+        if self.prefilter:
+            self.candidates,self.candidateAncestors = self.computeCandidates()
+        changes,seen = [],set()
+        p = self.p
+        try:
+            while p:
+                if p.v not in seen:
+                    seen.add(p.v)
+                    h,b,n = p.h,p.b,0
+                    if self.search_headline:
+                        h,n1 = self.replaceAllInString(h)
+                        if h.endswith('\n'):
+                            h = h[:-1]
+                        n += n1
+                    if self.search_body:
+                        b,n2 = self.replaceAllInString(b)
+                        n += n2
+                    if n:
+                        changes.append((p.copy(),h,b,n))
+                p = self.nextNodeAfterFail(p)
+                if self.candidates is not None:
+                    p = self.nextCandidate(p)
+        finally:
+            self.candidates = self.candidateAncestors = None
+        return changes
+    #@+node:agent.20261018204700.2: *5* find.replaceAllInString
+    def replaceAllInString(self,s):
+        '''
+        Return (s2,n), where s2 is s with all n matches of the find
+        pattern replaced by the change text. Matches are found as in
+        find.plainHelper and find.regexHelper.
+        '''
+        change_text = self.change_text
+        result,i,n = [],0,0
+        if self.pattern_match:
+            for mo in self.re_obj.finditer(s):
+                # Like regexHelper, ignore empty matches.
+                if mo.start() < mo.end():
+                    result.append(s[i:mo.start()])
+                    result.append(change_text)
+                    i = mo.end()
+                    n += 1
+        elif not self.ignore_case and not self.whole_word:
+            pattern = self.replaceBackSlashes(self.find_text)
+            n = s.count(pattern)
+            return (s.replace(pattern,change_text) if n else s),n
+        else:
+            s2,pattern = s,self.find_text
+            if self.ignore_case:
+                s2,pattern = s2.lower(),pattern.lower()
+            pattern = self.replaceBackSlashes(pattern)
+            # Like matchWord, but faster.
+            word = self.whole_word
+            isWordPat1 = word and g.isWordChar(pattern[0])
+            isWordPat2 = word and g.isWordChar(pattern[-1])
+            j = 0 # The start of the next search.
+            while True:
+                k = s2.find(pattern,j)
+                if k == -1:
+                    break
+                j = k + len(pattern)
+                if not (
+                    isWordPat1 and k > 0 and g.isWordChar(s2[k-1]) or
+                    isWordPat2 and j < len(s2) and g.isWordChar(s2[j])
+                ):
+                    result.append(s[i:k])
+                    result.append(change_text)
+                    i = j
+                    n += 1
+        if not n:
+            return s,0
+        result.append(s[i:])
+        return ''.join(result),n
     #@+node:ekr.20031218072017.3070: *4* find.changeSelection
     # Replace selection with self.change_text.
     # If no selection, insert self.change_text at the cursor.
@@ -1163,7 +1228,7 @@ class LeoFind:
         self.initInHeadline()
         if self.changeSelection():
             self.findNext(False) # don't reinitialize
-    #@+node:ekr.20031218072017.3073: *4* find.findAll & helper
+    #@+node:ekr.20031218072017.3073: *4* find.findAll & helpers
     def findAll(self,clone_find_all=False,clone_find_all_flattened=False):
         trace = False and not g.unitTesting
         c,w = self.c,self.s_ctrl
@@ -1189,26 +1254,31 @@ class LeoFind:
             if self.suboutline_only:
                 self.onlyPosition = self.p.copy()
         clones = set()
-        while 1:
-            pos, newpos = self.findNextMatch() # sets self.p.
-            if not self.p: self.p = c.p.copy()
-            if pos is None: break
-            if clone_find_all and self.p.v in skip:
-                continue
-            count += 1
-            s = w.getAllText()
-            i,j = g.getLine(s,pos)
-            line = s[i:j]
-            if clone_find_all or clone_find_all_flattened:
-                if clone_find_all_flattened:
-                    skip.add(self.p.v)
+        if self.prefilter:
+            self.candidates,self.candidateAncestors = self.computeCandidates()
+        try:
+            while 1:
+                pos, newpos = self.findNextMatch() # sets self.p.
+                if not self.p: self.p = c.p.copy()
+                if pos is None: break
+                if clone_find_all and self.p.v in skip:
+                    continue
+                count += 1
+                s = w.getAllText()
+                i,j = g.getLine(s,pos)
+                line = s[i:j]
+                if clone_find_all or clone_find_all_flattened:
+                    if clone_find_all_flattened:
+                        skip.add(self.p.v)
+                    else:
+                        # Don't look at the node or it's descendants.
+                        for p2 in self.p.self_and_subtree():
+                            skip.add(p2.v)
+                    clones.add(self.p.copy())
                 else:
-                    # Don't look at the node or it's descendants.
-                    for p2 in self.p.self_and_subtree():
-                        skip.add(p2.v)
-                clones.add(self.p.copy())
-            else:
-                self.printLine(line,allFlag=True)
+                    self.printLine(line,allFlag=True)
+        finally:
+            self.candidates = self.candidateAncestors = None
         if clones and (clone_find_all or clone_find_all_flattened):
             u = c.undoer
             undoData = u.beforeInsertNode(c.p)
@@ -1220,6 +1290,59 @@ class LeoFind:
             self.restore(data)
         c.redraw()
         g.es("found",count,"matches for",self.find_text)
+    #@+node:agent.20261018203901.1: *5* find.computeCandidates
+    def computeCandidates(self):
+        """
+        Return (candidates,ancestors), two sets of vnodes, or (None,None).
+
+        candidates contains all vnodes whose headline or body text might
+        match the find pattern. ancestors contains all ancestors of those
+        vnodes. Batch searches skip all other nodes. This is much faster
+        than searching each node with the SearchWidget because Python's
+        string and regex methods scan the text of each node at C speed.
+        """
+        c = self.c
+        if self.pattern_match:
+            if not self.precompilePattern():
+                return None,None
+            matches = self.re_obj.search
+        else:
+            # Compute the pattern exactly as plainHelper does.
+            nocase = self.ignore_case
+            pattern = self.find_text.lower() if nocase else self.find_text
+            pattern = self.replaceBackSlashes(pattern)
+            if nocase:
+                matches = lambda s: pattern in s.lower()
+            else:
+                matches = lambda s: pattern in s
+        stripCR = sys.platform.lower().startswith('win')
+            # find.search ignores '\r' characters on Windows.
+        candidates,seen = set(),set()
+        # Visit each vnode once. This is faster than c.all_unique_nodes.
+        stack = [c.hiddenRootNode]
+        while stack:
+            for v in stack.pop().children:
+                if v in seen: continue
+                seen.add(v)
+                stack.append(v)
+                for flag,s in (
+                    (self.search_headline,v._headString),
+                    (self.search_body,v._bodyString),
+                ):
+                    if flag and s:
+                        if stripCR:
+                            s = s.replace('\r','')
+                        if matches(s):
+                            candidates.add(v)
+                            break
+        ancestors = set()
+        stack = list(candidates)
+        while stack:
+            for parent in stack.pop().parents:
+                if parent not in ancestors:
+                    ancestors.add(parent)
+                    stack.append(parent)
+        return candidates,ancestors
     #@+node:ekr.20141023110422.1: *5* find.createCloneFindAllNodes
     def createCloneFindAllNodes(self,clones,flattened):
         '''
@@ -1311,6 +1434,8 @@ class LeoFind:
                 # Switch to the next/prev node, if possible.
                 attempts += 1
                 p = self.p = self.nextNodeAfterFail(p)
+                if self.candidates is not None:
+                    p = self.p = self.nextCandidate(p)
                 if p: # Found another node: select the proper pane.
                     self.in_headline = self.firstSearchPane()
                     self.initNextText()
@@ -1374,7 +1499,7 @@ class LeoFind:
             ins = 0
         if trace and self.in_headline and ins is not None: g.trace(ins,p.h)
         self.init_s_ctrl(s,ins)
-    #@+node:ekr.20131123132043.16476: *5* find.nextNodeAfterFail & helper (use p.moveTo...?)
+    #@+node:ekr.20131123132043.16476: *5* find.nextNodeAfterFail & helpers (use p.moveTo...?)
     def nextNodeAfterFail(self,p):
         '''Return the next node after a failed search or None.'''
         trace = False and not g.unitTesting
@@ -1402,6 +1527,21 @@ class LeoFind:
         else:
             if trace: g.trace('found',p and p.h)
             return p
+    #@+node:agent.20261018203901.2: *6* find.nextCandidate
+    def nextCandidate(self,p):
+        '''
+        Return the first position, starting at p, whose vnode is in
+        self.candidates, or None. Forward searches skip entire trees
+        that contain no candidates.
+        '''
+        while p and p.v not in self.candidates:
+            if self.reverse or p.v in self.candidateAncestors:
+                p = self.nextNodeAfterFail(p)
+            else:
+                p = p.nodeAfterTree()
+                if p and self.outsideSearchRange(p):
+                    p = None
+        return p
     #@+node:ekr.20131123071505.16465: *6* find.outsideSearchRange
     def outsideSearchRange(self,p):
         '''
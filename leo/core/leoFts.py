@@ -0,0 +1,539 @@
+#@+leo-ver=5-thin
+#@+node:agent.20261018213537.1: * @file leoFts.py
+#@@language python
+#@@tabwidth -4
+'''
+Leo's full-text index.
+
+FtsIndex is a dependency-free inverted index of the headlines and body
+text of Leo outlines. Each index is a single file containing the
+compressed postings of each token, a token directory and a table of
+indexed nodes. The file is memory-mapped, so a search decompresses only
+the postings of the tokens in the query.
+
+Changes are kept in memory until FtsIndex.flush merges them into a new
+file. Nodes are identified by (document,gnx) pairs, where document is
+the outline's file name.
+'''
+#@+<< imports >>
+#@+node:agent.20261018213537.2: ** << imports >> (leoFts.py)
+import leo.core.leoGlobals as g
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import zlib
+from xml.sax.saxutils import escape
+#@-<< imports >>
+#@+<< data >>
+#@+node:agent.20261018213537.3: ** << data >> (leoFts.py)
+# Words are runs of letters and underscores. Digits separate words.
+token_pat = re.compile(r'[^\W\d]+',re.UNICODE)
+# Query words may end with '*' to match any suffix.
+query_pat = re.compile(r'[^\W\d]+\*?',re.UNICODE)
+
+# Words that are too common to be worth indexing.
+stop_words = frozenset([
+    'a','an','and','are','as','at','be','by','can','for','from','have',
+    'if','in','is','it','may','not','of','on','or','tbd','that','the',
+    'this','to','us','we','when','will','with','yet','you','your',
+])
+
+index = None # The singleton FtsIndex instance returned by getIndex.
+#@-<< data >>
+#@+others
+#@+node:agent.20261018213537.4: ** Top-level functions (leoFts.py)
+#@+node:agent.20261018213537.5: *3* getIndex
+def getIndex():
+    '''Return the FtsIndex for ~/.leo/fts.idx, creating it if necessary.'''
+    global index
+    if not index:
+        index = FtsIndex(g.os_path_finalize_join(g.app.homeLeoDir,'fts.idx'))
+    return index
+#@+node:agent.20261018213537.6: *3* tokenize
+def tokenize(s):
+    '''Return the list of indexed words in s.'''
+    return [z for z in token_pat.findall(s.lower())
+        if len(z) > 1 and z not in stop_words]
+#@+node:agent.20261018213537.7: ** class Segment
+class Segment:
+    '''
+    A read-only, memory-mapped index file.
+
+    The file starts with the magic string and a header giving the
+    offsets and lengths of the token directory and the node table. Both
+    are zlib-compressed json. Each directory entry is [token,offset,length],
+    the location of the token's zlib-compressed postings: pairs of
+    unsigned 32-bit ints (delta-encoded node number, term frequency).
+    Each row of the node table is [doc,gnx,h,parent,length,fingerprint].
+    '''
+    magic = b'LEOFTS1\n'
+    header = struct.Struct('<QQQQ')
+    #@+others
+    #@+node:agent.20261018213537.8: *3*  segment.ctor
+    def __init__(self,path):
+        '''Ctor for the Segment class.'''
+        self.f = open(path,'rb')
+        self.map = None
+        try:
+            self.map = mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+            n = len(self.magic)
+            if self.map[:n] != self.magic:
+                raise ValueError('not a full-text index: %s' % path)
+            dirOffset,dirLength,nodesOffset,nodesLength = \
+                self.header.unpack_from(self.map,n)
+            directory = self.load(dirOffset,dirLength)
+            self.tokens = [z[0] for z in directory]
+            self.entries = [(z[1],z[2]) for z in directory]
+            self.nodes = self.load(nodesOffset,nodesLength)
+            self.keys = [(z[0],z[1]) for z in self.nodes]
+        except Exception:
+            self.close()
+            raise
+    #@+node:agent.20261018213537.9: *3* segment.close
+    def close(self):
+        '''Close the file.'''
+        if self.map:
+            self.map.close()
+            self.map = None
+        if self.f:
+            self.f.close()
+            self.f = None
+    #@+node:agent.20261018213537.10: *3* segment.load
+    def load(self,offset,length):
+        '''Return the json object stored at offset.'''
+        s = zlib.decompress(self.map[offset:offset+length])
+        return json.loads(g.toUnicode(s))
+    #@+node:agent.20261018213537.11: *3* segment.postings
+    def postings(self,token):
+        '''Return a list of (node number, frequency) tuples for token.'''
+        i = bisect.bisect_left(self.tokens,token)
+        if i == len(self.tokens) or self.tokens[i] != token:
+            return []
+        offset,length = self.entries[i]
+        s = zlib.decompress(self.map[offset:offset+length])
+        values = struct.unpack('<%dI' % (len(s)//4),s)
+        result,n = [],0
+        for i in range(0,len(values),2):
+            n += values[i]
+            result.append((n,values[i+1]))
+        return result
+    #@+node:agent.20261018213537.12: *3* segment.tokensWithPrefix
+    def tokensWithPrefix(self,prefix):
+        '''Return all tokens starting with prefix.'''
+        i = bisect.bisect_left(self.tokens,prefix)
+        result = []
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            result.append(self.tokens[i])
+            i += 1
+        return result
+    #@-others
+#@+node:agent.20261018213537.13: ** class FtsIndex
+class FtsIndex:
+    '''
+    An incrementally updated full-text index of Leo outlines.
+
+    Searches are ranked with BM25. Words in headlines count
+    self.headlineWeight times as much as words in body text.
+    '''
+    b = 0.75
+    headlineWeight = 3
+    k1 = 1.2
+    #@+others
+    #@+node:agent.20261018213537.14: *3*  fts.ctor
+    def __init__(self,path):
+        '''Ctor for the FtsIndex class.'''
+        self.base = None
+            # The Segment for the index file, or None.
+        self.baseKeys = {}
+            # Keys are (doc,gnx), values are node numbers in self.base.
+        self.cache = {}
+            # Keys are tokens, values are dicts returned by getPostings.
+        self.changed = False
+            # True: self.records contains changes not in the file.
+        self.count = 0
+            # The number of indexed nodes.
+        self.docCounts = {}
+            # Keys are documents, values are the number of indexed nodes.
+        self.path = path
+        self.pending = set()
+            # A set of (c,v) for nodes that have changed since the last update.
+        self.records = {}
+            # Keys are (doc,gnx), values are g.Bunches or None for deleted nodes.
+            # These override the node table and postings in self.base.
+        self.terms = {}
+            # Keys are tokens, values are sets of keys in self.records.
+        self.totalLength = 0
+            # The sum of the lengths of all indexed nodes.
+        self.open()
+    #@+node:agent.20261018213537.15: *3* fts.clear
+    def clear(self):
+        '''Remove all documents from the index.'''
+        for doc in self.documents():
+            self.dropDocument(doc)
+    #@+node:agent.20261018213537.16: *3* fts.close
+    def close(self):
+        '''Write all changes and close the index file.'''
+        self.flush()
+        if self.base:
+            self.base.close()
+            self.base = None
+    #@+node:agent.20261018213537.17: *3* fts.documents
+    def documents(self):
+        '''Return the sorted list of indexed documents.'''
+        return sorted([doc for doc,n in self.docCounts.items() if n > 0])
+    #@+node:agent.20261018213537.18: *3* fts.dropDocument
+    def dropDocument(self,doc):
+        '''Remove all of doc's nodes from the index.'''
+        for key in self.keys(doc):
+            self.setRecord(key,None)
+        self.pending = set([z for z in self.pending if z[0].mFileName != doc])
+    #@+node:agent.20261018213537.19: *3* fts.flush
+    def flush(self):
+        '''Merge all changes into a new index file.'''
+        self.update()
+        if not self.changed:
+            return
+        base,records = self.base,self.records
+        # Renumber all nodes.
+        nodes,numbers = [],{}
+        if base:
+            for key,row in zip(base.keys,base.nodes):
+                if key not in records:
+                    numbers[key] = len(nodes)
+                    nodes.append(row)
+        for key in sorted(records):
+            rec = records.get(key)
+            if rec:
+                numbers[key] = len(nodes)
+                nodes.append([key[0],key[1],rec.h,rec.parent,rec.length,rec.fp])
+        # Write the postings.
+        tokens = set(self.terms)
+        if base:
+            tokens.update(base.tokens)
+        n = len(Segment.magic) + Segment.header.size
+        chunks,directory,offset = [],[],n
+        for token in sorted(tokens):
+            postings = []
+            if base:
+                for i,tf in base.postings(token):
+                    key = base.keys[i]
+                    if key not in records:
+                        postings.append((numbers[key],tf))
+            for key in self.terms.get(token,[]):
+                postings.append((numbers[key],records[key].terms[token]))
+            if postings:
+                postings.sort()
+                values,last = [],0
+                for i,tf in postings:
+                    values.extend([i-last,tf])
+                    last = i
+                s = zlib.compress(struct.pack('<%dI' % len(values),*values))
+                directory.append([token,offset,len(s)])
+                chunks.append(s)
+                offset += len(s)
+        # Write the directory and node table.
+        dirData = zlib.compress(g.toEncodedString(json.dumps(directory)))
+        nodesData = zlib.compress(g.toEncodedString(json.dumps(nodes)))
+        header = Segment.header.pack(offset,len(dirData),
+            offset+len(dirData),len(nodesData))
+        tempPath = self.path + '.tmp'
+        f = open(tempPath,'wb')
+        try:
+            f.write(Segment.magic)
+            f.write(header)
+            for s in chunks:
+                f.write(s)
+            f.write(dirData)
+            f.write(nodesData)
+        finally:
+            f.close()
+        # Replace the old file.
+        if base:
+            base.close()
+            self.base = None
+        if hasattr(os,'replace'):
+            os.replace(tempPath,self.path)
+        else:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tempPath,self.path)
+        self.open()
+    #@+node:agent.20261018213537.20: *3* fts.getRecord
+    def getRecord(self,key):
+        '''Return a g.Bunch describing the node for key, or None.'''
+        if key in self.records:
+            return self.records[key]
+        i = self.baseKeys.get(key)
+        if i is None:
+            return None
+        row = self.base.nodes[i]
+        return g.Bunch(h=row[2],parent=row[3],length=row[4],fp=row[5],terms=None)
+    #@+node:agent.20261018213654.1: *3* fts.hasDocument
+    def hasDocument(self,doc):
+        '''Return True if any of doc's nodes are indexed.'''
+        return bool(doc and self.docCounts.get(doc))
+    #@+node:agent.20261018213537.21: *3* fts.highlight
+    def highlight(self,text,query,maxLines=3):
+        '''
+        Return html for up to maxLines lines of text that contain words in
+        query. The matching words are bold.
+        '''
+        words = self.parseQuery(query)
+        prefixes = tuple([z[:-1] for z in words if z.endswith('*')])
+        exact = set([z for z in words if not z.endswith('*')])
+        lines = []
+        for line in g.splitLines(text):
+            aList,i = [],0
+            for m in token_pat.finditer(line):
+                word = m.group(0).lower()
+                if word in exact or (prefixes and word.startswith(prefixes)):
+                    aList.append(escape(line[i:m.start()]))
+                    aList.append('<b>%s</b>' % escape(m.group(0)))
+                    i = m.end()
+            if aList:
+                aList.append(escape(line[i:].rstrip()))
+                lines.append(''.join(aList))
+                if len(lines) >= maxLines:
+                    break
+        return '\n'.join(lines)
+    #@+node:agent.20261018213537.22: *3* fts.indexCommander
+    def indexCommander(self,c):
+        '''
+        Bring the index of c's outline up to date, re-indexing only
+        changed nodes. Return the number of re-indexed nodes.
+        '''
+        doc = c.mFileName
+        if not doc:
+            return 0
+        n,seen = 0,set()
+        for p in c.all_unique_positions():
+            seen.add((doc,p.gnx))
+            if self.indexPosition(doc,p):
+                n += 1
+        for key in self.keys(doc):
+            if key not in seen:
+                self.setRecord(key,None)
+        self.pending = set([z for z in self.pending if z[0] != c])
+        return n
+    #@+node:agent.20261018213537.23: *3* fts.indexPosition
+    def indexPosition(self,doc,p):
+        '''
+        Index the node at p as part of doc, if it has changed.
+        Return True if the node was re-indexed.
+        '''
+        key = doc,p.gnx
+        parent = p.parent()
+        fp = zlib.crc32(g.toEncodedString('%s\n%s\n%s' % (
+            parent.gnx if parent else '',p.h,p.b))) & 0xffffffff
+        if key in self.records:
+            rec = self.records[key]
+            if rec and rec.fp == fp:
+                return False
+        elif key in self.baseKeys:
+            if self.base.nodes[self.baseKeys[key]][5] == fp:
+                return False
+        terms = {}
+        for token in tokenize(p.b):
+            terms[token] = terms.get(token,0) + 1
+        for token in tokenize(p.h):
+            terms[token] = terms.get(token,0) + self.headlineWeight
+        self.setRecord(key,g.Bunch(
+            h=p.h,
+            parent=parent.get_UNL() if parent else doc,
+            length=sum(terms.values()),
+            fp=fp,
+            terms=terms))
+        return True
+    #@+node:agent.20261018213537.24: *3* fts.keys
+    def keys(self,doc):
+        '''Return a list of the keys of all of doc's indexed nodes.'''
+        result = [key for key in self.baseKeys
+            if key[0] == doc and key not in self.records]
+        result.extend([key for key,rec in self.records.items()
+            if rec and key[0] == doc])
+        return result
+    #@+node:agent.20261018213537.25: *3* fts.markChanged
+    def markChanged(self,c,p):
+        '''Re-index p's node before the next search, if c is indexed.'''
+        if self.hasDocument(c.mFileName):
+            self.pending.add((c,p.v))
+    #@+node:agent.20261018213537.26: *3* fts.open
+    def open(self):
+        '''Open the index file, if it exists.'''
+        self.base = None
+        self.baseKeys = {}
+        self.cache = {}
+        self.changed = False
+        self.count = self.totalLength = 0
+        self.docCounts = {}
+        self.records = {}
+        self.terms = {}
+        if not g.os_path_exists(self.path):
+            return
+        try:
+            self.base = Segment(self.path)
+        except Exception as e:
+            g.es_print('ignoring damaged full-text index: %s\n%s' % (self.path,e))
+            return
+        for i,row in enumerate(self.base.nodes):
+            doc = row[0]
+            self.baseKeys[doc,row[1]] = i
+            self.docCounts[doc] = self.docCounts.get(doc,0) + 1
+            self.totalLength += row[4]
+        self.count = len(self.base.nodes)
+    #@+node:agent.20261018213537.27: *3* fts.parseQuery
+    def parseQuery(self,query):
+        '''Return the list of words in query. Prefix words end with '*'.'''
+        return [z for z in query_pat.findall(query.lower())
+            if z.endswith('*') or (len(z) > 1 and z not in stop_words)]
+    #@+node:agent.20261018213537.28: *3* fts.resolve
+    def resolve(self,gnx,doc=None,commanders=None):
+        '''
+        Return (c,p) for the node with the given gnx in one of the given
+        commanders, by default all open commanders, preferring the
+        outline for doc. Return (None,None) if not found.
+        '''
+        if commanders is None:
+            commanders = g.app.commanders()
+        commanders = sorted(commanders,key=lambda c: c.mFileName != doc)
+        for c in commanders:
+            d = c.fileCommands.gnxDict
+            v = d.get(gnx)
+            if not v:
+                # Nodes created since the outline was read are not in gnxDict.
+                for v in c.all_unique_nodes():
+                    if v.gnx == gnx:
+                        d[gnx] = v
+                        break
+                else:
+                    v = None
+            if v:
+                p = c.vnode2position(v)
+                if p and c.positionExists(p):
+                    return c,p
+        return None,None
+    #@+node:agent.20261018213537.29: *3* fts.search
+    def search(self,query,limit=30):
+        '''
+        Return a list of up to limit hits for query, best first.
+        All words in the query must match. A trailing '*' matches any suffix.
+        Each hit is a dict with doc, gnx, h, parent and score keys.
+        '''
+        self.update()
+        postingsList = []
+        for word in self.parseQuery(query):
+            if word.endswith('*'):
+                tokens = set([z for z in self.terms if z.startswith(word[:-1])])
+                if self.base:
+                    tokens.update(self.base.tokensWithPrefix(word[:-1]))
+                tokens = list(tokens)
+            else:
+                tokens = [word]
+            if len(tokens) == 1:
+                d = self.getPostings(tokens[0])
+            else:
+                d = {}
+                for token in tokens:
+                    for key,tf in self.getPostings(token).items():
+                        d[key] = d.get(key,0) + tf
+            if not d:
+                return []
+            postingsList.append(d)
+        if not postingsList:
+            return []
+        postingsList.sort(key=len)
+        first,rest = postingsList[0],postingsList[1:]
+        n = max(1,self.count)
+        avgLength = max(1.0,float(self.totalLength)/n)
+        k1,b = self.k1,self.b
+        idfs = [math.log(1.0+(n-len(d)+0.5)/(len(d)+0.5)) for d in postingsList]
+        records = self.records
+        nodes = self.base and self.base.nodes
+        baseKeys = self.baseKeys
+        pairs = list(zip(postingsList,idfs))
+        scores = []
+        for key in set(first).intersection(*rest):
+            rec = records.get(key)
+            length = rec.length if rec else nodes[baseKeys[key]][4]
+            norm = k1*(1-b+b*length/avgLength)
+            score = 0.0
+            for d,idf in pairs:
+                tf = d[key]
+                score += idf*tf*(k1+1)/(tf+norm)
+            scores.append((score,key))
+        result = []
+        for score,key in heapq.nlargest(limit,scores):
+            rec = self.getRecord(key)
+            result.append({'doc':key[0],'gnx':key[1],
+                'h':rec.h,'parent':rec.parent,'score':score})
+        return result
+    #@+node:agent.20261018213537.30: *4* fts.getPostings
+    def getPostings(self,token):
+        '''
+        Return a dict whose keys are the keys of all live nodes containing
+        token and whose values are the token's frequencies.
+        The caller must not change the dict.
+        '''
+        d = self.cache.get(token)
+        if d is not None:
+            return d
+        d = {}
+        if self.base:
+            keys,records = self.base.keys,self.records
+            for i,tf in self.base.postings(token):
+                key = keys[i]
+                if key not in records:
+                    d[key] = tf
+        for key in self.terms.get(token,[]):
+            d[key] = self.records[key].terms[token]
+        if len(self.cache) >= 100:
+            self.cache = {}
+        self.cache[token] = d
+        return d
+    #@+node:agent.20261018213537.31: *3* fts.setRecord
+    def setRecord(self,key,rec):
+        '''Set the record for key. rec is None for deleted nodes.'''
+        doc = key[0]
+        if key in self.records:
+            old = self.records[key]
+            if old:
+                for token in old.terms:
+                    keys = self.terms[token]
+                    keys.discard(key)
+                    if not keys:
+                        del self.terms[token]
+        else:
+            old = self.getRecord(key)
+        if old:
+            self.count -= 1
+            self.docCounts[doc] -= 1
+            self.totalLength -= old.length
+        if rec:
+            self.count += 1
+            self.docCounts[doc] = self.docCounts.get(doc,0) + 1
+            self.totalLength += rec.length
+            for token in rec.terms:
+                self.terms.setdefault(token,set()).add(key)
+        if rec or key in self.baseKeys:
+            self.records[key] = rec
+        elif key in self.records:
+            del self.records[key]
+        self.cache = {}
+        self.changed = True
+    #@+node:agent.20261018213537.32: *3* fts.update
+    def update(self):
+        '''Re-index all nodes marked by markChanged.'''
+        pending,self.pending = self.pending,set()
+        for c,v in pending:
+            if c.exists and v.context == c:
+                p = c.vnode2position(v)
+                if p and c.positionExists(p):
+                    self.indexPosition(c.mFileName,p)
+    #@-others
+#@-others
+#@-leo
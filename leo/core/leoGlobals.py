@@ -123,6 +123,7 @@ else:
     import urlparse
 
 import binascii
+import hashlib
 
 # import zipfile
 
@@ -1599,7 +1600,17 @@ def clearAllIvars (o):
     """Clear all ivars of o, a member of some class."""
 
     if o:
-        o.__dict__.clear()
+        d = getattr(o,'__dict__',None)
+        if d is not None:
+            d.clear()
+        # Also clear slots, including the slots of VNodes and Positions.
+        for cls in o.__class__.__mro__:
+            slots = cls.__dict__.get('__slots__',())
+            if g.isString(slots):
+                slots = [slots]
+            for ivar in slots:
+                if ivar not in ('__dict__','__weakref__') and hasattr(o,ivar):
+                    delattr(o,ivar)
 #@+node:ekr.20031218072017.1590: *4* g.collectGarbage
 def collectGarbage():
 
@@ -1986,30 +1997,113 @@ def findLanguageDirectives(c,p):
 # Called from the syntax coloring method that colorizes section references.
 # Also called from write at.putRefAt.
 
-def findReference(c,name,root):
+def findReference(c,name,root,index=None):
 
     '''Find the section definition for name.
 
     If a search of the descendants fails,
     and an ancestor is an @root node,
     search all the descendants of the @root node.
+
+    index is an optional g.SectionIndex. It speeds up the
+    searches of the descendants of nodes in its tree.
     '''
 
-    for p in root.subtree():
-        assert(p!=root)
-        if p.matchHeadline(name) and not p.isAtIgnoreNode():
-            return p
+    def findInSubtree(p):
+        if index:
+            return index.find(name,p)
+        for p2 in p.subtree():
+            if p2.matchHeadline(name) and not p2.isAtIgnoreNode():
+                return p2
+        return None
+
+    p = findInSubtree(root)
+    if p: return p
 
     # New in Leo 4.7: expand the search for @root trees.
     for p in root.self_and_parents():
         d = g.get_directives_dict(p)
         if 'root' in d:
+            p2 = findInSubtree(p)
+            if p2: return p2
+
+    # g.trace("not found:",name,root)
+    return c.nullPosition()
+#@+node:agent.20261018212253.1: *3* class g.SectionIndex
+class SectionIndex:
+
+    '''
+    A map from section names to the nodes defining them in root's tree.
+
+    The index is built when first used. Create a new index whenever
+    root's tree changes.
+    '''
+
+    def __init__ (self,root):
+        self.d = None
+            # Keys are canonical section names, values are lists of positions
+            # in outline order. Created by self.build.
+        self.root = root.copy()
+        self.rootPath = self.path(root)
+
+    def build (self):
+        '''Create self.d from self.root's tree.'''
+        self.d = d = {}
+        for p in self.root.self_and_subtree():
+            key = self.canonicalName(p.h,headline=True)
+            if key and not p.isAtIgnoreNode():
+                aList = d.get(key)
+                if aList: aList.append(p.copy())
+                else: d[key] = [p.copy()]
+
+    def canonicalName (self,s,headline=False):
+        '''
+        Return the section name at the start of s, normalized as in
+        v.matchHeadline, or None if s does not start with a section name.
+        '''
+        s = g.toUnicode(s).lower().replace(' ','').replace('\t','')
+        if headline:
+            s = s.lstrip('.')
+        if not s.startswith('<'+'<'):
+            return None
+        i = s.find('>'+'>')
+        if i == -1:
+            return None
+        elif headline:
+            # v.matchHeadline ignores anything following the name.
+            return s[:i+2]
+        else:
+            return s if i + 2 == len(s) else None
+
+    def contains (self,p):
+        '''Return True if p is in self.root's tree.'''
+        return self.path(p)[:len(self.rootPath)] == self.rootPath
+
+    def find (self,name,p):
+        '''
+        Return the first descendant of p whose headline matches name as
+        p.matchHeadline(name) does and that is not an @ignore node.
+        Return None if there is no such descendant.
+        '''
+        key = self.canonicalName(name)
+        if key is None or not self.contains(p):
+            # The index can't help: search p's subtree.
             for p2 in p.subtree():
                 if p2.matchHeadline(name) and not p2.isAtIgnoreNode():
                     return p2
+            return None
+        if self.d is None:
+            self.build()
+        path = self.path(p)
+        n = len(path)
+        for p2 in self.d.get(key,[]):
+            if len(p2.stack) >= n and p2.stack[:n] == path:
+                return p2
+        return None
 
-    # g.trace("not found:",name,root)
-    return c.nullPosition()
+    def path (self,p):
+        '''Return the stack describing the path from the root of the outline to p.'''
+        return p.stack + ((p.v,p._childIndex),)
 #@+node:ekr.20090214075058.9: *3* g.get_directives_dict (must be fast)
 # The caller passes [root_node] or None as the second arg.
 # This allows us to distinguish between None and [None].
@@ -2022,17 +2116,32 @@ def get_directives_dict(p,root=None):
 
     Returns a dict containing the stripped remainder of the line
     following the first occurrence of each recognized directive
+
+    The result depends only on p's headline and body, so it is cached
+    in c.directivesCache until the headline, body or directives change.
     """
     trace = False and not g.unitTesting
     verbose = False
     if trace: g.trace('*'*20,p.h)
     if root: root_node = root[0]
-    d = {}
     # Do this every time so plugins can add directives.
-    pat = g.compute_directives_re()
-    directives_pat = re.compile(pat,re.MULTILINE)
+    directives_pat = g.get_directives_re()
+    h,b = p.h,p.b
+    if root and not root_node:
+        cache = None # Don't cache the warning below.
+    else:
+        cache = getattr(p.v.context,'directivesCache',None)
+    if cache is not None:
+        data = cache.get(p.v.fileIndex)
+        if data:
+            h2,b2,root2,pat2,d = data
+            if h2 == h and b2 == b and root2 == bool(root) and pat2 is directives_pat:
+                if '@path_in_body' in d:
+                    g.app.atPathInBodyWarning = h
+                return dict(d)
+    d = {}
     # The headline has higher precedence because it is more visible.
-    for kind,s in (('head',p.h),('body',p.b)):
+    for kind,s in (('head',h),('body',b)):
         anIter = directives_pat.finditer(s)
         for m in anIter:
             word = m.group(0)[1:] # Omit the @
@@ -2063,7 +2172,7 @@ def get_directives_dict(p,root=None):
                         if trace: g.trace('@path in body',p.h)
 
     if root:
-        anIter = g_noweb_root.finditer(p.b)
+        anIter = g_noweb_root.finditer(b)
         for m in anIter:
             if root_node:
                 d["root"]=0 # value not immportant
@@ -2071,6 +2180,8 @@ def get_directives_dict(p,root=None):
                 g.es('%s= may only occur in a topmost node (i.e., without a parent)' % (
                     g.angleBrackets('*')))
             break
+    if cache is not None:
+        cache[p.v.fileIndex] = h,b,bool(root),directives_pat,dict(d)
     if trace and verbose:
         g.trace('%4d' % (len(p.h) + len(p.b)))
     return d
@@ -2095,6 +2206,21 @@ def compute_directives_re ():
             # @others can have leading whitespace.
             aList.append(r'^\s@others\s')
         return '|'.join(aList)
+#@+node:agent.20261018195120.1: *4* get_directives_re
+g_directives_key = None
+g_directives_re = None
+
+def get_directives_re():
+    '''
+    Return the compiled form of compute_directives_re(),
+    recompiling it only when globalDirectiveList changes.
+    '''
+    global g_directives_key,g_directives_re
+    key = tuple(globalDirectiveList)
+    if key != g_directives_key:
+        g_directives_key = key
+        g_directives_re = re.compile(g.compute_directives_re(),re.MULTILINE)
+    return g_directives_re
 #@+node:ekr.20080827175609.1: *3* g.get_directives_dict_list (must be fast)
 def get_directives_dict_list(p):
 
@@ -3629,6 +3755,10 @@ def is_special(s,i,directive):
     # j = g.skip_line(s,i) ; g.trace(s[i:j],':',directive)
     assert (directive and directive [0] == '@' )
 
+    # Most bodies don't contain the directive at all. Find that out quickly.
+    if s.find(directive,i) == -1:
+        return False, -1
+
     # 10/23/02: all directives except @others must start the line.
     skip_flag = directive in ("@others","@all")
     while i < len(s):
@@ -3952,7 +4082,7 @@ def enableIdleTimeHook(idleTimeDelay=500,idleTimeHandler=None):
 #@+node:ekr.20140825042850.18410: *4* g.IdleTime
 def IdleTime(handler,delay=500,tag=None):
     '''A proxy for the g.app.gui.IdleTime class.'''
-    if g.app and g.app.gui and hasattr(g.app.gui,'idleTimeClass'):
+    if g.app and g.app.gui and getattr(g.app.gui,'idleTimeClass',None):
         return g.app.gui.idleTimeClass(handler,delay,tag)
     else:
         return None
@@ -6504,10 +6634,6 @@ def getScript (c,p,useSelectedText=True,forcePythonSentinels=True,useSentinels=T
     Return the expansion of all of node p's body text if
     p is not the current node or if there is no text selection.'''
 
-    # New in Leo 4.6 b2: use a pristine AtFile handler
-    # so there can be no conflict with c.atFileCommands.
-    import leo.core.leoAtFile as leoAtFile
-    at = leoAtFile.AtFile(c)
     w = c.frame.body.wrapper
     p1 = p and p.copy()
     if not p: p = c.p
@@ -6527,11 +6653,20 @@ def getScript (c,p,useSelectedText=True,forcePythonSentinels=True,useSentinels=T
                 # encoding = scanAtEncodingDirectives(aList) or 'utf-8'
                 # s = g.insertCodingLine(encoding,s)
             g.app.scriptDict["script1"]=s
-            # Important: converts unicode to utf-8 encoded strings.
-            script = at.writeFromString(p.copy(),s,
-                forcePythonSentinels=forcePythonSentinels,
-                useSentinels=useSentinels)
-            script = script.replace("\r\n","\n") # Use brute force.
+            cache = g.app.scriptCache
+            key = cache.scriptKey(c,p,s,forcePythonSentinels,useSentinels)
+            script = cache.get(key)
+            if script is None:
+                # New in Leo 4.6 b2: use a pristine AtFile handler
+                # so there can be no conflict with c.atFileCommands.
+                import leo.core.leoAtFile as leoAtFile
+                at = leoAtFile.AtFile(c)
+                # Important: converts unicode to utf-8 encoded strings.
+                script = at.writeFromString(p.copy(),s,
+                    forcePythonSentinels=forcePythonSentinels,
+                    useSentinels=useSentinels)
+                script = script.replace("\r\n","\n") # Use brute force.
+                cache.put(key,script)
             # Important, the script is an **encoded string**, not a unicode string.
             g.app.scriptDict["script2"]=script
         else: script = ''
@@ -6540,6 +6675,82 @@ def getScript (c,p,useSelectedText=True,forcePythonSentinels=True,useSentinels=T
         g.es_exception()
         script = ''
     return script
+#@+node:agent.20261018213212.1: *3* class g.ScriptCache
+class ScriptCache:
+    '''
+    A least-recently-used cache of the scripts computed by g.getScript
+    and of the code objects that execute them.
+
+    Script keys are hashes of everything the expansion depends on: the
+    script's text, the headlines, bodies and gnx's of p's subtree, and
+    the bodies of p's ancestors, which contain the directives in effect.
+    Cached scripts are identical to freshly computed scripts, so
+    c.goToScriptLineNumber works as before.
+    '''
+    #@+others
+    #@+node:agent.20261018213212.2: *4* sc.ctor
+    def __init__ (self,maxSize=100):
+
+        self.d = {}
+            # Keys are hashes, values are [tick,value] lists.
+        self.hits = 0
+        self.maxSize = maxSize
+        self.misses = 0
+        self.tick = 0
+            # Incremented on every access.
+    #@+node:agent.20261018213212.3: *4* sc.clear
+    def clear (self):
+        '''Clear the cache.'''
+        self.d = {}
+    #@+node:agent.20261018213212.4: *4* sc.compileScript
+    def compileScript (self,script,fileName='<string>'):
+        '''Return the code object for script, compiling it only if necessary.'''
+        key = self.hash(['code',fileName,script])
+        code = self.get(key)
+        if code is None:
+            code = compile(script,fileName,'exec')
+            self.put(key,code)
+        return code
+    #@+node:agent.20261018213212.5: *4* sc.get & put
+    def get (self,key):
+        '''Return the value for key, or None.'''
+        aList = self.d.get(key)
+        if aList is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tick += 1
+        aList[0] = self.tick
+        return aList[1]
+
+    def put (self,key,value):
+        '''Add value to the cache, evicting the least recently used entry if full.'''
+        if len(self.d) >= self.maxSize and key not in self.d:
+            oldest = min(self.d,key=lambda k: self.d[k][0])
+            del self.d[oldest]
+        self.tick += 1
+        self.d[key] = [self.tick,value]
+    #@+node:agent.20261018213212.6: *4* sc.hash
+    def hash (self,aList):
+        '''Return a hash of a list of strings.'''
+        h = hashlib.md5()
+        for s in aList:
+            s = g.toEncodedString(s,'utf-8')
+            # Include the length so that the boundaries between strings matter.
+            h.update(g.toEncodedString('%s:' % len(s)))
+            h.update(s)
+        return h.hexdigest()
+    #@+node:agent.20261018213212.7: *4* sc.scriptKey
+    def scriptKey (self,c,p,s,forcePythonSentinels,useSentinels):
+        '''Return the cache key for g.getScript(c,p).'''
+        aList = ['script',repr((forcePythonSentinels,useSentinels,c.tab_width)),s]
+        for p2 in p.parents():
+            aList.append(p2.b)
+        aList.extend([p.gnx,p.h])
+        for p2 in p.subtree():
+            aList.extend([str(p2.level()),p2.gnx,p2.h,p2.b])
+        return self.hash(aList)
+    #@-others
 #@+node:ekr.20060624085200: *3* g.handleScriptException
 def handleScriptException (c,p,script,script1):
 
@@ -11,12 +11,16 @@ import leo.core.leoGlobals as g
 
 import leo.external.codewise as codewise
 
+import ast
+import bisect
 import glob
 import inspect
 import os
 import re
 import string
 import sys
+import textwrap
+import threading
 import time
 #@-<< imports >>
 #@+<< Key bindings, an overview >>
@@ -177,6 +181,11 @@ class AutoCompleterClass:
             # The (global) completions for "self."
         self.completionsDict = {}
             # Keys are prefixes, values are completion lists.
+        self.symbolIndex = None
+            # A SymbolIndex, replacing codewise queries.
+        if c.config.getBool('use_symbol_index',default=True):
+            self.symbolIndex = SymbolIndex(c)
+        self.symbolIndexGeneration = 0
         # Options...
         self.auto_tab       = c.config.getBool('auto_tab_complete',False)
         self.forbid_invalid = c.config.getBool('forbid_invalid_completions',False)
@@ -751,18 +760,24 @@ class AutoCompleterClass:
     #@+node:ekr.20110510120621.14543: *6* ac.lookup_functions/methods/modules
     def lookup_functions(self,prefix):
 
+        if self.symbolIndex:
+            return self.symbolIndex.get_functions(prefix)
         aList = codewise.cmd_functions([prefix])
         hits = [z.split(None,1) for z in aList if z.strip()]
         return self.clean(hits)
 
     def lookup_methods(self,aList,prefix): # prefix not used, only aList[0] used.
 
+        if self.symbolIndex:
+            return self.symbolIndex.get_members(aList[0])
         aList = codewise.cmd_members([aList[0]])
         hits = [z.split(None,1) for z in aList if z.strip()]
         return self.clean(hits)
 
     def lookup_modules (self,aList,prefix): # prefix not used, only aList[0] used.
 
+        if self.symbolIndex:
+            return self.symbolIndex.get_module_functions(aList[0])
         aList = codewise.cmd_functions([aList[0]])
         hits = [z.split(None,1) for z in aList if z.strip()]
         return self.clean(hits)
@@ -1042,6 +1057,14 @@ class AutoCompleterClass:
 
         # We don't need to clear this now that we don't use ContextSniffer.
         # self.completionsDict = {}
+        si = self.symbolIndex
+        if si:
+            # Clear the cached completions if the index has changed.
+            if si.generation != self.symbolIndexGeneration:
+                self.symbolIndexGeneration = si.generation
+                self.codewiseSelfList = []
+                self.completionsDict = {}
+            si.update()
 
         if self.use_qcompleter:
             self.init_qcompleter(event)
@@ -1109,6 +1132,255 @@ class ContextSniffer:
             self.vars[var] = vars
         vars.append(klass)
     #@-others
+#@+node:agent.20261018204917.1: ** class SymbolIndex
+class SymbolIndex:
+    '''
+    An in-process index of the classes, functions and methods defined in
+    the outline's python @<file> trees and in an optional ctags file.
+
+    si.update runs in the main thread. It finds the nodes whose text has
+    changed since the last update. A separate thread parses those nodes
+    and rebuilds the sorted lists used by the queries. Queries never wait
+    for the thread: they use the lists of the last completed build.
+    '''
+    #@+others
+    #@+node:agent.20261018204917.2: *3* si.ctor
+    def __init__ (self,c):
+        '''Ctor for SymbolIndex class.'''
+        self.c = c
+        self.ctagsFileName = c.config.getString('autocompleter_ctags_file')
+        self.ctagsSymbols = None # The symbols of the ctags file, read in the thread.
+        self.error = None # An error message from the thread, reported by si.update.
+        self.generation = 0 # Incremented after each build.
+        self.nodes = {} # Keys are vnodes, values are g.Bunches.
+        self.thread = None
+        # The results of the last build. Only the thread sets these.
+        self.functions = [] # Sorted names of all functions and methods.
+        self.members = {} # Keys are class names, values are sorted lists of method names.
+        self.modules = {} # Keys are module names, values are sorted lists of function names.
+    #@+node:agent.20261018204917.3: *3* si.Queries
+    def find (self,aList,prefix):
+        '''Return the items of sorted list aList that start with prefix.'''
+        i = bisect.bisect_left(aList,prefix)
+        j = i
+        while j < len(aList) and aList[j].startswith(prefix):
+            j += 1
+        return aList[i:j]
+
+    def get_functions (self,prefix=''):
+        '''Return the names of all functions and methods that start with prefix.'''
+        return self.find(self.functions,prefix)
+
+    def get_members (self,className,prefix=''):
+        '''Return the names of the methods of className that start with prefix.'''
+        return self.find(self.members.get(className,[]),prefix)
+
+    def get_module_functions (self,module,prefix=''):
+        '''Return the names of the functions of module that start with prefix.'''
+        return self.find(self.modules.get(module,[]),prefix)
+    #@+node:agent.20261018204917.4: *3* si.update & helper
+    def update (self):
+        '''
+        Start a thread that parses all python nodes that have changed since
+        the last update. Do nothing if the thread is already running.
+        '''
+        c = self.c
+        if self.isBusy():
+            return
+        if self.error:
+            g.es_print(self.error,color='red')
+            self.error = None
+        d,changed = {},[]
+        for p in c.all_unique_positions():
+            if p.isAnyAtFileNode():
+                module,ext = g.os_path_splitext(g.shortFileName(p.anyAtFileNodeName()))
+                if ext in ('.py','.pyw'):
+                    self.scanTree(p.v,module,None,d,changed)
+        deleted = [v for v in self.nodes if v not in d]
+        self.nodes = d
+        if changed or deleted or (self.ctagsFileName and self.ctagsSymbols is None):
+            self.thread = threading.Thread(target=self.run,args=(changed,),name='leo-symbols')
+            self.thread.daemon = True # Don't delay Leo's exit.
+            self.thread.start()
+
+    def scanTree (self,v,module,className,d,changed):
+        '''
+        Add the nodes of v's tree to d. Add the nodes whose body,
+        module or class have changed to the changed list.
+        '''
+        bunch = self.nodes.get(v)
+        s = v.b
+        if (not bunch or bunch.body is not s or
+            bunch.module != module or bunch.className != className
+        ):
+            bunch = g.Bunch(body=s,className=className,module=module,symbols=[])
+            changed.append(bunch)
+        d[v] = bunch
+        if v.children:
+            # Methods in child nodes belong to the last class of v's body
+            # if @others follows the class.
+            m = None
+            for m in self.class_pattern.finditer(s):
+                pass
+            if m and '@others' in s[m.end():]:
+                className = m.group(2)
+            for child in v.children:
+                if child not in d:
+                    self.scanTree(child,module,className,d,changed)
+    #@+node:agent.20261018204917.5: *3* si.isBusy & wait
+    def isBusy (self):
+        '''Return True if the thread is running.'''
+        return bool(self.thread and self.thread.is_alive())
+
+    def wait (self):
+        '''Wait for the thread to end.'''
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+    #@+node:agent.20261018204917.6: *3* si.run & helpers (thread)
+    def run (self,changed):
+        '''
+        Parse the changed nodes, then rebuild the sorted lists.
+        Errors are saved in self.error: si.update reports them.
+        '''
+        for bunch in changed:
+            bunch.symbols = self.parseBody(bunch.body,bunch.className)
+        if self.ctagsFileName and self.ctagsSymbols is None:
+            try:
+                self.ctagsSymbols = self.readCtagsFile(self.ctagsFileName)
+            except Exception as e:
+                # Don't try again: index the outline without the ctags file.
+                self.ctagsSymbols = []
+                self.error = 'can not read autocompleter_ctags_file: %s\n%s' % (
+                    self.ctagsFileName,e)
+        self.build()
+    #@+node:agent.20261018204917.7: *4* si.build
+    def build (self):
+        '''Rebuild the sorted lists from all symbols.'''
+        functions,members,modules = set(),{},{}
+        aList = [(z.module,z.symbols) for z in list(self.nodes.values())]
+        aList.extend(self.ctagsSymbols or [])
+        for module,symbols in aList:
+            for kind,name,className in symbols:
+                if kind == 'class':
+                    members.setdefault(name,set())
+                else:
+                    functions.add(name)
+                    if className:
+                        members.setdefault(className,set()).add(name)
+                    else:
+                        modules.setdefault(module,set()).add(name)
+        # Assign the results all at once: the main thread may use them at any time.
+        self.members = dict([(key,sorted(val)) for key,val in members.items()])
+        self.modules = dict([(key,sorted(val)) for key,val in modules.items()])
+        self.functions = sorted(functions)
+        self.generation += 1
+    #@+node:agent.20261018204917.8: *4* si.parseBody & helpers
+    class_pattern = re.compile(r'^(\s*)class\s+(\w+)',re.MULTILINE)
+    def_pattern = re.compile(r'^(\s*)(class|def)\s+(\w+)',re.MULTILINE)
+    section_pattern = re.compile(r'^(\s*)<<.*>>\s*$')
+
+    def parseBody (self,s,className):
+        '''
+        Return a list of (kind,name,className) tuples for the classes,
+        functions and methods defined in s, the body text of a node.
+        kind is 'class', 'function' or 'method'. className is the class
+        containing s, or None.
+        '''
+        try:
+            tree = ast.parse(self.cleanBody(s))
+        except Exception: # SyntaxError, etc.
+            return self.scanBody(s,className)
+        result = []
+        for node in tree.body:
+            if isinstance(node,ast.ClassDef):
+                result.append(('class',node.name,None))
+                for node2 in node.body:
+                    if isinstance(node2,ast.FunctionDef):
+                        result.append(('method',node2.name,node.name))
+            elif isinstance(node,ast.FunctionDef):
+                if className:
+                    result.append(('method',node.name,className))
+                else:
+                    result.append(('function',node.name,None))
+        return result
+    #@+node:agent.20261018204917.9: *5* si.cleanBody
+    def cleanBody (self,s):
+        '''
+        Return s as valid python code: remove Leo directives and doc parts,
+        replace @others and section references by 'pass' and remove common
+        indentation.
+        '''
+        result,inDoc = [],False
+        for line in g.splitLines(s):
+            stripped = line.strip()
+            if inDoc:
+                if stripped in ('@c','@code'):
+                    inDoc = False
+                result.append('\n')
+            elif stripped in ('@','@doc') or stripped.startswith(('@ ','@doc ')):
+                inDoc = True
+                result.append('\n')
+            elif stripped.startswith(('@others','@all')):
+                result.append('%spass\n' % line[:len(line)-len(line.lstrip())])
+            elif stripped.startswith('@') and g.isDirective(stripped):
+                # Decorators are not directives.
+                result.append('\n')
+            else:
+                m = self.section_pattern.match(line)
+                if m:
+                    result.append('%spass\n' % m.group(1))
+                else:
+                    result.append(line)
+        return textwrap.dedent(''.join(result))
+    #@+node:agent.20261018204917.10: *5* si.scanBody
+    def scanBody (self,s,className):
+        '''Find definitions in s with a regex when s is not valid python.'''
+        result,indent = [],None
+        for m in self.def_pattern.finditer(s):
+            lws,kind,name = m.group(1),m.group(2),m.group(3)
+            if kind == 'class':
+                result.append(('class',name,None))
+                indent,className2 = lws,name
+            elif indent is not None and len(lws) > len(indent):
+                result.append(('method',name,className2))
+            elif className:
+                result.append(('method',name,className))
+            else:
+                result.append(('function',name,None))
+        return result
+    #@+node:agent.20261018204917.11: *4* si.readCtagsFile
+    def readCtagsFile (self,fileName):
+        '''Return a list of (module,symbols) tuples for all entries of a ctags file.'''
+        d = {} # Keys are module names, values are lists of symbols.
+        f = open(g.os_path_expanduser(fileName),'rb')
+        try:
+            for line in f:
+                line = g.toUnicode(line)
+                if line.startswith('!'):
+                    continue
+                fields = line.rstrip('\r\n').split('\t')
+                if len(fields) < 4:
+                    continue
+                name,fn,kind = fields[0],fields[1],fields[3]
+                module = g.os_path_splitext(g.os_path_basename(fn))[0]
+                className = None
+                for field in fields[4:]:
+                    if field.startswith('class:'):
+                        className = field[6:].split('.')[-1]
+                if kind == 'c':
+                    symbol = ('class',name,None)
+                elif className:
+                    symbol = ('method',name,className)
+                elif kind in ('f','m'):
+                    symbol = ('function',name,None)
+                else:
+                    continue
+                d.setdefault(module,[]).append(symbol)
+        finally:
+            f.close()
+        return list(d.items())
+    #@-others
 #@+node:ekr.20140813052702.18194: ** class FileNameChooser
 class FileNameChooser:
     '''A class encapsulation file selection & completion logic.'''
@@ -201,6 +201,10 @@ class NodeIndices (object):
 
 # Positions should *never* be saved by the ZOBD.
 class Position (object):
+    # Positions are created and copied very often.
+    # Slots make them smaller and faster to create.
+    # __dict__ allows plugins to set other attributes.
+    __slots__ = ('_childIndex','v','stack','txtOffset','__dict__','__weakref__')
     #@+others
     #@+node:ekr.20040228094013: *3*  p.ctor & other special methods...
     #@+node:ekr.20080416161551.190: *4*  p.__init__
@@ -211,10 +215,8 @@ class Position (object):
         self._childIndex = childIndex
         self.v = v
         # New in Leo 4.5: stack entries are tuples (v,childIndex).
-        if stack:
-            self.stack = stack[:] # Creating a copy here is safest and best.
-        else:
-            self.stack = []
+        # The stack itself is a tuple, so copies of positions can share it.
+        self.stack = tuple(stack) if stack else ()
         g.app.positions += 1
         self.txtOffset = None # see self.textOffset()
     #@+node:ekr.20080920052058.3: *4* p.__eq__ & __ne__
@@ -1412,7 +1414,7 @@ class Position (object):
         p = self
 
         if p.v and p.v.children:
-            p.stack.append((p.v,p._childIndex),)
+            p.stack = p.stack + ((p.v,p._childIndex),)
             p.v = p.v.children[0]
             p._childIndex = 0
         else:
@@ -1427,7 +1429,7 @@ class Position (object):
         p = self
 
         if p.v and p.v.children:
-            p.stack.append((p.v,p._childIndex),)
+            p.stack = p.stack + ((p.v,p._childIndex),)
             n = len(p.v.children)
             p.v = p.v.children[n-1]
             p._childIndex = n-1
@@ -1487,7 +1489,7 @@ class Position (object):
         p = self
 
         if p.v and len(p.v.children) > n:
-            p.stack.append((p.v,p._childIndex),)
+            p.stack = p.stack + ((p.v,p._childIndex),)
             p.v = p.v.children[n]
             p._childIndex = n
         else:
@@ -1499,7 +1501,8 @@ class Position (object):
         """Move a position to its parent position."""
         p = self
         if p.v and p.stack:
-            p.v,p._childIndex = p.stack.pop()
+            p.v,p._childIndex = p.stack[-1]
+            p.stack = p.stack[:-1]
         else:
             p.v = None
         return p
@@ -1646,8 +1649,12 @@ class Position (object):
         # p will change if p2 is a previous sibling of p or
         # p2 is a previous sibling of any ancestor of p.
 
+        # This code compares child indices instead of moving
+        # through the siblings, so it takes constant time
+        # regardless of the number of siblings.
+
         trace = False and not g.unitTesting
-        p = self ; sib = p.copy()
+        p = self
 
         if trace:
             g.trace('entry')
@@ -1655,37 +1662,40 @@ class Position (object):
             g.trace('p2',p2)
             g.trace('p.stack',p.stack)
 
+        if not p2.v:
+            return
+
         # A special case for previous siblings.
         # Adjust p._childIndex, not the stack's childIndex.
-        while sib.hasBack():
-            sib.moveToBack()
-            if sib == p2:
+        n = p2._childIndex
+        if p.v and p2.stack == p.stack:
+            parent_v = p._parentVnode()
+            children = parent_v.children
+            if 0 <= n < p._childIndex <= len(children) and children[n] == p2.v:
                 p._childIndex -= 1
                 if trace: g.trace('***new index: %s\n%s' % (
                     p.h,p.stack))
                 return
 
         # Adjust p's stack.
-        stack = [] ; changed = False ; i = 0
-        while i < len(p.stack):
+        # Only the stack entry at p2's level can match p2.
+        i = len(p2.stack)
+        if i < len(p.stack) and p2.stack == p.stack[:i]:
             v,childIndex = p.stack[i]
-            p3 = Position(v=v,childIndex=childIndex,stack=stack[:i])
-            while p3:
-                if p2 == p3:
-                    # 2011/02/25: compare full positions, not just vnodes.
-                    # A match with the to-be-moved node.
-                    stack.append((v,childIndex-1),)
-                    changed = True
-                    break # terminate only the inner loop.
-                p3.moveToBack()
+            if i == 0:
+                parent_v = p2.v.context.hiddenRootNode
             else:
-                stack.append((v,childIndex),)
-            i += 1
-
-        if changed:
-            if trace: g.trace('***new stack: %s\n%s' % (
-                p.h,stack))
-            p.stack = stack
+                parent_v = p.stack[i-1][0]
+            children = parent_v.children
+            if (
+                (n == childIndex and p2.v == v) or
+                (0 <= n < childIndex <= len(children) and children[n] == p2.v)
+            ):
+                # A match with the to-be-moved node.
+                stack = p.stack[:i] + ((v,childIndex-1),) + p.stack[i+1:]
+                if trace: g.trace('***new stack: %s\n%s' % (
+                    p.h,stack))
+                p.stack = stack
     #@+node:ekr.20080416161551.214: *4* p._linkAfter
     def _linkAfter (self,p_after,adjust=True):
 
@@ -1696,7 +1706,7 @@ class Position (object):
             # Returns None if p.v is None
 
         # Init the ivars.
-        p.stack = p_after.stack[:]
+        p.stack = p_after.stack
         p._childIndex = p_after._childIndex + 1
 
         # Set the links.
@@ -1710,8 +1720,7 @@ class Position (object):
         parent_v = parent.v
 
         # Init the ivars.
-        p.stack = parent.stack[:]
-        p.stack.append((parent_v,parent._childIndex),)
+        p.stack = parent.stack + ((parent_v,parent._childIndex),)
         p._childIndex = n
 
         child = p.v
@@ -1729,7 +1738,7 @@ class Position (object):
         # else:       oldRootNode = None
 
         # Init the ivars.
-        p.stack = []
+        p.stack = ()
         p._childIndex = 0
         parent_v = hiddenRootNode
         child = p.v
@@ -1764,6 +1773,7 @@ class Position (object):
             return
         if parent_v.children[p._childIndex] == v:
             parent_v.children[p._childIndex] = v2
+            parent_v._childIndexData = None
             v2.parents.append(parent_v)
             # p.v no longer truly exists.
             # p.v = p2.v
@@ -1890,6 +1900,17 @@ class VNodeBase (object):
     dirtyBit    = 0x200
     writeBit    = 0x400
     #@-<< VNode constants >>
+    if not use_zodb:
+        # Slots make vnodes smaller. __dict__ is created only when
+        # some other attribute is set, usually by plugins.
+        __slots__ = (
+            '_bodyString','_childIndexData','_headString','_p_changed',
+            'children','context','expandedPositions','fileIndex',
+            'iconVal','insertSpot','parents','scrollBarSpot',
+            'selectionLength','selectionStart','statusBits',
+            'tempAttributes','unknownAttributes',
+            '__dict__','__weakref__',
+        )
     #@+others
     #@+node:ekr.20031218072017.3342: *3* v.Birth & death
     #@+node:ekr.20031218072017.3344: *4* v.__init
@@ -1905,6 +1926,7 @@ class VNodeBase (object):
         # Structure data...
         self.children = [] # Ordered list of all children of this node.
         self.parents = [] # Unordered list of all parents of this node.
+        self._childIndexData = None # Used by v._indexOfChild.
         # Other essential data...
         if gnx:
             self.fileIndex = gnx
@@ -1920,7 +1942,8 @@ class VNodeBase (object):
         self.context = context # The context containing context.hiddenRootNode.
             # Required so we can compute top-level siblings.
             # It is named .context rather than .c to emphasize its limited usage.
-        self.expandedPositions = [] # Positions that should be expanded.
+        self.expandedPositions = () # Positions that should be expanded.
+            # Code that changes this creates a new list.
         self.insertSpot = None # Location of previous insert point.
         self.scrollBarSpot = None # Previous value of scrollbar position.
         self.selectionLength = 0 # The length of the selected body text.
@@ -2506,6 +2529,15 @@ class VNodeBase (object):
         parent_v.childrenModified()    
         # Update parent_v.children & v.parents.
         parent_v.children.insert(childIndex,v)
+        data = parent_v._childIndexData
+        if data:
+            # Appending keeps the index valid. Anything else invalidates it.
+            children = parent_v.children
+            if data[0] is children and data[1] == childIndex == len(children)-1:
+                data[2].setdefault(v,childIndex)
+                data[1] += 1
+            else:
+                parent_v._childIndexData = None
         v.parents.append(parent_v)
         if trace: g.trace('*** added parent',parent_v,'to',v,
             'len(parents)',len(v.parents))
@@ -2541,6 +2573,16 @@ class VNodeBase (object):
         parent_v.childrenModified()    
         assert parent_v.children[childIndex]==v
         del parent_v.children[childIndex]
+        data = parent_v._childIndexData
+        if data:
+            # Removing the last child keeps the index valid.
+            children = parent_v.children
+            if data[0] is children and data[1] == childIndex+1 == len(children)+1:
+                if data[2].get(v) == childIndex:
+                    del data[2][v]
+                data[1] -= 1
+            else:
+                parent_v._childIndexData = None
         v.parents.remove(parent_v)
         v._p_changed = 1
         parent_v._p_changed = 1
@@ -2562,6 +2604,33 @@ class VNodeBase (object):
         if len(v.parents) == 0:
             for child in v.children:
                 child._cutParentLinks(parent=v)
+    #@+node:agent.20261018195306.1: *4* v._indexOfChild
+    def _indexOfChild(self,child):
+        '''
+        Return the index of the first occurrence of child in v.children,
+        or -1 if child is not a child of v.
+
+        For nodes with many children this uses a dict, rebuilt whenever
+        v.children has been replaced or has changed size.
+        '''
+        v = self
+        children = v.children
+        n = len(children)
+        if n < 20:
+            try:
+                return children.index(child)
+            except ValueError:
+                return -1
+        data = v._childIndexData
+        if data and data[0] is children and data[1] == n:
+            i = data[2].get(child,-1)
+            if i == -1 or (i < n and children[i] is child):
+                return i
+        d = {}
+        for i in range(n-1,-1,-1):
+            d[children[i]] = i
+        v._childIndexData = [children,n,d]
+        return d.get(child,-1)
     #@+node:ekr.20031218072017.3425: *4* v._linkAsNthChild (used by 4.x read logic)
     def _linkAsNthChild (self,parent_v,n):
 
@@ -2610,7 +2679,7 @@ class VNodeBase (object):
         if val is None:
             if hasattr(v,'unknownAttributes'):
                 delattr(v,'unknownAttributes')
-        elif type(val) == type({}):
+        elif isinstance(val,dict):
             v.unknownAttributes = val
         else:
             raise ValueError
@@ -9,6 +9,7 @@
 import leo.core.leoGlobals as g
 # import bisect
 import sys
+import time
 
 #@+others
 #@+node:ekr.20100908125007.6041: ** Top-level functions
@@ -266,6 +267,116 @@ class BaseLeoPlugin(object):
             script=script, 
             buttonText = buttonText, bg = color)
     #@-others
+#@+node:agent.20261018213015.1: ** class HookProfiler
+class HookProfiler:
+    '''
+    Record the time taken by each hook handler.
+
+    Enabled by --trace-hooks, @bool profile-hooks or a nonzero
+    @int idle-hook-budget-ms. When the budget is nonzero, idle handlers
+    that are repeatedly slower than the budget are called less often.
+    '''
+    #@+others
+    #@+node:agent.20261018213015.2: *3*  hp.ctor
+    def __init__ (self,budget=0):
+
+        self.budget = budget
+            # The idle-time budget in seconds. 0: never demote idle handlers.
+        self.clock = getattr(time,'perf_counter',time.time)
+        self.divisors = {}
+            # Keys are handlers, values are n: call the handler every n idle ticks.
+        self.maxDivisor = 64
+        self.maxSamples = 1000
+            # The number of recent times kept for percentiles.
+        self.maxSlowCalls = 3
+            # The number of consecutive slow calls that demote an idle handler.
+        self.stats = {}
+            # Keys are (tag,handler), values are g.Bunches.
+        self.ticks = {}
+            # Keys are handlers, values are the number of skipped idle ticks.
+    #@+node:agent.20261018213015.3: *3* hp.clear
+    def clear (self):
+        '''Clear all statistics and restore demoted idle handlers.'''
+        self.divisors = {}
+        self.stats = {}
+        self.ticks = {}
+    #@+node:agent.20261018213015.4: *3* hp.isDue
+    def isDue (self,bunch):
+        '''Return True if the idle handler in bunch should be called now.'''
+        fn = bunch.fn
+        n = self.divisors.get(fn)
+        if not n:
+            return True
+        i = self.ticks.get(fn,0) + 1
+        self.ticks[fn] = i % n
+        return i == n
+    #@+node:agent.20261018213015.5: *3* hp.record
+    def record (self,tag,bunch,t):
+        '''Record that the handler in bunch took t seconds to handle tag.'''
+        key = tag,bunch.fn
+        stat = self.stats.get(key)
+        if not stat:
+            self.stats[key] = stat = g.Bunch(count=0,max=0.0,moduleName=bunch.moduleName,
+                samples=[],slow=0,total=0.0)
+        if len(stat.samples) < self.maxSamples:
+            stat.samples.append(t)
+        else:
+            stat.samples[stat.count % self.maxSamples] = t
+        stat.count += 1
+        stat.total += t
+        if t > stat.max:
+            stat.max = t
+        if tag == 'idle' and self.budget:
+            # Demote only handlers that are slow several times in a row.
+            stat.slow = stat.slow + 1 if t > self.budget else 0
+            if stat.slow >= self.maxSlowCalls:
+                self.demote(bunch,stat,t)
+    #@+node:agent.20261018213015.6: *3* hp.demote
+    def demote (self,bunch,stat,t):
+        '''Call the idle handler in bunch half as often as before.'''
+        fn = bunch.fn
+        n = self.divisors.get(fn,1)
+        if n < self.maxDivisor:
+            self.divisors[fn] = n = 2 * n
+            g.es_print('idle handler %s took %.1f ms: calling it every %s idle ticks' % (
+                self.handlerName(fn,stat.moduleName),1000*t,n))
+        # Demote again only if the handler stays slow.
+        stat.slow = 0
+    #@+node:agent.20261018213015.7: *3* hp.handlerName
+    def handlerName (self,fn,moduleName):
+        '''Return a short name for a handler.'''
+        name = moduleName or ''
+        if name.startswith('leo.plugins.'):
+            name = name[len('leo.plugins.'):]
+        fnName = getattr(fn,'__name__',repr(fn))
+        return '%s.%s' % (name,fnName) if name else fnName
+    #@+node:agent.20261018213015.8: *3* hp.percentile
+    def percentile (self,aList,fraction):
+        '''Return the given percentile of aList, a sorted list.'''
+        if not aList:
+            return 0.0
+        i = min(len(aList)-1,int(fraction * len(aList)))
+        return aList[i]
+    #@+node:agent.20261018213015.9: *3* hp.report
+    def report (self):
+        '''Return a list of lines describing all handlers, slowest first.'''
+        result = ['%7s %10s %8s %8s %8s %8s  %s' % (
+            'calls','total ms','mean','p50','p95','max','tag: handler')]
+        ms = 1000.0
+        items = sorted(self.stats.items(),key=lambda item: -item[1].total)
+        for (tag,fn),stat in items:
+            samples = sorted(stat.samples)
+            name = self.handlerName(fn,stat.moduleName)
+            n = self.divisors.get(fn)
+            if n:
+                name = '%s (every %s idle ticks)' % (name,n)
+            result.append('%7s %10.1f %8.3f %8.3f %8.3f %8.3f  %s: %s' % (
+                stat.count,ms*stat.total,ms*stat.total/stat.count,
+                ms*self.percentile(samples,0.5),
+                ms*self.percentile(samples,0.95),
+                ms*stat.max,tag,name))
+        return result
+    #@-others
 #@+node:ekr.20100908125007.6007: ** class LeoPluginsController
 class LeoPluginsController:
 
@@ -277,6 +388,8 @@ class LeoPluginsController:
         # g.trace('LeoPluginsController',g.callers())
 
         self.handlers = {}
+        self.hookProfiler = None
+            # A HookProfiler, or None if hooks are not being profiled.
         self.loadedModulesFilesDict = {}
             # Keys are regularized module names, values are the names of .leo files
             # containing @enabled-plugins nodes that caused the plugin to be loaded
@@ -351,10 +464,18 @@ class LeoPluginsController:
                 if not c.exists or not hasattr(c,'frame'):
                     # g.pr('skipping tag %s: c does not exist or does not have a frame.' % tag)
                     return None
+        profiler = self.hookProfiler
+        if profiler and tag == 'idle' and not profiler.isDue(bunch):
+            return None
         # Calls to registerHandler from inside the handler belong to moduleName.
         self.loadingModuleNameStack.append(moduleName)
         try:
-            result = handler(tag,keywords)
+            if profiler:
+                t1 = profiler.clock()
+                result = handler(tag,keywords)
+                profiler.record(tag,bunch,profiler.clock()-t1)
+            else:
+                result = handler(tag,keywords)
         except Exception:
             g.es("hook failed: %s, %s, %s" % (tag, handler, moduleName))
             g.es_exception()
@@ -370,8 +491,46 @@ class LeoPluginsController:
         if trace and tag != 'idle':
             g.trace(tag)
         if tag in ('start1','open0'):
+            if tag == 'start1':
+                # Settings have been read.
+                self.initHookProfiler()
             self.loadHandlers(tag,keywords)
         return self.doHandlersForTag(tag,keywords)
+    #@+node:agent.20261018213024.1: *3* Hook profiling
+    #@+node:agent.20261018213024.2: *4* initHookProfiler
+    def initHookProfiler (self):
+        '''Create self.hookProfiler if any setting or option requires it.'''
+        budget = g.app.config.getInt('idle-hook-budget-ms') or 0
+        if (g.app.trace_hooks or budget > 0 or
+            g.app.config.getBool('profile-hooks',default=False)
+        ):
+            self.hookProfiler = HookProfiler(budget=budget/1000.0)
+    #@+node:agent.20261018213024.3: *4* printHookStats
+    def printHookStats (self,c=None):
+        '''
+        Print the statistics gathered by the hook profiler
+        to the Plugins tab, or to the console if c is None.
+        '''
+        profiler = self.hookProfiler
+        if profiler:
+            lines = ['hook statistics (times in msec)...'] + profiler.report()
+        else:
+            lines = ['hook profiling is disabled']
+        if c:
+            tabName = 'Plugins'
+            c.frame.log.selectTab(tabName)
+            g.es('',''.join(['%s\n' % (s) for s in lines]),tabName=tabName)
+        else:
+            print('\n'.join(lines))
+    #@+node:agent.20261018213024.4: *4* toggleHookProfiler
+    def toggleHookProfiler (self):
+        '''Start or stop profiling hooks. Return True if profiling is now enabled.'''
+        if self.hookProfiler:
+            self.hookProfiler = None
+        else:
+            budget = g.app.config.getInt('idle-hook-budget-ms') or 0
+            self.hookProfiler = HookProfiler(budget=budget/1000.0)
+        return bool(self.hookProfiler)
     #@+node:ekr.20100909065501.5950: *3* Information
     #@+node:ekr.20100908125007.6019: *4* getHandlersForTag
     def getHandlersForTag(self,tags):
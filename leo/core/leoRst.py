@@ -178,6 +178,7 @@ class RstCommands:
         self.rst_nodes = [] # The list of positions for all @rst nodes.
         self.outputFile = None # The open file being written.
         self.path = '' # The path from any @path directive.
+        self.sectionIndex = None # A g.SectionIndex for the tree being written.
         self.source = None # The written source as a string.
         self.trialWrite = False # True if doing a trialWrite.
         #@-<< init ivars >>
@@ -868,12 +869,10 @@ class RstCommands:
     #@+node:ekr.20110610144305.6751: *7* findSectionDef
     def findSectionDef (self,name,p):
 
-        for p2 in p.subtree():
-            name2 = self.isSectionDef(p2)
-            if name2:
-                return p2
+        '''Return the descendant of p defining the section name, or None.'''
 
-        return None
+        index = self.sectionIndex or g.SectionIndex(p)
+        return index.find('<'+'<' + name + '>'+'>',p)
     #@+node:ekr.20090502071837.72: *7* handleCodeMode & helper
     def handleCodeMode (self,lines):
 
@@ -1121,6 +1120,9 @@ class RstCommands:
                 self.write(self.rstComment(
                     'rst3: filename: %s\n\n' % fn))
 
+        # Section references in p's tree are expanded using this index.
+        self.sectionIndex = g.SectionIndex(p)
+
         # We can't use an iterator because we may skip parts of the tree.
         p = p.copy() # Only one copy is needed for traversal.
         after = p.nodeAfterTree()
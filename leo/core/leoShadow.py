@@ -35,6 +35,7 @@ Settings:
 #@+node:ekr.20080708094444.52: ** << imports >> (leoShadow)
 import leo.core.leoGlobals as g
 
+import bisect
 import difflib
 import os
 import pprint
@@ -65,6 +66,8 @@ class ShadowController:
         self.shadow_subdir = c.config.getString('shadow_subdir') or '.leo_shadow'
         self.shadow_prefix = c.config.getString('shadow_prefix') or ''
         self.shadow_in_home_dir = c.config.getBool('shadow_in_home_dir',default=False)
+        self.shadow_diff_engine = c.config.getString('shadow_diff_engine') or 'patience'
+            # 'patience': use x.PatienceDiff. 'difflib': use difflib.SequenceMatcher.
 
         # Munch shadow_subdir
         self.shadow_subdir = g.os_path_normpath(self.shadow_subdir)
@@ -375,7 +378,10 @@ class ShadowController:
         #@-<< define print_tags >>
 
         delim1,delim2 = marker.getDelims()
-        sm = difflib.SequenceMatcher(None,old_public_lines,new_public_lines)
+        if self.shadow_diff_engine == 'difflib':
+            sm = difflib.SequenceMatcher(None,old_public_lines,new_public_lines)
+        else:
+            sm = self.PatienceDiff(old_public_lines,new_public_lines)
         prev_old_j = 0 ; prev_new_j = 0
 
         for tag,old_i,old_j,new_i,new_j in sm.get_opcodes():
@@ -984,6 +990,212 @@ class ShadowController:
             return self.isSentinel(s,suffix='verbatim')
         #@-others
 
+    #@+node:agent.20261018210614.1: *3* class PatienceDiff
+    class PatienceDiff:
+
+        '''
+        A replacement for difflib.SequenceMatcher(None,a,b) that uses
+        linear space and works on integer line ids.
+
+        Lines that appear exactly once in both ranges anchor the match
+        (patience diff). Ranges without such lines are split by Myers'
+        middle-snake bisection.
+        '''
+
+        #@+others
+        #@+node:agent.20261018210614.2: *4* PatienceDiff.ctor
+        def __init__ (self,a,b):
+
+            d = {} # Keys are lines, values are line ids.
+            self.a = [d.setdefault(z,len(d)) for z in a]
+            self.b = [d.setdefault(z,len(d)) for z in b]
+        #@+node:agent.20261018210614.3: *4* PatienceDiff.get_matching_blocks
+        def get_matching_blocks (self):
+
+            '''Return a list of triples (i,j,n) as difflib does.'''
+
+            a,b = self.a,self.b
+            blocks = []
+            # Entries are (alo,ahi,blo,bhi) for ranges to match,
+            # or (i,j,n) for matched lines, in reverse order.
+            todo = [(0,len(a),0,len(b))]
+            while todo:
+                item = todo.pop()
+                if len(item) == 3:
+                    i,j,n = item
+                    if blocks and blocks[-1][0]+blocks[-1][2] == i and blocks[-1][1]+blocks[-1][2] == j:
+                        i0,j0,n0 = blocks.pop()
+                        blocks.append((i0,j0,n0+n),)
+                    else:
+                        blocks.append(item)
+                else:
+                    todo.extend(reversed(self.match(*item)))
+            blocks.append((len(a),len(b),0),)
+            return blocks
+        #@+node:agent.20261018210614.4: *4* PatienceDiff.get_opcodes
+        def get_opcodes (self):
+
+            '''Return a list of 5-tuples describing how to turn a into b, as difflib does.'''
+
+            i = j = 0
+            result = []
+            for ai,bj,n in self.get_matching_blocks():
+                if i < ai and j < bj: tag = 'replace'
+                elif i < ai:          tag = 'delete'
+                elif j < bj:          tag = 'insert'
+                else:                 tag = None
+                if tag:
+                    result.append((tag,i,ai,j,bj),)
+                i,j = ai+n,bj+n
+                if n:
+                    result.append(('equal',ai,i,bj,j),)
+            return result
+        #@+node:agent.20261018210614.5: *4* PatienceDiff.match & helpers
+        def match (self,alo,ahi,blo,bhi):
+
+            '''
+            Return a list of the matches (i,j,n) and the smaller ranges
+            (alo,ahi,blo,bhi) that together cover a[alo:ahi] and b[blo:bhi].
+            '''
+
+            a,b = self.a,self.b
+            # Match the common prefix and suffix.
+            i,j = alo,blo
+            while i < ahi and j < bhi and a[i] == b[j]:
+                i += 1 ; j += 1
+            head = [(alo,blo,i-alo)] if i > alo else []
+            alo,blo = i,j
+            i,j = ahi,bhi
+            while i > alo and j > blo and a[i-1] == b[j-1]:
+                i -= 1 ; j -= 1
+            tail = [(i,j,ahi-i)] if i < ahi else []
+            ahi,bhi = i,j
+            if alo == ahi or blo == bhi:
+                return head + tail
+            anchors = self.find_anchors(alo,ahi,blo,bhi)
+            if anchors:
+                middle = []
+                for i,j in anchors:
+                    middle.append((alo,i,blo,j),)
+                    middle.append((i,j,1),)
+                    alo,blo = i+1,j+1
+                middle.append((alo,ahi,blo,bhi),)
+            else:
+                split = self.bisect(alo,ahi,blo,bhi)
+                if split:
+                    i,j = split
+                    middle = [(alo,i,blo,j),(i,ahi,j,bhi)]
+                else:
+                    middle = [] # Nothing matches.
+            return head + middle + tail
+        #@+node:agent.20261018210614.6: *5* PatienceDiff.find_anchors
+        def find_anchors (self,alo,ahi,blo,bhi):
+
+            '''
+            Return the longest increasing sequence of pairs (i,j) such that
+            a[i] == b[j] and the line appears just once in each range.
+            '''
+
+            a,b = self.a,self.b
+            counts = {} # Keys are line ids, values are [count in a,index in a,count in b,index in b]
+            for i in range(alo,ahi):
+                aList = counts.get(a[i])
+                if aList: aList[0] += 1
+                else: counts[a[i]] = [1,i,0,0]
+            for j in range(blo,bhi):
+                aList = counts.get(b[j])
+                if aList:
+                    aList[2] += 1 ; aList[3] = j
+            pairs = sorted([(aList[1],aList[3]) for aList in counts.values()
+                if aList[0] == 1 and aList[2] == 1])
+            # Patience sorting: find the longest increasing run of j's.
+            tops,backs = [],[]
+            for n,(i,j) in enumerate(pairs):
+                k = bisect.bisect_left(tops,j)
+                if k == len(tops):
+                    tops.append(j)
+                else:
+                    tops[k] = j
+                backs.append((k,n),)
+            result,k = [],len(tops)-1
+            for k2,n in reversed(backs):
+                if k2 == k:
+                    result.append(pairs[n])
+                    k -= 1
+            result.reverse()
+            return result
+        #@+node:agent.20261018210614.7: *5* PatienceDiff.bisect
+        def bisect (self,alo,ahi,blo,bhi):
+
+            '''
+            Return the point (i,j) in the middle of a shortest edit script
+            for the ranges, using Myers' linear-space algorithm, or None if
+            the ranges have nothing in common.
+            '''
+
+            a,b = self.a,self.b
+            n,m = ahi-alo,bhi-blo
+            max_d = (n+m+1) // 2
+            offset = max_d
+            v1 = [-1] * (2*max_d+2)
+            v1[offset+1] = 0
+            v2 = v1[:]
+            delta = n-m
+            front = delta % 2 != 0
+            k1start = k1end = k2start = k2end = 0
+            for d in range(max_d):
+                # Walk the forward path one step.
+                for k1 in range(-d+k1start,d+1-k1end,2):
+                    k = offset+k1
+                    if k1 == -d or (k1 != d and v1[k-1] < v1[k+1]):
+                        x1 = v1[k+1]
+                    else:
+                        x1 = v1[k-1]+1
+                    y1 = x1-k1
+                    while x1 < n and y1 < m and a[alo+x1] == b[blo+y1]:
+                        x1 += 1 ; y1 += 1
+                    v1[k] = x1
+                    if x1 > n:
+                        k1end += 2
+                    elif y1 > m:
+                        k1start += 2
+                    elif front:
+                        k2 = offset+delta-k1
+                        if 0 <= k2 < len(v2) and v2[k2] != -1 and x1 >= n-v2[k2]:
+                            return self.split(alo,ahi,blo,bhi,x1,y1)
+                # Walk the reverse path one step.
+                for k2 in range(-d+k2start,d+1-k2end,2):
+                    k = offset+k2
+                    if k2 == -d or (k2 != d and v2[k-1] < v2[k+1]):
+                        x2 = v2[k+1]
+                    else:
+                        x2 = v2[k-1]+1
+                    y2 = x2-k2
+                    while x2 < n and y2 < m and a[ahi-x2-1] == b[bhi-y2-1]:
+                        x2 += 1 ; y2 += 1
+                    v2[k] = x2
+                    if x2 > n:
+                        k2end += 2
+                    elif y2 > m:
+                        k2start += 2
+                    elif not front:
+                        k1 = offset+delta-k2
+                        if 0 <= k1 < len(v1) and v1[k1] != -1:
+                            x1 = v1[k1]
+                            y1 = offset+x1-k1
+                            if x1 >= n-x2:
+                                return self.split(alo,ahi,blo,bhi,x1,y1)
+            return None
+
+        def split (self,alo,ahi,blo,bhi,x,y):
+
+            '''Return the split point, or None if it would not shrink the ranges.'''
+
+            if (x,y) in ((0,0),(ahi-alo,bhi-blo)):
+                return None
+            return alo+x,blo+y
+        #@-others
+
     #@+node:ekr.20080708094444.12: *3* class Sourcereader
     class Sourcereader:
         """
@@ -50,6 +50,11 @@
 #@-<< How Leo implements unlimited undo >>
 
 import leo.core.leoGlobals as g
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import tempfile
 
 # pylint: disable=unpacking-non-sequence
 
@@ -72,6 +77,10 @@ class Undoer:
         # g.trace('Undoer',self.granularity)
 
         self.max_undo_stack_size = c.config.getInt('max_undo_stack_size') or 0
+        # The number of bytes of undo text to keep in memory. 0: no limit.
+        self.max_undo_memory = 1024 * 1024 * (c.config.getInt('max-undo-memory') or 0)
+        self.memory = 0 # An estimate of the undo text in memory.
+        self.spillFile = None # A SpillFile holding the text of old beads.
 
         # Statistics comparing old and new ways (only if self.debug_Undoer is on).
         self.new_mem = 0
@@ -98,6 +107,7 @@ class Undoer:
         # Set the following ivars to keep pylint happy.
         self.afterTree = None
         self.beforeTree = None
+        self.bodyDelta = None
         self.children = None
         self.deleteMarkedNodesData = None
         self.dirtyVnodeList = None
@@ -134,6 +144,7 @@ class Undoer:
         self.pasteAsClone = None
         self.prevSel = None
         self.sortChildren = None
+        self.spilledText = None
         self.verboseUndoGroup = None
 
     def redoHelper(self):
@@ -151,6 +162,137 @@ class Undoer:
 
         for ivar in u.optionalIvars:
             setattr(u,ivar,None)
+    #@+node:agent.20261018204207.1: *4* computeLineDelta & applyLineDelta
+    def computeLineDelta (self,oldText,newText):
+        '''
+        Return (leading,trailing,oldMiddleLines,newMiddleLines), describing
+        the lines that differ between oldText and newText.
+        applyLineDelta uses this tuple to recreate either text from the other.
+        '''
+        old_lines = oldText.split('\n')
+        new_lines = newText.split('\n')
+        old_len,new_len = len(old_lines),len(new_lines)
+        min_len = min(old_len,new_len)
+        leading = 0
+        while leading < min_len and old_lines[leading] == new_lines[leading]:
+            leading += 1
+        trailing = 0
+        while (trailing < min_len - leading and
+            old_lines[old_len-trailing-1] == new_lines[new_len-trailing-1]
+        ):
+            trailing += 1
+        return (leading,trailing,
+            old_lines[leading:old_len-trailing],
+            new_lines[leading:new_len-trailing])
+
+    def applyLineDelta (self,s,delta,undo=True):
+        '''
+        Return the old text (undo) or the new text (redo) described by the
+        delta returned by computeLineDelta. s is the new or old text.
+
+        Return None if s does not contain the expected middle lines, that
+        is, if s was changed without the undoer knowing.
+        '''
+        leading,trailing,oldMiddleLines,newMiddleLines = delta
+        lines = s.split('\n')
+        if undo:
+            expected,middle = newMiddleLines,oldMiddleLines
+        else:
+            expected,middle = oldMiddleLines,newMiddleLines
+        n = len(lines)
+        if n < leading + trailing or lines[leading:n-trailing] != expected:
+            return None
+        return '\n'.join(lines[:leading] + middle + lines[n-trailing:])
+    #@+node:agent.20261018204207.2: *4* checkMemory & helpers
+    # The text fields of beads that spillBead writes to the spill file.
+    spillKeys = (
+        'bodyDelta',
+        'newBody','oldBody',
+        'newMiddleLines','oldMiddleLines',
+        'newText','oldText',
+    )
+
+    def checkMemory (self):
+        '''
+        Write the text of the oldest beads to a temporary file if the beads
+        use more memory than allowed by the max-undo-memory setting.
+        setIvarsFromBunch reloads the text when needed.
+        '''
+        u = self
+        if u.max_undo_memory <= 0 or u.memory <= u.max_undo_memory:
+            return
+        # Beads may have been discarded or reloaded since the last check.
+        sizes = [u.beadSize(bunch) for bunch in u.beads]
+        u.memory = sum(sizes)
+        # Leave room for new beads so spilling happens rarely.
+        # Never spill the present bead: typing may still change it.
+        n = 0
+        while u.memory > u.max_undo_memory // 2 and n < u.bead:
+            bunch = u.beads[n]
+            if sizes[n] and bunch.get('kind') != 'beforeGroup':
+                if not u.spillBead(bunch):
+                    break
+                u.memory -= sizes[n]
+            n += 1
+    #@+node:agent.20261018204207.3: *5* beadSize & textSize
+    def beadSize (self,bunch):
+        '''Return the number of characters in the text fields of a bead.'''
+        u = self
+        n = 0
+        for key in u.spillKeys:
+            val = bunch.get(key)
+            if val:
+                n += u.textSize(val)
+        for z in bunch.get('items') or []:
+            n += u.beadSize(z)
+        return n
+
+    def textSize (self,val):
+        '''Return the number of characters in val, a string or a list or tuple.'''
+        if g.isString(val):
+            return len(val)
+        elif isinstance(val,(list,tuple)):
+            return sum([self.textSize(z) for z in val])
+        else:
+            return 0
+    #@+node:agent.20261018204207.4: *5* spillBead & unspillBead
+    def spillBead (self,bunch):
+        '''Move the text fields of a bead to the spill file. Return True if all went well.'''
+        u = self
+        for z in bunch.get('items') or []:
+            if not u.spillBead(z):
+                return False
+        d = {}
+        for key in u.spillKeys:
+            val = bunch.get(key)
+            if val:
+                d[key] = val
+        if d:
+            try:
+                if not u.spillFile:
+                    u.spillFile = SpillFile()
+                bunch.spilledText = u.spillFile.save(d)
+            except Exception:
+                g.es_print('can not write undo data to a temporary file')
+                g.es_exception()
+                u.max_undo_memory = 0 # Don't try again.
+                return False
+            for key in d:
+                bunch[key] = None
+        return True
+
+    def unspillBead (self,bunch):
+        '''Reload the text fields of a bead written by spillBead.'''
+        u = self
+        for z in bunch.get('items') or []:
+            u.unspillBead(z)
+        ref = bunch.get('spilledText')
+        if ref and u.spillFile:
+            d = u.spillFile.load(ref)
+            for key in d:
+                bunch[key] = d.get(key)
+            bunch.spilledText = None
+            u.memory += u.beadSize(bunch)
     #@+node:ekr.20060127052111.1: *4* cutStack
     def cutStack (self):
 
@@ -238,6 +380,8 @@ class Undoer:
 
             # Recalculate the menu labels.
             u.setUndoTypes()
+        u.memory += u.beadSize(bunch)
+        u.checkMemory()
     #@+node:ekr.20050126081529: *4* recognizeStartOfTypingWord
     def recognizeStartOfTypingWord (self,
         old_lines,old_row,old_col,old_ch, 
@@ -285,6 +429,7 @@ class Undoer:
         u = self
 
         u.clearOptionalIvars()
+        u.unspillBead(bunch)
 
         if 0: # Debugging.
             g.pr('-' * 40)
@@ -566,13 +711,15 @@ class Undoer:
         bunch.redoHelper = u.redoNodeContents
         bunch.dirtyVnodeList = dirtyVnodeList
         bunch.inHead = inHead # 2013/08/26
-        bunch.newBody = p.b
         bunch.newChanged = u.c.isChanged()
         bunch.newDirty = p.isDirty()
         bunch.newHead = p.h
         bunch.newMarked = p.isMarked()
         bunch.newSel = w.getSelectionRange()
         bunch.newYScroll = w.getYScrollPosition()
+        # Save only the lines that differ, not the old and new body text.
+        bunch.bodyDelta = u.computeLineDelta(bunch.oldBody,p.b)
+        bunch.oldBody = None
         u.pushBead(bunch)
     #@+node:ekr.20050315134017.3: *5* afterChangeTree
     def afterChangeTree (self,p,command,bunch):
@@ -584,9 +731,8 @@ class Undoer:
         bunch.undoType = command
         bunch.undoHelper = u.undoTree
         bunch.redoHelper = u.redoTree
-        # Set by beforeChangeTree: changed, oldSel, oldText, oldTree, p
+        # Set by beforeChangeTree: changed, oldSel, oldTree, p
         bunch.newSel = w.getSelectionRange()
-        bunch.newText = w.getAllText()
         bunch.newTree = u.saveTree(p)
         u.pushBead(bunch)
     #@+node:ekr.20050424161505: *5* afterClearRecentFiles
@@ -938,7 +1084,6 @@ class Undoer:
         w = c.frame.body.wrapper
         bunch = u.createCommonBunch(p)
         bunch.oldSel = w.getSelectionRange()
-        bunch.oldText = w.getAllText()
         bunch.oldTree = u.saveTree(p)
         return bunch
     #@+node:ekr.20050424161505.1: *5* beforeClearRecentFiles
@@ -1072,6 +1217,10 @@ class Undoer:
         u.setUndoType("Can't Undo")
         u.beads = [] # List of undo nodes.
         u.bead = -1 # Index of the present bead: -1:len(beads)
+        u.memory = 0
+        if u.spillFile:
+            u.spillFile.close()
+            u.spillFile = None
 
     #@+node:ekr.20031218072017.3611: *4* enableMenuItems
     def enableMenuItems (self):
@@ -1669,8 +1818,16 @@ class Undoer:
 
         u = self ; c = u.c ; w = c.frame.body.wrapper
         # Restore the body.
-        u.p.setBodyString(u.newBody)
-        w.setAllText(u.newBody)
+        if u.bodyDelta:
+            newBody = u.applyLineDelta(u.p.b,u.bodyDelta,undo=False)
+            if newBody is None:
+                g.error('can not redo %s: the body of %s has changed' % (
+                    u.undoType,u.p.h))
+                return
+        else:
+            newBody = u.newBody
+        u.p.setBodyString(newBody)
+        w.setAllText(newBody)
         c.frame.body.recolor(u.p,incremental=False)
         # Restore the headline.
         u.p.initHeadString(u.newHead)
@@ -2043,8 +2200,16 @@ class Undoer:
         trace = False and not g.unitTesting
         u = self ; c = u.c
         w = c.frame.body.wrapper
-        u.p.b = u.oldBody
-        w.setAllText(u.oldBody)
+        if u.bodyDelta:
+            oldBody = u.applyLineDelta(u.p.b,u.bodyDelta,undo=True)
+            if oldBody is None:
+                g.error('can not undo %s: the body of %s has changed' % (
+                    u.undoType,u.p.h))
+                return
+        else:
+            oldBody = u.oldBody
+        u.p.b = oldBody
+        w.setAllText(oldBody)
         c.frame.body.recolor(u.p,incremental=False)
         if trace: g.trace(repr(u.oldHead))
         u.p.h = u.oldHead
@@ -2219,5 +2384,33 @@ class Undoer:
             c.bodyWantsFocus()
             w.setYScrollPosition(u.yview)
     #@-others
+#@+node:agent.20261018204207.5: ** class SpillFile
+class SpillFile:
+    '''A temporary file holding the text of old undo beads.'''
+    #@+others
+    #@+node:agent.20261018204207.6: *3* spill.ctor & close
+    def __init__ (self):
+        '''Ctor for SpillFile class.'''
+        self.f = tempfile.TemporaryFile()
+            # The file is deleted when closed.
+
+    def close (self):
+        '''Close and delete the file.'''
+        self.f.close()
+    #@+node:agent.20261018204207.7: *3* spill.load & save
+    def load (self,ref):
+        '''Return the data for ref, an (offset,length) tuple returned by save.'''
+        offset,length = ref
+        self.f.seek(offset)
+        return pickle.loads(self.f.read(length))
+
+    def save (self,data):
+        '''Append data to the file. Return its (offset,length).'''
+        s = pickle.dumps(data,pickle.HIGHEST_PROTOCOL)
+        self.f.seek(0,2)
+        offset = self.f.tell()
+        self.f.write(s)
+        return offset,len(s)
+    #@-others
 #@-others
 #@-leo
@@ -104,5 +104,8 @@ while todo:
             print (" FILE: %s"%real_name)
     
         c = fn2c.setdefault(real_name, controller.openLeoFile(fn))
-        fts.drop_document(real_name)
+        # only changed nodes are re-indexed
         fts.index_nodes(c)
+
+# write the index
+fts.close()
@@ -9,7 +9,8 @@ Use the global-search command to show this window.
 
 To restore the original appearance of the window, type help.
 
-Requires the whoosh library ('easy_install whoosh') to do full text searches.
+Full text searches use Leo's built-in index, leo.core.leoFts.
+The index is updated as you type and save indexed outlines.
 '''
 # By VMV.
 # Stand-alone version by EKR.
@@ -26,6 +27,7 @@ Requires the whoosh library ('easy_install whoosh') to do full text searches.
 # 
 # EKR:
 # - This plugin does not use leofts.
+# - Full text searches use leo.core.leoFts instead of whoosh.
 # - g.app.__global_search contains the singleton GlobalSearch instance.
 # - g has only one meaning: leo.core.leoGlobals. the set_leo hack is gone.
 # - The per-commander value of @int fts_max_hits is used.
@@ -36,19 +38,9 @@ Requires the whoosh library ('easy_install whoosh') to do full text searches.
 #@+<< imports >>
 #@+node:ekr.20140920041848.17949: ** << imports >> (bigdash.py)
 import leo.core.leoGlobals as g
+import leo.core.leoFts as leoFts
 from leo.core.leoQt import QtCore,QtGui,QtWidgets,QtWebKitWidgets
 # This code no longer uses leo.plugins.leofts.
-try:
-    # pylint: disable=no-name-in-module
-    # index,fields,qparser,analysis *are* defined.
-    import whoosh
-    from whoosh.index import create_in, open_dir
-    from whoosh.fields import TEXT,ID,Schema
-    from whoosh.qparser import MultifieldParser
-    from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter
-except ImportError:
-    whoosh = None
-import os
 import sys
 #@-<< imports >>
 #@+others
@@ -135,27 +127,18 @@ class BigDash:
     #@+node:ekr.20140919160020.17914: *3* show_help
     def show_help(self):
         '''Show the contents of the help panel.'''
-        if whoosh:
-            s = """
+        s = """
     <h12>Dashboard</h2>
     <table cellspacing="10">
     <tr><td> <b>s</b> foobar</td><td>   <i>Simple string search for "foobar" in all open documents</i></td></tr>
     <tr><td> <b>fts init</b></td><td>   <i>Initialize full text search  (create index) for all open documents</i></td></tr>
     <tr><td> <b>fts add</b></td><td>    <i>Add currently open, still unindexed leo files to index</i></td></tr>                    
     <tr><td> <b>f</b> foo bar</td><td>   <i>Do full text search for node with terms 'foo' AND 'bar'</i></td></tr>
-    <tr><td> <b>f</b> h:foo b:bar wild?ards*</td><td>   <i>Search for foo in heading and bar in body, test wildcards</i></td></tr>
+    <tr><td> <b>f</b> foo wild*</td><td>   <i>Search for foo and any word starting with wild</i></td></tr>
     <tr><td> <b>help</b></td><td>       <i>Show this help</i></td></tr>
     <tr><td> <b>stats</b></td><td>      <i>List indexed files</i></td></tr>
     <tr><td> <b>fts refresh</b></td><td><i>re-index files</i></td></tr>
     </table>
-    """
-        else:
-            s = """
-    <h12>Dashboard (whoosh disabled)</h2>
-    <table cellspacing="10">
-    <tr><td> <b>s</b> foobar</td><td>   <i>Simple string search for "foobar" in all open documents</i></td></tr>
-    <tr><td> <b>help</b></td><td>       <i>Show this help</i></td></tr>
-    </table>
     """
         self.web.setHtml(s)
 
@@ -169,16 +152,16 @@ class GlobalSearch:
         self.fts_max_hits = g.app.config.getInt('fts_max_hits') or 30
             # A default: will be overridden by the global-search command.
         self.bd = BigDash()
-        self.gnxcache = GnxCache()
         #self.bd.show()
         self.bd.add_cmd_handler(self.do_search)
-        if whoosh:
-            self.fts = LeoFts(self.gnxcache,g.app.homeLeoDir + "/fts_index")
-            self.bd.add_cmd_handler(self.do_fts)
-            self.bd.add_cmd_handler(self.do_stats)
-        else:
-            self.fts = None
+        self.fts = LeoFts()
+        self.bd.add_cmd_handler(self.do_fts)
+        self.bd.add_cmd_handler(self.do_stats)
         self.anchors = {}        
+        # Keep the index of indexed outlines up to date.
+        g.registerHandler(('bodykey2','headkey2'),self.onChanged)
+        g.registerHandler(('open2','save2'),self.onOpenOrSave)
+        g.registerHandler('end1',self.onEnd)
     #@+node:ekr.20140919160020.17922: *3* add_anchor
     def add_anchor(self,l,tgt, text):
 
@@ -219,8 +202,8 @@ class GlobalSearch:
                     hits.append("<b> (moved to top)</b>")
                 hits.append("</div>")       
             hits.append("</p>")
-        outline_order = outlines.keys()
-        outline_order.sort(key=lambda x:'' if x==target_outline else x)
+        outline_order = sorted(outlines.keys(),
+            key=lambda x:'' if x==target_outline else x)
         for outline in outline_order:
             hits.append("<div id='%s'><p><b>%s</b></p>"%(outline, outline))
             res = outlines[outline]
@@ -230,8 +213,8 @@ class GlobalSearch:
                 hits.append("<div>")
                 self.add_anchor(hits, r["gnx"], r["h"])
                 hits.append("</div>")
-                # always show opener link because r['f'] is True when
-                # outline was open but isn't any more (GnxCache stale)
+                # always show opener link: the hit may be in an outline
+                # that is not open.
                 if False and r['f']:
                     opener = ""
                 else:
@@ -255,9 +238,6 @@ class GlobalSearch:
             q = ss[2:]
         if not (q or ss.startswith("fts ")):
             return False
-        if not whoosh:
-            g.es("Whoosh not installed (easy_install whoosh)")
-            return False
         # print("Doing fts: %s" % qs)
         fts = self.fts
         if ss.strip() == "fts init":
@@ -265,6 +245,7 @@ class GlobalSearch:
             for c2 in g.app.commanders():
                 g.es_print("Scanning: %s" % c2.shortFileName())
                 fts.index_nodes(c2)
+            fts.commit()
             g.es_print('Scan complete')
         if ss.strip() == "fts add":
             # print("Add new docs")
@@ -275,17 +256,14 @@ class GlobalSearch:
                 if fn not in docs:
                     g.es_print("Adding document to index: %s" % c2.shortFileName())
                     fts.index_nodes(c2)
+            fts.commit()
             g.es_print('Add complete')
         if ss.strip() == "fts refresh":
             for c2 in g.app.commanders():
-                fn = c2.mFileName
                 g.es_print("Refreshing: %s" % c2.shortFileName())
-                fts.drop_document(fn)
                 fts.index_nodes(c2)
+            fts.commit()
             g.es_print('Refresh complete')
-            gc = self.gnxcache         
-            gc.clear()
-            gc.update_new_cs()
         if q:
             self.do_find(tgt, q)
     #@+node:ekr.20140919160020.17904: *3* do_link
@@ -306,11 +284,8 @@ class GlobalSearch:
             l = l[4:]
             self.open_unl(l)
             return
-        gc = self.gnxcache
-        gc.update_new_cs()
-        hit = gc.get_p(l)
-        if hit:
-            c,p = hit
+        c,p = self.fts.index.resolve(l)
+        if c:
             # print("found!")
             c.selectPosition(p)
             c.bringToFront()
@@ -367,6 +342,23 @@ class GlobalSearch:
             
             res.append((li, (m.start()-st, m.end()-st ), (spre, spost)))
         return res
+    #@+node:agent.20261018213648.1: *3* onChanged, onOpenOrSave & onEnd
+    def onChanged(self,tag,keywords):
+        '''Re-index changed nodes in indexed outlines before the next search.'''
+        c,p = keywords.get('c'),keywords.get('p')
+        if c and p:
+            self.fts.index.markChanged(c,p)
+
+    def onOpenOrSave(self,tag,keywords):
+        '''Re-index the changed nodes of an indexed outline.'''
+        c = keywords.get('c')
+        index = self.fts.index
+        if c and index.hasDocument(c.mFileName):
+            index.indexCommander(c)
+
+    def onEnd(self,tag,keywords):
+        '''Write the index when Leo exits.'''
+        self.fts.close()
     #@+node:ekr.20140919160020.17919: *3* open_unl
     def open_unl(self,unl):
 
@@ -384,139 +376,49 @@ class GlobalSearch:
 class LeoConnector(QtCore.QObject):
     pass
 #@+node:ekr.20140920041848.17939: ** class LeoFts
-class LeoFts:    
+class LeoFts:
+    '''An adapter between GlobalSearch and Leo's full-text index.'''
     #@+others
     #@+node:ekr.20140920041848.17940: *3* __init__
-    def __init__(self,gnxcache,idx_dir):
+    def __init__(self):
         '''Ctor for LeoFts class (bigdash.py)'''
-        self.gnxcache = gnxcache
-        self.idx_dir = idx_dir
-        if not os.path.exists(idx_dir):
-            os.mkdir(idx_dir)
-            self.create()
-        else:
-            self.ix = open_dir(idx_dir)
-    #@+node:ekr.20140920041848.17941: *3* schema
-    def schema(self):
-
-        my_analyzer = RegexTokenizer("[a-zA-Z_]+") | LowercaseFilter() | StopFilter()
-        schema = Schema(
-            h=TEXT(stored=True,
-            analyzer=my_analyzer),
-            gnx=ID(stored=True),
-            b=TEXT(analyzer=my_analyzer),
-            parent=ID(stored=True),
-            doc=ID(stored=True))
-        return schema
+        self.index = leoFts.getIndex()
     #@+node:ekr.20140920041848.17942: *3* create
     def create(self):
-        
-        schema = self.schema()
-        self.ix = ix = create_in(self.idx_dir, schema)
+        '''Remove all documents from the index.'''
+        self.index.clear()
+    #@+node:agent.20261018213630.1: *3* commit
+    def commit(self):
+        '''Write the index to disk.'''
+        self.index.flush()
     #@+node:ekr.20140920041848.17943: *3* index_nodes
     def index_nodes(self,c):
-        writer = self.ix.writer()
-        doc = c.mFileName
-        for p in c.all_unique_positions():
-            #print "pushing",p
-            if p.hasParent():
-                par = p.parent().get_UNL()
-            else:
-                par = c.mFileName
-            writer.add_document(h=p.h, b=p.b, gnx=unicode(p.gnx), parent=par, doc=doc)
-        writer.commit()
-        self.gnxcache.clear()
+        '''Add c's outline to the index, re-indexing only changed nodes.'''
+        self.index.indexCommander(c)
     #@+node:ekr.20140920041848.17944: *3* drop_document
     def drop_document(self, docfile):
-        writer = self.ix.writer()
         g.es_print("Drop index: %s" % g.shortFileName(docfile))
-        writer.delete_by_term("doc", docfile)
-        writer.commit()
+        self.index.dropDocument(docfile)
     #@+node:ekr.20140920041848.17945: *3* statistics
     def statistics(self):
         r = {}
-        with self.ix.searcher() as s:
-            r['documents'] = list(s.lexicon("doc"))
+        r['documents'] = self.index.documents()
         # print("stats: %s" % r)
         return r
     #@+node:ekr.20140920041848.17946: *3* search
     def search(self, searchstring, limit=30):        
-                
-        res = []
-        gnxcache = self.gnxcache
-        gnxcache.update_new_cs()
-        with self.ix.searcher() as searcher:
-            #print (list(searcher.lexicon("b")))
-            query = MultifieldParser(["h", "b"], schema=self.schema()).parse(searchstring)
-            results = searcher.search(query, limit=limit)
-            # print (results)
-            for r in results:
-                rr = r.fields()
-                gnx = rr["gnx"]
-                tup = gnxcache.get(gnx)
-                if tup:
-                    rr['f'] = True
-                    cont = tup[1].b
-                    hl = r.highlights("b", text = cont)
-                    rr["highlight"] = hl
-                else:
-                    rr['f'] = False
-                res.append(rr)
+
+        index = self.index
+        res = index.search(searchstring,limit)
+        for rr in res:
+            c,p = index.resolve(rr["gnx"],rr["doc"])
+            rr['f'] = bool(c)
+            if c:
+                rr["highlight"] = index.highlight(p.b,searchstring)
         return res
     #@+node:ekr.20140920041848.17947: *3* close
     def close(self):
-        self.ix.close()
-    #@-others
-#@+node:ekr.20140920041848.17933: ** class GnxCache
-class GnxCache:
-    """ map gnx => vnode """
-    #@+others
-    #@+node:ekr.20140920041848.17934: *3* __init__
-    def __init__(self):
-        '''Ctor for GnxCashe class (bigdash.py)'''
-        self.clear()
-    #@+node:ekr.20140919160020.17918: *3* all_positions_global
-    def all_positions_global(self):
-
-        for c in g.app.commanders():
-            for p in c.all_unique_positions():
-                yield (c,p)
-    #@+node:ekr.20140920041848.17938: *3* clear
-    def clear(self):
-
-        self.ps = {}
-        self.cs = set()
-    #@+node:ekr.20140920041848.17936: *3* get
-    def get(self,gnx):
-
-        if not self.ps:
-            self.update_new_cs()
-        res = self.ps.get(gnx,None)                               
-        return res
-    #@+node:ekr.20140920041848.17937: *3* get_p
-    def get_p(self,gnx):
-
-        r = self.get(gnx)
-        if r:
-            c,v = r
-            for p in c.all_unique_positions():
-                if p.v is v:
-                    return c,p.copy()
-        g.es_print("Not in gnx cache, slow!")
-        for c,p in self.all_positions_global():
-            if p.gnx == gnx:
-                return c,p.copy()
-        return None,None
-
-    #@+node:ekr.20140920041848.17935: *3* update_new_cs
-    def update_new_cs(self):
-
-        for c in g.app.commanders():
-            if c.hash() not in self.cs:
-                for p in c.all_unique_positions():
-                    k = p.gnx
-                    self.ps[k] = c, p.v
-                self.cs.add(c.hash())
+        self.index.close()
     #@-others
 #@-others
 
@@ -9,6 +9,8 @@ if g.isPython3:
 else:
     import StringIO
     StringIO = StringIO.StringIO
+import bisect
+import re
 import time
 
 class BaseScanner:
@@ -35,6 +37,14 @@ class BaseScanner:
         self.errors = 0
         ic.errors = 0
         self.errorLines = []
+        self.blockDict = {}
+            # Keys are (delim1,delim2), values are g.Bunch's describing blocks already scanned.
+        self.stringPattern = (
+            r'"(?:[^"\\]|\\[\s\S])*(?:"|\\?\Z)|' +
+            r"'(?:[^'\\]|\\[\s\S])*(?:'|\\?\Z)")
+            # A regex matching strings as g.skip_string does.
+        self.tokenPattern = None
+            # The compiled pattern used by tokenize, or False if tokenize must scan by hand.
         self.escapeSectionRefs = True
         self.extraIdChars = ''
         self.fileName = ic.fileName
@@ -216,6 +226,10 @@ class BaseScanner:
             lines2 = self.adjustTestLines(lines2)
             s1 = ''.join(lines1)
             s2 = ''.join(lines2)
+            if s1 == s2:
+                # Equal strings tokenize equally.
+                if trace_time: g.trace(g.timeSince(t1))
+                return True
         if trace and trace_code:
             g.trace('s1...\n%s' % s1)
             g.trace('s2...\n%s' % s2)
@@ -1196,7 +1210,7 @@ class BaseScanner:
             return start,False
         else:
             return i,True 
-    #@+node:ekr.20140727075002.18240: *4* BaseScanner.skipBlock
+    #@+node:ekr.20140727075002.18240: *4* BaseScanner.skipBlock & helper
     def skipBlock(self,s,i,delim1=None,delim2=None):
 
         '''Skip from the opening delim to *past* the matching closing delim.
@@ -1213,6 +1227,20 @@ class BaseScanner:
         level,start,startIndent = 0,i,self.startSigIndent
         if trace and verbose:
             g.trace('***','startIndent',startIndent)
+        # Don't rescan blocks seen while skipping an enclosing block.
+        errors,stack = self.errors,[]
+        d = self.blockDict.get((delim1,delim2))
+        if d and d.s is s and i in d.blocks:
+            end = self.skipKnownBlock(s,d,i,match2,delim2)
+            if end is not None:
+                return end
+            i = len(s) # There is no matching delim.
+        else:
+            if not d or d.s is not s:
+                d = g.Bunch(s=s,blocks={},
+                    pattern=self.getBlockPattern(delim1,delim2))
+                self.blockDict[delim1,delim2] = d
+            scan = g.Bunch(lines=[],indents=[],levels=[])
         while i < len(s):
             progress = i
             if g.is_nl(s,i):
@@ -1222,6 +1250,10 @@ class BaseScanner:
                     j, indent = g.skip_leading_ws_with_indent(s,i,self.tab_width)
                     line = g.get_line(s,j)
                     if trace and verbose: g.trace('indent',indent,line)
+                    if line.strip():
+                        scan.lines.append(j)
+                        scan.indents.append(indent)
+                        scan.levels.append(level)
                     if indent < startIndent and line.strip():
                         # An non-empty underindented line.
                         # Issue an error unless it contains just the closing bracket.
@@ -1230,7 +1262,9 @@ class BaseScanner:
                         else:
                             if j not in self.errorLines: # No error yet given.
                                 self.errorLines.append(j)
+                                n = self.errors
                                 self.underindentedLine(line)
+                                errors += self.errors - n
             elif s[i] in (' ','\t',):
                 i += 1 # speed up the scan.
             elif self.startsComment(s,i):
@@ -1238,6 +1272,7 @@ class BaseScanner:
             elif self.startsString(s,i):
                 i = self.skipString(s,i)
             elif match1(s,i,delim1):
+                stack.append((i,level))
                 level += 1 ; i += len(delim1)
             elif match2(s,i,delim2):
                 level -= 1 ; i += len(delim2)
@@ -1247,20 +1282,30 @@ class BaseScanner:
                     if g.match(s,i2,z):
                         i = i2 + len(z)
                         break
+                # 2010/09/20
+                # Skip a single-line comment if it exists.
+                end,j = i,self.skipWs(s,i)
+                if (g.match(s,j,self.lineCommentDelim) or
+                    g.match(s,j,self.lineCommentDelim2)
+                ):
+                    end = g.skip_to_end_of_line(s,i)
+                if stack:
+                    k,level2 = stack.pop()
+                    if errors == self.errors:
+                        d.blocks[k] = end,level2,scan
                 if level <= 0:
-                    # 2010/09/20
-                    # Skip a single-line comment if it exists.
-                    j = self.skipWs(s,i)
-                    if (g.match(s,j,self.lineCommentDelim) or
-                        g.match(s,j,self.lineCommentDelim2)
-                    ):
-                        i = g.skip_to_end_of_line(s,i)
-                    if trace: g.trace('returns:\n\n%s\n\n' % s[start:i])
-                    return i
-
+                    if trace: g.trace('returns:\n\n%s\n\n' % s[start:end])
+                    return end
+            elif d.pattern:
+                # Skip to the next character that might change the scan.
+                m = d.pattern.search(s,i+1)
+                i = m.start() if m else len(s)
             else: i += 1
             assert progress < i
 
+        if stack and errors == self.errors:
+            for k,level2 in stack:
+                d.blocks[k] = None,level2,scan
         self.error('no block: %s' % self.root.h)
         if 1:
             i,j = g.getLine(s,start)
@@ -1268,6 +1313,55 @@ class BaseScanner:
         else:
             if trace: g.trace('** no block')
         return start+1 # 2012/04/04: Ensure progress in caller.
+    #@+node:agent.20261018210327.1: *5* BaseScanner.getBlockPattern
+    def getBlockPattern(self,delim1,delim2):
+        '''
+        Return a regex matching all characters that might start a newline,
+        comment, string or delim in skipBlock, or None if that set of
+        characters is unknown.
+        '''
+        strings = self.getStringStarts()
+        if strings is None or not self.isBaseMethod('startsComment'):
+            return None
+        chars = ['\n','\r',delim1[0],delim2[0]]
+        chars.extend(strings)
+        for delim in (
+            self.lineCommentDelim,self.lineCommentDelim2,
+            self.blockCommentDelim1,self.blockCommentDelim1_2,
+        ):
+            if delim: chars.append(delim[0])
+        return re.compile('[%s]' % ''.join([re.escape(z) for z in sorted(set(chars))]))
+
+    def getStringStarts(self):
+        '''
+        Return a string containing all characters that can start a string,
+        or None if not known. Subclasses that override startsString may
+        override this.
+        '''
+        return '"\'' if self.isBaseMethod('startsString') else None
+    #@+node:agent.20261018205543.1: *5* BaseScanner.skipKnownBlock
+    def skipKnownBlock(self,s,d,i,match2,delim2):
+        '''
+        Skip the block starting at s[i], found in a previous scan of s.
+
+        Give the underindentation errors that rescanning the block would give.
+        Return the value skipBlock returns, or None if the block has no
+        matching delim.
+        '''
+        startIndent = self.startSigIndent
+        end,level,scan = d.blocks.get(i)
+        n1 = bisect.bisect_right(scan.lines,i)
+        n2 = len(scan.lines) if end is None else bisect.bisect_left(scan.lines,end)
+        if n1 < n2 and min(scan.indents[n1:n2]) < startIndent:
+            for n in range(n1,n2):
+                if scan.indents[n] < startIndent:
+                    j = scan.lines[n]
+                    if scan.levels[n] - level == 1 and match2(s,j,delim2):
+                        pass
+                    elif j not in self.errorLines:
+                        self.errorLines.append(j)
+                        self.underindentedLine(g.get_line(s,j))
+        return end
     #@+node:ekr.20140727075002.18241: *4* BaseScanner.skipCodeBlock
     def skipCodeBlock (self,s,i,kind):
         '''Skip the code block in a function or class definition.'''
@@ -1629,6 +1723,7 @@ class BaseScanner:
         # Init the error/status info.
         self.errors = 0
         self.errorLines = []
+        self.blockDict = {}
         self.mismatchWarningGiven = False
         changed = c.isChanged()
         # Use @verbatim to escape section references (but not for @auto).
@@ -1750,6 +1845,70 @@ class BaseScanner:
             i += 1
         return i,s[j:i]
 
+    #@+node:agent.20261018210156.1: *3* BaseScanner.getTokenPattern & helpers
+    def getTokenPattern(self):
+        '''
+        Return a compiled regex that splits text into the same tokens as
+        tokenize's hand-written scan, or None if the subclass's scanning
+        methods can't be described by a regex.
+        '''
+        if self.tokenPattern is None:
+            self.tokenPattern = self.computeTokenPattern() or False
+        return self.tokenPattern or None
+
+    def computeTokenPattern(self):
+        '''Return the compiled pattern for getTokenPattern, or None.'''
+        for name in (
+            'skipCommentToken','skipIdToken','skipNewlineToken',
+            'skipOtherToken','skipStringToken','skipWsToken',
+            'startsComment','skipComment','skipBlockComment',
+            'startsId','skipId',
+        ):
+            if not self.isBaseMethod(name):
+                return None
+        strings = self.getStringPattern()
+        if not strings:
+            return None
+        comments = []
+        for delim in (self.lineCommentDelim,self.lineCommentDelim2):
+            if delim:
+                comments.append(re.escape(delim) + r'[^\n]*')
+        for delim1,delim2 in (
+            (self.blockCommentDelim1,self.blockCommentDelim2),
+            (self.blockCommentDelim1_2,self.blockCommentDelim2_2),
+        ):
+            if delim1:
+                comments.append(r'%s[\s\S]*?%s' % (re.escape(delim1),re.escape(delim2)))
+        # A run-on block comment: tokenize reports the error itself.
+        runon = '|'.join([re.escape(z) for z in
+            (self.blockCommentDelim1,self.blockCommentDelim1_2) if z])
+        extra = re.escape(g.toUnicode(self.extraIdChars or ''))
+        aList = [
+            r'(?P<nl>\n)',
+            r'(?P<ws>[ \t][^\S\n]*)',
+            comments and r'(?P<comment>%s)' % '|'.join(comments),
+            runon and r'(?P<runon>%s)' % runon,
+            r'(?P<string>%s)' % strings,
+            r'(?P<id>\w[\w%s]*)' % extra if extra else r'(?P<id>\w+)',
+            r'(?P<other>[\s\S])',
+        ]
+        return re.compile('|'.join([z for z in aList if z]),re.UNICODE)
+
+    def getStringPattern(self):
+        '''
+        Return the regex matching strings as startsString and skipString do,
+        or None. Subclasses that override those methods may override this.
+        '''
+        if self.isBaseMethod('startsString') and self.isBaseMethod('skipString'):
+            return self.stringPattern
+        else:
+            return None
+
+    def isBaseMethod(self,name):
+        '''Return True if the subclass does not override BaseScanner.name.'''
+        f = getattr(self.__class__,name)
+        f = getattr(f,'__func__',f) # Python 2 unbound methods.
+        return f is BaseScanner.__dict__.get(name)
     #@+node:ekr.20140727075002.18263: *3* BaseScanner.tokenize
     def tokenize (self,s):
 
@@ -1759,7 +1918,20 @@ class BaseScanner:
 
         This is used only to verify the imported text.
         '''
-
+        pattern = self.getTokenPattern()
+        if pattern:
+            result,line_number = [],0
+            for m in pattern.finditer(s):
+                kind,val = m.lastgroup,m.group()
+                if kind == 'runon':
+                    break # Rescan by hand to report the error.
+                result.append((kind,val,line_number),)
+                if kind == 'nl':
+                    line_number += 1
+                elif kind in ('comment','string'):
+                    line_number += val.count('\n')
+            else:
+                return result
         result,i,line_number = [],0,0
         while i < len(s):
             progress = j = i
@@ -69,6 +69,10 @@ class JavaScriptScanner (basescanner.BaseScanner):
             return s[i-1] in (',([{=')
         else:
             return False
+    #@+node:agent.20261018210328.1: *3* getStringStarts (JavaScriptScanner)
+    def getStringStarts(self):
+        '''Return all characters that can start a JavaScript string.'''
+        return '"\'/'
     #@+node:ekr.20140723122936.18053: *3* skipString (JavaScriptScanner)
     def skipString (self,s,i):
         '''
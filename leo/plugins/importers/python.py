@@ -1,6 +1,7 @@
 #@+leo-ver=5-thin
 #@+node:ekr.20140723122936.18149: * @file importers/python.py
 '''The @auto importer for Python.'''
+import re
 import leo.core.leoGlobals as g
 import leo.plugins.importers.basescanner as basescanner
 #@+others
@@ -23,6 +24,8 @@ class PythonScanner (basescanner.BaseScanner):
             # Suppress the check for the block delim.
             # The check is done in skipSigTail.
         self.strict = True
+        self.codeBlockPattern = re.compile(r'[\n\r#"\'\[\]{}()]')
+            # Matches all characters that skipCodeBlock must examine.
     #@+node:ekr.20140723122936.18091: *3* adjustDefStart (PythonScanner)
     def adjustDefStart (self,s,i):
         '''A hook to allow the Python importer to adjust the 
@@ -139,7 +142,10 @@ class PythonScanner (basescanner.BaseScanner):
             elif ch in ']})':
                 i += 1 ; parenCount -= 1
                 # g.trace('ch',ch,parenCount)
-            else: i += 1
+            else:
+                # Skip all characters that can't change the scan.
+                m = self.codeBlockPattern.search(s,i)
+                i = m.start() if m else len(s)
             assert(progress < i)
 
         # The actual end of the block.
@@ -241,6 +247,13 @@ class PythonScanner (basescanner.BaseScanner):
 
         # Returns len(s) on unterminated string.
         return g.skip_python_string(s,i,verbose=False)
+    #@+node:agent.20261018210156.2: *3* getStringPattern (PythonScanner)
+    def getStringPattern(self):
+        '''Return the regex matching strings as skipString does.'''
+        # g.skip_python_string: triple-quoted strings end at the next delim.
+        return (
+            r"'''[\s\S]*?(?:'''|\Z)|" + r'"""[\s\S]*?(?:"""|\Z)|' +
+            self.stringPattern)
     #@-others
 #@-others
 importer_dict = {
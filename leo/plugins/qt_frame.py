@@ -3777,8 +3777,7 @@ class LeoQTreeWidget(QtWidgets.QTreeWidget):
         p = None
         item = self.itemAt(ev.pos())
         if item:
-            itemHash = tree.itemHash(item)
-            p = tree.item2positionDict.get(itemHash)
+            p = tree.item2position(item)
         if not p:
             # Fix bug: https://github.com/leo-editor/leo-editor/issues/59
             # Drop at last node.
@@ -7,6 +7,7 @@
 
 #@+<< imports >>
 #@+node:ekr.20140907131341.18709: ** << imports >> (qt_tree.py)
+import bisect
 import leo.core.leoGlobals as g
 import leo.core.leoFrame as leoFrame
 import leo.core.leoNodes as leoNodes
@@ -48,6 +49,16 @@ class LeoQtTree(leoFrame.LeoTree):
         self.position2itemDict = {}
         self.vnode2itemsDict = {} # values are lists of items.
         self.editWidgetsDict = {} # keys are native edit widgets, values are wrappers.
+        self.reusableItemsDict = {} # The item2vnodeDict of the previous redraw.
+        # Long sibling lists are drawn lazily. See qtree.drawLazyItems.
+        self.lazyDrawCount = 100 # Draw longer sibling lists lazily.
+        self.lazyListsDict = {}
+            # Keys are hashes of parent items (None for top-level items).
+            # Values are g.Bunches describing lazily drawn lists.
+        self.lazyParentsDict = {}
+            # Keys are keys of parent positions (None for top-level nodes).
+            # Values are the same bunches, for visible lists only.
+        self.reusableListsDict = {} # The lazyListsDict of the previous redraw.
         self.setConfigIvars()
         self.setEditPosition(None) # Set positions returned by LeoTree.editPosition()
         # Components.
@@ -73,6 +84,12 @@ class LeoQtTree(leoFrame.LeoTree):
         except Exception:
             pass
         w.setIconSize(QtCore.QSize(160,16))
+        w.setUniformRowHeights(True)
+            # Greatly speeds the layout of nodes with many children.
+        vScroll = w.verticalScrollBar()
+        vScroll.valueChanged.connect(self.drawVisibleItems)
+        vScroll.rangeChanged.connect(self.drawVisibleItems)
+            # The range changes when the tree is resized.
     #@+node:ekr.20110605121601.17866: *3* qtree.get_name
     def getName (self):
         '''Return the name of this widget: must start with "canvas".'''
@@ -167,6 +184,9 @@ class LeoQtTree(leoFrame.LeoTree):
             c.setCurrentPosition(p)
         self.redrawCount += 1
         if trace: t1 = g.getTime()
+        # Items of the previous redraw may be reused.
+        self.reusableItemsDict = self.item2vnodeDict
+        self.reusableListsDict = self.lazyListsDict
         self.initData()
         self.nodeDrawCount = 0
         try:
@@ -174,7 +194,10 @@ class LeoQtTree(leoFrame.LeoTree):
             self.drawTopTree(p)
         finally:
             self.redrawing = False
+            self.reusableItemsDict = {}
+            self.reusableListsDict = {}
         self.setItemForCurrentPosition(scroll=scroll)
+        self.drawVisibleItems()
         c.requestRedrawFlag= False
         if trace:
             theTime = g.timeSince(t1)
@@ -188,7 +211,6 @@ class LeoQtTree(leoFrame.LeoTree):
     #@+node:ekr.20110605121601.17874: *4* qtree.drawChildren
     def drawChildren (self,p,parent_item):
         '''Draw the children of p if they should be expanded.'''
-        c = self.c
         trace = False and not g.unitTesting
         # if trace: g.trace('children: %5s expanded: %5s %s childIndex: %s' % (
             # p.hasChildren(),p.isExpanded(),p.h,p._childIndex))
@@ -197,32 +219,303 @@ class LeoQtTree(leoFrame.LeoTree):
         if p.hasChildren():
             if p.isExpanded():
                 if trace: g.trace('expanded',p,p._childIndex)
+                self.drawSiblings(parent_item,p)
                 self.expandItem(parent_item)
-                child = p.firstChild()
-                while child:
-                    self.drawTree(child,parent_item)
-                    child.moveToNext()
             else:
-                # Draw the hidden children.
-                child = p.firstChild()
-                while child:
-                    self.drawNode(child,parent_item)
-                    child.moveToNext()
+                # Don't draw the hidden children.
+                # onItemExpanded draws them when the user expands the item.
+                if not self.keepHiddenItems(parent_item):
+                    parent_item.takeChildren()
+                parent_item.setChildIndicatorPolicy(
+                    QtWidgets.QTreeWidgetItem.ShowIndicator)
                 self.contractItem(parent_item)
         else:
+            parent_item.takeChildren()
+            parent_item.setChildIndicatorPolicy(
+                QtWidgets.QTreeWidgetItem.DontShowIndicatorWhenChildless)
             self.contractItem(parent_item)
+    #@+node:agent.20261018220502.1: *4* qtree.drawSiblings
+    def drawSiblings (self,parent_item,parent):
+        '''
+        Draw the children of parent as the children of parent_item.
+        If parent is None, draw the top-level nodes as top-level items.
+        '''
+        c = self.c
+        if parent:
+            n = len(parent.v.children)
+        else:
+            n = len(c.hiddenRootNode.children)
+        if n > self.lazyDrawCount:
+            self.drawLazyItems(parent_item,parent)
+        elif parent:
+            self.drawItems(parent_item,[z.copy() for z in parent.children()])
+        else:
+            self.drawItems(parent_item,[z.copy() for z in c.rootPosition().self_and_siblings()])
+    #@+node:agent.20261018204526.1: *4* qtree.drawItems & helpers
+    def drawItems (self,parent_item,aList):
+        '''
+        Draw the positions in aList, and their visible descendants, as the
+        children of parent_item, or as the top-level items if parent_item is None.
+
+        Items of the previous redraw are reused for unchanged nodes, so
+        inserting, deleting or moving nodes changes only the affected rows.
+        '''
+        w = self.treeWidget
+        old_items = self.childItems(parent_item)
+        items = self.findReusableItems(old_items,aList)
+        moved = self.removeItems(parent_item,old_items,items)
+        # Insert new and moved items in order, so i is always a valid index.
+        for i,p in enumerate(aList):
+            item = items[i]
+            if not item:
+                item = self.createTreeItem(p,parent_item,index=i)
+            elif id(item) in moved:
+                if parent_item:
+                    parent_item.insertChild(i,item)
+                else:
+                    w.insertTopLevelItem(i,item)
+            self.drawNode(p,item)
+            self.drawChildren(p,item)
+    #@+node:agent.20261018204526.2: *5* qtree.findReusableItems
+    def findReusableItems (self,old_items,aList):
+        '''
+        Return a list of items, one per position in aList: the item of the
+        previous redraw that drew the same vnode with the same headline, or None.
+        '''
+        d = {} # Keys are vnodes, values are lists of old items.
+        for item in old_items:
+            v = self.reusableItemsDict.get(self.itemHash(item))
+            if v:
+                d.setdefault(v,[]).append(item)
+        result = []
+        for p in aList:
+            aList2 = d.get(p.v)
+            if aList2 and self.getItemText(aList2[0]) == p.h:
+                result.append(aList2.pop(0))
+            else:
+                # New items call the visit-tree-item hook for the new headline.
+                result.append(None)
+        return result
+    #@+node:agent.20261018204526.3: *5* qtree.removeItems
+    def removeItems (self,parent_item,old_items,items):
+        '''
+        Remove the old items of parent_item that are not in items, and the
+        reused items that are out of order. Return the set of ids of the
+        reused items that drawItems must insert again.
+
+        The longest run of reused items that remain in order is never moved.
+        '''
+        w = self.treeWidget
+        n = {} # Keys are ids of reused items, values are their old indices.
+        for item in items:
+            if item:
+                n[id(item)] = None
+        for i,item in enumerate(old_items):
+            if id(item) in n:
+                n[id(item)] = i
+        # Find the longest increasing subsequence of old indices.
+        indices = [n[id(item)] for item in items if item]
+        tails,tailIndices,prev = [],[],[None]*len(indices)
+        for j,i in enumerate(indices):
+            k = bisect.bisect_left(tails,i)
+            if k: prev[j] = tailIndices[k-1]
+            if k == len(tails):
+                tails.append(i) ; tailIndices.append(j)
+            else:
+                tails[k] = i ; tailIndices[k] = j
+        keep = set()
+        j = tailIndices[-1] if tailIndices else None
+        while j is not None:
+            keep.add(indices[j])
+            j = prev[j]
+        # Remove all other items, starting at the end.
+        if not keep:
+            # Much faster than removing items one at a time.
+            if parent_item:
+                parent_item.takeChildren()
+            else:
+                w.clear()
+            old_items = []
+        for i in range(len(old_items)-1,-1,-1):
+            if i not in keep:
+                if parent_item:
+                    parent_item.takeChild(i)
+                else:
+                    w.takeTopLevelItem(i)
+        return set([z for z in n if n[z] not in keep])
+    #@+node:agent.20261018220502.2: *4* qtree.drawLazyItems & helpers
+    def drawLazyItems (self,parent_item,parent):
+        '''
+        Draw the children of parent, a long sibling list, as the children of
+        parent_item. If parent is None, draw the top-level nodes.
+
+        Every node gets an item, so the tree scrolls normally, but only the
+        items of expanded nodes are drawn now. drawVisibleItems and the item
+        getters draw the other items when they become visible or are needed.
+        Redrawing an unchanged list does not touch its items.
+        '''
+        c = self.c
+        if parent:
+            vnodes = list(parent.v.children)
+        else:
+            vnodes = list(c.hiddenRootNode.children)
+        key = self.itemHash(parent_item) if parent_item else None
+        old = self.reusableListsDict.get(key)
+        old_items = self.childItems(parent_item)
+        if old and old.vnodes == vnodes and len(old_items) == len(vnodes):
+            items = old_items
+        else:
+            items = self.updateLazyItems(parent_item,vnodes,old,old_items)
+        if parent:
+            stack = parent.stack + ((parent.v,parent._childIndex),)
+        else:
+            stack = ()
+        bunch = g.Bunch(hidden=False,parent_item=parent_item,stack=stack,vnodes=vnodes)
+        self.lazyListsDict[key] = bunch
+        self.lazyParentsDict[parent.key() if parent else None] = bunch
+        for i,item in enumerate(items):
+            v = vnodes[i]
+            if v.children and v.isExpanded():
+                p = self.lazyPosition(bunch,i)
+                if p.isExpanded():
+                    # The node's children are visible: draw it now.
+                    self.drawLazyItem(item,p)
+                    continue
+            if item.isExpanded():
+                self.contractItem(item)
+    #@+node:agent.20261018220502.3: *5* qtree.drawLazyItem
+    def drawLazyItem (self,item,p):
+        '''Completely draw item, p's item in a lazily drawn list.'''
+        # Set the lockout: this may be called outside of redraws.
+        redrawing = self.redrawing
+        try:
+            self.redrawing = True
+            try:
+                g.visit_tree_item(self.c,p,item)
+            except leoPlugins.TryNext:
+                pass
+            self.drawNode(p,item)
+            self.drawChildren(p,item)
+        finally:
+            self.redrawing = redrawing
+    #@+node:agent.20261018220502.4: *5* qtree.drawVisibleItems
+    def drawVisibleItems (self,*args):
+        '''
+        Completely draw the visible items of lazily drawn lists.
+        Called after each redraw and when the tree scrolls or is resized.
+        '''
+        if not self.lazyListsDict or self.redrawing:
+            return
+        w = self.treeWidget
+        height = w.viewport().height()
+        item = w.itemAt(0,0)
+        while item and w.visualItemRect(item).top() < height:
+            if self.itemHash(item) not in self.item2vnodeDict:
+                self.lazyItemPosition(item)
+            item = w.itemBelow(item)
+    #@+node:agent.20261018220502.5: *5* qtree.keepHiddenItems
+    def keepHiddenItems (self,parent_item):
+        '''
+        Keep the items of parent_item if they are a lazily drawn list that
+        has just been hidden, so drawLazyItems can reuse them when the list
+        is expanded again. Return True if the items were kept.
+        '''
+        key = self.itemHash(parent_item)
+        bunch = self.lazyListsDict.get(key) or self.reusableListsDict.get(key)
+        if bunch and parent_item.childCount() == len(bunch.vnodes):
+            bunch.hidden = True
+            self.lazyListsDict[key] = bunch
+            return True
+        return False
+    #@+node:agent.20261018220502.6: *5* qtree.lazyItemPosition & lazyPositionItem
+    def lazyItemPosition (self,item):
+        '''
+        If item is in a visible, lazily drawn list, completely draw the item
+        and return its position. Otherwise return None.
+        '''
+        parent_item = item.parent()
+        if parent_item:
+            bunch = self.lazyListsDict.get(self.itemHash(parent_item))
+        else:
+            bunch = self.lazyListsDict.get(None)
+        if not bunch or bunch.hidden:
+            return None
+        if parent_item:
+            i = parent_item.indexOfChild(item)
+        else:
+            i = self.treeWidget.indexOfTopLevelItem(item)
+        if i < 0 or i >= len(bunch.vnodes):
+            return None
+        p = self.lazyPosition(bunch,i)
+        self.drawLazyItem(item,p)
+        return p
+
+    def lazyPositionItem (self,p):
+        '''
+        If p's item is in a visible, lazily drawn list, completely draw the
+        item and return it. Otherwise return None.
+        '''
+        parent = p.parent()
+        bunch = self.lazyParentsDict.get(parent.key() if parent else None)
+        i = p._childIndex
+        if not bunch or i >= len(bunch.vnodes) or bunch.vnodes[i] is not p.v:
+            return None
+        if bunch.parent_item:
+            item = bunch.parent_item.child(i)
+        else:
+            item = self.treeWidget.topLevelItem(i)
+        if item:
+            self.drawLazyItem(item,self.lazyPosition(bunch,i))
+        return item
+    #@+node:agent.20261018220502.7: *5* qtree.lazyPosition
+    def lazyPosition (self,bunch,i):
+        '''Return the position of the i'th node of a lazily drawn list.'''
+        return leoNodes.Position(bunch.vnodes[i],i,bunch.stack)
+    #@+node:agent.20261018220502.8: *5* qtree.updateLazyItems
+    def updateLazyItems (self,parent_item,vnodes,old,old_items):
+        '''
+        Make the child items of parent_item match vnodes, reusing the old
+        items of unchanged nodes. Return the list of items.
+        New items get only their headlines: drawLazyItem draws the rest.
+        '''
+        w = self.treeWidget
+        d = {} # Keys are vnodes, values are lists of old items.
+        if old and len(old.vnodes) == len(old_items):
+            for v,item in zip(old.vnodes,old_items):
+                d.setdefault(v,[]).append(item)
+        else:
+            for item in old_items:
+                v = self.reusableItemsDict.get(self.itemHash(item))
+                if v:
+                    d.setdefault(v,[]).append(item)
+        items = []
+        for v in vnodes:
+            aList = d.get(v)
+            items.append(aList.pop(0) if aList else None)
+        moved = self.removeItems(parent_item,old_items,items)
+        # Insert new and moved items in order, so i is always a valid index.
+        for i,v in enumerate(vnodes):
+            item = items[i]
+            if not item:
+                item = items[i] = QtWidgets.QTreeWidgetItem([v.h])
+                item.setFlags(item.flags() | QtCore.Qt.ItemIsEditable)
+            elif id(item) not in moved:
+                continue
+            if parent_item:
+                parent_item.insertChild(i,item)
+            else:
+                w.insertTopLevelItem(i,item)
+        return items
     #@+node:ekr.20110605121601.17875: *4* qtree.drawNode
-    def drawNode (self,p,parent_item):
-        '''Draw the node p.'''
+    def drawNode (self,p,item):
+        '''Draw p's headline and icon in item.'''
         trace = False
-        c = self.c 
         self.nodeDrawCount += 1
-        # Allocate the item.
-        item = self.createTreeItem(p,parent_item) 
         # Do this now, so self.isValidItem will be true in setItemIcon.
         self.rememberItem(p,item)
         # Set the headline and maybe the icon.
-        self.setItemText(item,p.h)
+        if self.getItemText(item) != p.h:
+            self.setItemText(item,p.h)
         if p:
             self.drawItemIcon(p,item)
         if trace: g.trace(self.traceItem(item))
@@ -230,40 +523,24 @@ class LeoQtTree(leoFrame.LeoTree):
     #@+node:ekr.20110605121601.17876: *4* qtree.drawTopTree
     def drawTopTree (self,p):
         '''Draw the tree rooted at p.'''
-        trace = False and not g.unitTesting
         c = self.c
+        if g.app.gui.isNullGui:
+            return
         hPos,vPos = self.getScroll()
-        self.clear()
         # Draw all top-level nodes and their visible descendants.
         if c.hoistStack:
             bunch = c.hoistStack[-1]
             p = bunch.p ; h = p.h
             if len(c.hoistStack) == 1 and h.startswith('@chapter') and p.hasChildren():
-                p = p.firstChild()
-                while p:
-                    self.drawTree(p)
-                    p.moveToNext()
+                self.drawSiblings(None,p)
             else:
-                self.drawTree(p)
+                self.drawItems(None,[p.copy()])
         else:
-            p = c.rootPosition()
-            if trace: g.trace(p)
-            while p:
-                self.drawTree(p)
-                p.moveToNext()
+            self.drawSiblings(None,None)
         # This method always retains previous scroll position.
         self.setHScroll(hPos)
         self.setVScroll(vPos)
         self.repaint()
-    #@+node:ekr.20110605121601.17877: *4* qtree.drawTree
-    def drawTree (self,p,parent_item=None):
-        
-        if g.app.gui.isNullGui:
-            return
-        # Draw the (visible) parent node.
-        item = self.drawNode(p,parent_item)
-        # Draw all the visible children.
-        self.drawChildren(p,parent_item=item)
     #@+node:ekr.20110605121601.17878: *4* qtree.initData
     def initData (self):
 
@@ -274,6 +551,8 @@ class LeoQtTree(leoFrame.LeoTree):
         self.position2itemDict = {}
         self.vnode2itemsDict = {}
         self.editWidgetsDict = {}
+        self.lazyListsDict = {}
+        self.lazyParentsDict = {}
     #@+node:ekr.20110605121601.17879: *4* qtree.rememberItem
     def rememberItem (self,p,item):
 
@@ -952,21 +1231,28 @@ class LeoQtTree(leoFrame.LeoTree):
                 self.updateVisibleIcons(child)
     #@+node:ekr.20110605121601.18414: ** qtree.Items
     #@+node:ekr.20110605121601.17943: *3*  qtree.item dict getters
+    # Items in lazily drawn lists are drawn completely when first used.
+    # vnode2items returns only completely drawn items.
+
     def itemHash(self,item):
         return '%s at %s' % (repr(item),str(id(item)))
 
     def item2position(self,item):
         itemHash = self.itemHash(item)
         p = self.item2positionDict.get(itemHash) # was item
+        if not p and self.lazyListsDict:
+            p = self.lazyItemPosition(item)
         # g.trace(item,p.h)
         return p
 
     def item2vnode (self,item):
-        itemHash = self.itemHash(item)
-        return self.item2vnodeDict.get(itemHash) # was item
+        p = self.item2position(item)
+        return p and p.v
 
     def position2item(self,p):
         item = self.position2itemDict.get(p.key())
+        if not item and self.lazyParentsDict:
+            item = self.lazyPositionItem(p)
         return item
 
     def vnode2items(self,v):
@@ -974,6 +1260,8 @@ class LeoQtTree(leoFrame.LeoTree):
 
     def isValidItem (self,item):
         itemHash = self.itemHash(item)
+        if itemHash not in self.item2vnodeDict and self.lazyListsDict:
+            self.lazyItemPosition(item)
         return itemHash in self.item2vnodeDict # was item.
     #@+node:ekr.20110605121601.18415: *3* qtree.childIndexOfItem
     def childIndexOfItem (self,item):
@@ -1064,13 +1352,24 @@ class LeoQtTree(leoFrame.LeoTree):
 
         return e,wrapper
     #@+node:ekr.20110605121601.18421: *3* qtree.createTreeItem
-    def createTreeItem(self,p,parent_item):
-
+    def createTreeItem(self,p,parent_item,index=None):
+        '''
+        Create an item for p as the child of parent_item, or as a top-level
+        item if parent_item is None. Insert the item at the given index, or
+        after the existing items if index is None.
+        '''
         trace = False and not g.unitTesting
 
         w = self.treeWidget
-        itemOrTree = parent_item or w
-        item = QtWidgets.QTreeWidgetItem(itemOrTree)
+        if index is None:
+            itemOrTree = parent_item or w
+            item = QtWidgets.QTreeWidgetItem(itemOrTree)
+        else:
+            item = QtWidgets.QTreeWidgetItem()
+            if parent_item:
+                parent_item.insertChild(index,item)
+            else:
+                w.insertTopLevelItem(index,item)
         item.setFlags(item.flags() | QtCore.Qt.ItemIsEditable)
 
         if trace: g.trace(id(item),p.h,g.callers(4))